@@ -1,17 +1,52 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 import geopandas as gpd
 import pandas as pd
+import asyncio
+import bisect
+import contextvars
+import functools
+import gzip
+import hashlib
+import hmac
+import io
 import json
+import logging
+import math
+import multiprocessing
 import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from typing import Dict, List, Optional
+from urllib.parse import quote
 import numpy as np
-from shapely.geometry import mapping
+import shapely
+from shapely.geometry import mapping, shape
 import warnings
 warnings.filterwarnings('ignore')
 
+# 日誌設定：LOG_LEVEL 控制等級；熱路徑上的訊息只取樣 LOG_SAMPLE_RATE 比例輸出
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.01'))
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger('taiwan_map')
+
+def log_sampled(level, message, *args):
+    """熱路徑上的日誌：啟用該等級時，只輸出 LOG_SAMPLE_RATE 比例的訊息"""
+    if logger.isEnabledFor(level) and random.random() < LOG_SAMPLE_RATE:
+        logger.log(level, message, *args)
+
 # 雙變數顏色矩陣定義 (9x9)
 # 行：薪資等級 (0-8)，列：人口密度等級 (0-8)
 # 薪資色系：紅色系，人口密度色系：藍色系
@@ -138,6 +173,59 @@ def blend_colors(color1, color2, weight1, weight2):
     
     return rgb_to_hex(mixed_rgb)
 
+def classify_levels(values, reference):
+    """
+    依同一縣市所有村里的數值（reference）將每個數值分為 0-8 級
+    
+    等級為第一個滿足「數值 <= 排序後第 int((等級 + 1) * n / 9) - 1 個參考值」的等級，都不滿足時為 8；
+    沒有數值（None）或沒有參考值時為 0
+    
+    Returns:
+        list: 與 values 對應的等級
+    """
+    levels = [0] * len(values)
+    present = [index for index, value in enumerate(values) if value is not None]
+    if not reference or not present:
+        return levels
+    ordered = np.sort(np.asarray(reference, dtype=float))
+    n = len(ordered)
+    thresholds = ordered[[int((level + 1) * n / 9) - 1 for level in range(9)]]
+    below = np.asarray([values[index] for index in present], dtype=float)[:, None] <= thresholds[None, :]
+    found = np.where(below.any(axis=1), below.argmax(axis=1), 8)
+    for index, level in zip(present, found.tolist()):
+        levels[index] = level
+    return levels
+
+def compute_level_ranges(values, label):
+    """
+    以 pd.qcut 將數值分為九等分，返回每個等級的最小與最大值（圖例使用）
+    
+    等級不足 9 個時以 min/max 為 0 的等級補齊；分級失敗時返回 9 個空的等級，沒有數值時返回空列表
+    """
+    if not values:
+        return []
+    try:
+        levels = [int(level) for level in pd.qcut(values, q=9, labels=False, duplicates='drop')]
+        
+        # 確保長度匹配
+        if len(levels) != len(values):
+            logger.warning("%s等級數量 %d 與數值數量 %d 不匹配", label, len(levels), len(values))
+            levels = [0] * len(values)
+        
+        ranges = []
+        for level in sorted(set(levels)):
+            level_values = [values[j] for j, l in enumerate(levels) if l == level]
+            if level_values:
+                ranges.append({'level': level, 'min': min(level_values), 'max': max(level_values)})
+        
+        # 確保有9個等級（補齊缺失的等級）
+        while len(ranges) < 9:
+            ranges.append({'level': len(ranges), 'min': 0, 'max': 0})
+        return ranges
+    except Exception as e:
+        logger.warning("%s分級計算錯誤: %s", label, e)
+        return [{'level': i, 'min': 0, 'max': 0} for i in range(9)]
+
 print("正在初始化 FastAPI 應用程式...")
 
 app = FastAPI(title="台灣地圖 API", version="1.0.0")
@@ -153,61 +241,115 @@ app.add_middleware(
 
 # 資料路徑配置
 BASE_DIR = Path(__file__).parent.parent
-COUNTY_GEOJSON_PATH = BASE_DIR / "taiwan_country_border" / "taiwan_country_border.geojson"
-VILLAGE_GEOJSON_PATH = BASE_DIR / "taiwan_village_border" / "counties_villages_standardized.geojson"
-SALARY_DATA_DIR = BASE_DIR / "salary-gh-pages" / "data" / "csv"
-POPULATION_DATA_DIR = BASE_DIR / "taiwan_population_data"
-CLINIC_DATA_PATH = BASE_DIR / "taiwan_clinic_site" / "TAIWAN CLINIC SITE_FINAL_20231231.csv"
+# 資料目錄可用 DATA_BASE_DIR 覆寫（例如指向 benchmarks/synthetic_data.py 產生的合成資料）
+DATA_DIR = Path(os.getenv('DATA_BASE_DIR') or BASE_DIR)
+COUNTY_GEOJSON_PATH = DATA_DIR / "taiwan_country_border" / "taiwan_country_border.geojson"
+VILLAGE_GEOJSON_PATH = DATA_DIR / "taiwan_village_border" / "counties_villages_standardized.geojson"
+SALARY_DATA_DIR = DATA_DIR / "salary-gh-pages" / "data" / "csv"
+# 健保（全民健康保險）與勞保（勞工保險，含就業保險）的投保金額分級表
+INSURANCE_TABLE_PATHS = {
+    'nhi': DATA_DIR / "salary-gh-pages" / "data" / "nhi.json",
+    'bli': DATA_DIR / "salary-gh-pages" / "data" / "bli.json",
+}
+POPULATION_DATA_DIR = DATA_DIR / "taiwan_population_data"
+CLINIC_DATA_PATH = DATA_DIR / "taiwan_clinic_site" / "TAIWAN CLINIC SITE_FINAL_20231231.csv"
+# 行政區名稱對照表（別名 -> 標準名稱），隨程式碼一起發布
+NAME_MAPPING_PATH = BASE_DIR / "name_mapping_reference.json"
 
 print(f"Running in environment: {'production' if os.getenv('RAILWAY_ENVIRONMENT') else 'development'}")
 print(f"BASE_DIR: {BASE_DIR}")
 print(f"Files in BASE_DIR: {list(BASE_DIR.glob('*'))}")
 
-print(f"BASE_DIR: {BASE_DIR}")
+print(f"DATA_DIR: {DATA_DIR}")
 print(f"COUNTY_GEOJSON_PATH: {COUNTY_GEOJSON_PATH}")
 print(f"VILLAGE_GEOJSON_PATH: {VILLAGE_GEOJSON_PATH}")
 print(f"SALARY_DATA_DIR: {SALARY_DATA_DIR}")
 
-# 全域變數儲存處理後的資料
-county_data = None
-village_data = None
-salary_data = None
-population_data = None
-village_salary_mapping = None
-village_population_mapping = None
-clinic_data = None
+# 多 worker 共享資料目錄：設定後，處理後的資料只建置一次並寫成可記憶體映射的欄式檔案，
+# 各 uvicorn worker 以唯讀方式映射同一份檔案，不必各自重新載入與處理
+SHARED_DATA_DIR = os.getenv('SHARED_DATA_DIR')
+SHARED_DATA_FORMAT_VERSION = 8
 
+# 載入時將縣市、村里與鄉鎮市區的座標對齊的格網大小（度），1e-6 度約 0.1 公尺，對網頁地圖已足夠；0 表示不對齊
+GEOMETRY_GRID_SIZE = float(os.getenv('GEOMETRY_GRID_SIZE', '1e-6'))
+# 幾何前處理（整理、中心點、面積與鄉鎮市區合併）依縣市分區後在最多 GEOMETRY_WORKERS 個行程中平行處理，1 表示不使用行程池；
+# 行程啟動需重新匯入本模組，總頂點數少於 GEOMETRY_POOL_MIN_VERTICES 時直接在目前的行程處理
+GEOMETRY_WORKERS = int(os.getenv('GEOMETRY_WORKERS', str(os.cpu_count() or 1)))
+GEOMETRY_POOL_MIN_VERTICES = int(os.getenv('GEOMETRY_POOL_MIN_VERTICES', '500000'))
 
+# CPU 密集的請求處理在有限大小的執行緒池中進行，避免阻塞事件迴圈（/api/health 等請求不受影響）
+# CPU_OFFLOAD=0 時改回直接在事件迴圈中執行（用於效能比較）
+CPU_OFFLOAD = os.getenv('CPU_OFFLOAD', '1') != '0'
+CPU_WORKERS = int(os.getenv('CPU_WORKERS', str(min(4, os.cpu_count() or 1))))
+# 准入控制：同時建置的回應數不超過 CPU_WORKERS，單一路由最多佔用 ADMISSION_ROUTE_LIMIT 個（預設保留一個給其他路由）；
+# 其餘請求在最多 ADMISSION_QUEUE_MAX 個的佇列中依預估成本排序等待，預估等待超過 ADMISSION_MAX_WAIT 秒時立即回應 503
+ADMISSION_ROUTE_LIMIT = int(os.getenv('ADMISSION_ROUTE_LIMIT', str(max(1, CPU_WORKERS - 1))))
+ADMISSION_QUEUE_MAX = int(os.getenv('ADMISSION_QUEUE_MAX', '64'))
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', '5'))
+# 快取預熱：資料載入後在背景依熱門程度預先建置各縣市的回應，WARMUP=0 停用
+# 熱門程度（各路由與縣市的請求次數）定期寫入 WARMUP_POPULARITY_PATH，下次啟動（或其他執行個體）沿用
+WARMUP_ENABLED = os.getenv('WARMUP', '1') != '0'
+WARMUP_POPULARITY_PATH = os.getenv('WARMUP_POPULARITY_PATH')
+WARMUP_SAVE_INTERVAL = float(os.getenv('WARMUP_SAVE_INTERVAL', '300'))
+# 已完成回應的快取上限（MB），0 表示停用
+RESPONSE_CACHE_MAX_BYTES = int(float(os.getenv('RESPONSE_CACHE_MB', '64')) * 1024 * 1024)
+# 大於此大小的 JSON 回應以 gzip 壓縮（壓縮結果與原始內容一起快取）
+GZIP_MIN_BYTES = int(os.getenv('GZIP_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '6'))
 
-def calculate_area_km2(gdf):
-    """
-    計算 GeoDataFrame 中每個幾何的面積（平方公里）
-    使用適合台灣的投影座標系統 TWD97 TM2 (EPSG:3826)
+# 資料檔案監看間隔（秒）：輸入檔案變更時自動在背景重新載入，0 表示停用
+DATA_WATCH_INTERVAL = float(os.getenv('DATA_WATCH_INTERVAL', '0'))
+# 管理端點（POST /api/admin/reload）的權杖，未設定時停用管理端點
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+# 單一請求的取樣分析：請求帶 X-Profile: 1 標頭（或 profile=1 參數）與正確的 X-Admin-Token 時，
+# 其中 PROFILE_SAMPLE_RATE 比例的請求每隔 PROFILE_INTERVAL_MS 毫秒擷取一次回應建置執行緒的呼叫堆疊，
+# 最近 PROFILE_BUFFER_SIZE 筆保留在記憶體中；權杖不符或未設定 ADMIN_TOKEN 時忽略分析要求、照常回應
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '1'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_BUFFER_SIZE = int(os.getenv('PROFILE_BUFFER_SIZE', '20'))
+
+# 目前的資料快照（DataSnapshot），所有處理後的資料都由此取得；重新載入時整個替換
+data_snapshot = None
+reload_lock = threading.Lock()
+reload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='data-reload')
+reload_status = {
+    'state': 'idle',  # idle / running
+    'trigger': None,
+    'last_started': None,
+    'last_finished': None,
+    'last_result': None,  # updated / unchanged / failed
+    'last_rebuilt': [],
+    'last_error': None,
+    'counts': {'updated': 0, 'unchanged': 0, 'failed': 0}
+}
+
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix='cpu-worker')
+inflight_requests = {}  # 請求鍵值 -> 進行中的 Future（相同請求合併為一次運算）
+response_cache = OrderedDict()  # 請求鍵值 -> 已序列化（及壓縮）的 JSON 回應（LRU）
+response_cache_bytes = 0
+response_stats = {'cache_hits': 0, 'cache_misses': 0, 'coalesced': 0}
+
+
+
+def calculate_area_km2(geometries):
     """
-    print("開始計算面積...")
+    計算 WGS84 幾何的面積（平方公里）
+    使用適合台灣的投影座標系統 TWD97 TM2 (EPSG:3826)，無法使用時改用台灣地區的等面積投影
     
-    # 確保原始資料是 EPSG:4326 (WGS84)
-    if gdf.crs != 'EPSG:4326':
-        print(f"警告：資料CRS不是EPSG:4326，當前為: {gdf.crs}")
-        gdf = gdf.to_crs('EPSG:4326')
-    
-    # 轉換到台灣適用的投影座標系統 (TWD97 TM2)
+    Returns:
+        ndarray: 與輸入相同順序的面積
+    """
+    geometries = gpd.GeoSeries(geometries, crs='EPSG:4326')
     try:
-        gdf_projected = gdf.to_crs('EPSG:3826')
-        print("成功轉換到 TWD97 TM2 (EPSG:3826)")
+        projected = geometries.to_crs('EPSG:3826')
     except Exception as e:
-        print(f"無法轉換到EPSG:3826，嘗試使用等面積投影: {e}")
-        # 如果TWD97不可用，使用適合台灣地區的等面積投影
+        logger.warning("無法轉換到EPSG:3826，改用台灣Albers等面積投影: %s", e)
         # 使用 Albers Equal Area Conic 投影，參數適合台灣
         taiwan_albers = "+proj=aea +lat_1=22 +lat_2=26 +lat_0=24 +lon_0=121 +x_0=0 +y_0=0 +datum=WGS84 +units=m +no_defs"
-        gdf_projected = gdf.to_crs(taiwan_albers)
-        print("使用台灣Albers等面積投影")
-    
-    # 計算面積（平方公里）
-    areas_km2 = gdf_projected.area / 1000000  # 從平方公尺轉換為平方公里
+        projected = geometries.to_crs(taiwan_albers)
     
-    print(f"面積計算完成，範圍：{areas_km2.min():.6f} - {areas_km2.max():.6f} km²")
-    return areas_km2
+    # 從平方公尺轉換為平方公里
+    return projected.area.to_numpy() / 1000000
 
 def standardize_specialties(specialty_str):
     """
@@ -245,142 +387,470 @@ def standardize_specialties(specialty_str):
     
     return standardized
 
-def load_and_process_data():
-    """載入並處理所有地理、薪資、人口和診所資料"""
-    global county_data, village_data, salary_data, population_data, village_salary_mapping, village_population_mapping, clinic_data
-    print("=== 開始載入資料 ===")
-    
-    print("正在載入地理資料...")
+# 薪資成長分析可用的指標與對應欄位
+SALARY_GROWTH_METRICS = {
+    'median': '中位數',
+    'average': '平均數',
+    'total': '綜合所得總額'
+}
+SALARY_GROWTH_RANK_FIELDS = ['cagr', 'pct_change', 'abs_change']
+
+def build_salary_matrix(salary_df):
+    """
+    將薪資資料轉為 村里 × 年份 的矩陣，每個指標一個 NumPy 陣列
     
-    # 載入縣市界資料
-    if COUNTY_GEOJSON_PATH.exists():
-        print("使用 json 模組直接讀取 GeoJSON...")
-        # 直接使用 json 模組讀取 GeoJSON，避免 fiona 版本問題
-        import json
-        with open(COUNTY_GEOJSON_PATH, 'r', encoding='utf-8') as f:
-            county_geojson = json.load(f)
-        county_gdf = gpd.GeoDataFrame.from_features(county_geojson['features'])
-        
-        # 所有檔案已統一為 WGS84 (EPSG:4326)，直接設定 CRS
-        print("設定縣市界為 WGS84 (EPSG:4326)")
-        county_gdf.set_crs(epsg=4326, inplace=True, allow_override=True)
-        print(f"縣市界 CRS: {county_gdf.crs}")
-        
-        # 計算代表性點 - 簡化版本，直接使用 WGS84 座標
-        def get_representative_point(geometry):
-            try:
-                # 首先嘗試使用 representative_point
-                rep_point = geometry.representative_point()
-                
-                # 檢查點是否在幾何內部
-                if geometry.contains(rep_point):
-                    print(f"使用 representative_point: ({rep_point.x:.6f}, {rep_point.y:.6f})")
-                    return rep_point
-                
-                # 如果不在內部，嘗試使用 centroid
-                centroid = geometry.centroid
-                if geometry.contains(centroid):
-                    print(f"使用 centroid: ({centroid.x:.6f}, {centroid.y:.6f})")
-                    return centroid
-                
-                # 對於 MultiPolygon，使用最大多邊形的 centroid
-                if geometry.geom_type == 'MultiPolygon':
-                    largest_polygon = max(geometry.geoms, key=lambda p: p.area)
-                    largest_centroid = largest_polygon.centroid
-                    print(f"使用最大多邊形的 centroid: ({largest_centroid.x:.6f}, {largest_centroid.y:.6f})")
-                    return largest_centroid
-                
-                # 所有方法都失敗
-                print(f"無法找到合適的內部點")
-                return None
-                
-            except Exception as e:
-                print(f"座標計算錯誤: {e}")
-                return None
+    Args:
+        salary_df: 合併所有年份的薪資 DataFrame（需包含 年份 欄位）
         
-        # 移除座標順序檢查函數，因為所有檔案已統一為 WGS84
+    Returns:
+        dict: keys（村里鍵值 DataFrame）、years（年份陣列）、matrices（指標 -> 二維陣列，缺值為 NaN）
+    """
+    key_index = pd.MultiIndex.from_frame(salary_df[['縣市', '鄉鎮市區', '村里']].astype(str))
+    village_codes, village_keys = pd.factorize(key_index)
+    years = np.sort(salary_df['年份'].unique())
+    year_codes = np.searchsorted(years, salary_df['年份'].to_numpy())
+    
+    matrices = {}
+    for metric, column in SALARY_GROWTH_METRICS.items():
+        matrix = np.full((len(village_keys), len(years)), np.nan)
+        matrix[village_codes, year_codes] = pd.to_numeric(salary_df[column], errors='coerce').to_numpy(dtype=float)
+        matrices[metric] = matrix
+    
+    keys = village_keys.to_frame(index=False, name=['縣市', '鄉鎮市區', '村里'])
+    return {
+        'counties': keys['縣市'].to_numpy(),
+        'districts': keys['鄉鎮市區'].to_numpy(),
+        'villages': keys['村里'].to_numpy(),
+        'years': years,
+        'matrices': matrices
+    }
+
+def compute_salary_growth(matrix_data, start_year, end_year):
+    """
+    以向量化方式計算所有村里在兩個年份間的絕對變化、百分比變化與年複合成長率（CAGR）
+    
+    Returns:
+        dict: 指標 -> {start, end, abs_change, pct_change, cagr} 陣列
+    """
+    years = matrix_data['years']
+    start_idx = int(np.searchsorted(years, start_year))
+    end_idx = int(np.searchsorted(years, end_year))
+    span = end_year - start_year
+    
+    growth = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for metric, matrix in matrix_data['matrices'].items():
+            start_values = matrix[:, start_idx]
+            end_values = matrix[:, end_idx]
+            valid = (start_values > 0) & (end_values > 0)
+            growth[metric] = {
+                'start': start_values,
+                'end': end_values,
+                'abs_change': end_values - start_values,
+                'pct_change': np.where(valid, (end_values - start_values) / start_values * 100, np.nan),
+                'cagr': np.where(valid, np.power(end_values / start_values, 1.0 / span) - 1, np.nan) * 100
+            }
+    return growth
+
+def _downcast_numeric_lossless(series):
+    """
+    在不損失精度的前提下縮小數值欄位的型別
+    整數欄位縮為最小整數型別；數值皆為整數且小於 2^24 的浮點欄位改為 float32（可精確表示）
+    """
+    if pd.api.types.is_integer_dtype(series) and not isinstance(series.dtype, pd.CategoricalDtype):
+        return pd.to_numeric(series, downcast='integer')
+    if pd.api.types.is_float_dtype(series) and series.dtype != np.float32:
+        values = series.to_numpy()
+        finite = values[np.isfinite(values)]
+        if finite.size and np.all(finite == np.round(finite)) and np.abs(finite).max() < 2 ** 24:
+            return series.astype(np.float32)
+    return series
+
+def compact_dataframe(df, category_threshold=0.5):
+    """
+    縮減 DataFrame 的記憶體用量（原地修改並返回）
+    - 重複值多的字串欄位（如 縣市、鄉鎮市區、村里）轉為 categorical
+    - 其餘字串欄位（如 機構名稱、地址）改用 Arrow 字串儲存
+    - 數值欄位無損縮小型別
+    """
+    for column in df.columns:
+        if column == 'geometry':
+            continue
+        series = df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            continue
+        if pd.api.types.is_string_dtype(series):
+            non_null = series.dropna()
+            if non_null.empty or not non_null.map(type).eq(str).all():
+                continue  # 非純字串欄位（例如科別集合）維持原樣
+            if series.nunique() <= len(series) * category_threshold:
+                df[column] = series.astype('category')
+            elif series.dtype == object:
+                df[column] = series.astype('string[pyarrow]')
+        else:
+            df[column] = _downcast_numeric_lossless(series)
+    return df
+
+def _intern_specialty_sets(series):
+    """將科別集合轉為共用的 frozenset，相同組合只保留一個物件"""
+    interned = {}
+    return series.map(lambda specialties: interned.setdefault(frozenset(specialties), frozenset(specialties)))
+
+class StageTimer:
+    """依序記錄各處理階段的耗時（秒），每次 mark 記錄距離上一次 mark 的時間"""
+    
+    def __init__(self, timings):
+        self.timings = timings
+        self.timings.clear()
+        self.started = self.last = time.perf_counter()
+    
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = now - self.last
+        self.last = now
+    
+    def finish(self):
+        self.timings['total'] = time.perf_counter() - self.started
+
+class DataSnapshot:
+    """
+    一份完整的資料快照：所有資料集、索引與快取都屬於同一個快照
+    
+    快照建置完成後不再修改；重新載入時建立新的快照（未變更的資料集與舊快照共用），
+    再以單一指派替換 data_snapshot，處理常式在請求開始時取得一次快照並全程使用，
+    因此進行中的請求不會看到新舊資料混合
+    """
+    
+    FIELDS = ('county_data', 'village_data', 'district_data', 'salary_data', 'population_data', 'population_history',
+              'clinic_data', 'salary_matrix', 'insurance_brackets')
+    
+    def __init__(self, source, signatures, stage_timings, **datasets):
+        for field in self.FIELDS:
+            setattr(self, field, datasets[field])
+        self.source = source  # 'processed'（本程序處理）或 'shared'（映射共享檔案）
+        self.signatures = signatures  # 資料集名稱 -> 輸入檔案簽章
+        self.stage_timings = stage_timings  # 建置各階段耗時（秒）
+        self.salary_growth_cache = {}  # 薪資成長指標快取（依起訖年份），隨快照一起替換
+        self.clinic_gap_cache = {}  # 村里診所供需指標快取（依服務半徑），隨快照一起替換
+        self.hex_grid_cache = {}  # 六角形網格與其彙總指標（依網格大小），隨快照一起替換
+        # 由資料集推導的索引（build_derived_indexes），共享資料模式下由共享目錄映射（attach_derived_indexes）
+        self.village_registry = None  # 標準村里編號（VillageRegistry）
+        self.village_indicators = None  # 村里 ID -> 最新薪資中位數、人口數、人口密度
+        self.district_indicators = None  # 鄉鎮市區（district_data 列）的人口加權薪資、總人口、人口密度與診所數
+        self.summary_tables = None  # 縣市與全台的薪資（各年度）、人口密度與每萬人診所數統計摘要
+        self.search_index = None  # 村里與診所的搜尋索引
+        self.clinic_index = None  # 診所的空間索引（EPSG:3826）
+        self.village_locator = None  # 座標查詢村里的 STRtree
+        self.version = 0
+        self.loaded_at = time.time()
+    
+    def datasets(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+# 可個別重新載入的資料集，以及各自產生的欄位
+DATASET_FIELDS = {
+    'county': ('county_data',),
+    'village': ('village_data', 'district_data'),
+    'salary': ('salary_data', 'salary_matrix'),
+    'population': ('population_data', 'population_history'),
+    'clinic': ('clinic_data',),
+    'insurance': ('insurance_brackets',),
+}
+# 資料集之間的相依（重建前者時後者也要重建）；人口密度改在快照建置時以村里 ID 合併面積計算，目前沒有相依
+DATASET_DEPENDENCIES = {}
+
+def get_representative_point(geometry):
+    """計算位於幾何內部的代表點（直接使用 WGS84 座標），找不到時返回 None"""
+    try:
+        # 首先嘗試使用 representative_point
+        rep_point = geometry.representative_point()
         
-        # 使用更安全的方式處理幾何資料
-        representative_points = []
-        center_lats = []
-        center_lons = []
+        # 檢查點是否在幾何內部
+        if geometry.contains(rep_point):
+            logger.debug("使用 representative_point: (%.6f, %.6f)", rep_point.x, rep_point.y)
+            return rep_point
         
-        for geometry in county_gdf['geometry']:
-            rep_point = get_representative_point(geometry)
-            if rep_point is not None:
-                representative_points.append(rep_point)
-                lat = rep_point.y
-                lon = rep_point.x
-                center_lats.append(lat)
-                center_lons.append(lon)
-            else:
-                print("跳過無法計算合適座標的縣市")
-                representative_points.append(None)
-                center_lats.append(None)
-                center_lons.append(None)
+        # 如果不在內部，嘗試使用 centroid
+        centroid = geometry.centroid
+        if geometry.contains(centroid):
+            logger.debug("使用 centroid: (%.6f, %.6f)", centroid.x, centroid.y)
+            return centroid
         
-        county_gdf['representative_point'] = representative_points
-        county_gdf['center_lat'] = center_lats
-        county_gdf['center_lon'] = center_lons
+        # 對於 MultiPolygon，使用最大多邊形的 centroid
+        if geometry.geom_type == 'MultiPolygon':
+            largest_polygon = max(geometry.geoms, key=lambda p: p.area)
+            largest_centroid = largest_polygon.centroid
+            logger.debug("使用最大多邊形的 centroid: (%.6f, %.6f)", largest_centroid.x, largest_centroid.y)
+            return largest_centroid
         
-        county_data = county_gdf
-        print(f"已載入 {len(county_data)} 個縣市")
+        # 所有方法都失敗
+        logger.warning("無法找到合適的內部點")
+        return None
+    
+    except Exception as e:
+        logger.warning("座標計算錯誤: %s", e)
+        return None
+
+def _polygonal_part(geometry):
+    """make_valid 可能產生含線或點的 GeometryCollection，只保留面的部分（沒有面時保留原幾何）"""
+    if geometry.geom_type in ('Polygon', 'MultiPolygon'):
+        return geometry
+    parts = [part for part in shapely.get_parts(geometry) if part.geom_type in ('Polygon', 'MultiPolygon')]
+    return shapely.union_all(parts) if parts else geometry
+
+def clean_geometries(values, grid_size):
+    """
+    整理幾何：修復無效的多邊形（make_valid）、移除重複頂點，並將座標對齊 grid_size 格網
+    
+    之後的面積、中心點、空間索引與回應都使用整理後的幾何，請求時不必再處理無效的環，
+    序列化的座標也只有格網精度的位數
+    
+    Returns:
+        (幾何陣列, 統計)：統計為 修復數、整理前頂點數、整理後頂點數、仍無效的幾何數
+    """
+    present = ~shapely.is_missing(values)
+    vertices_before = int(shapely.get_num_coordinates(values).sum())
+    invalid = np.flatnonzero(present & ~shapely.is_valid(values))
+    if len(invalid):
+        values = values.copy()
+        values[invalid] = [_polygonal_part(geometry) for geometry in shapely.make_valid(values[invalid])]
+    values = shapely.remove_repeated_points(values)
+    if grid_size > 0:
+        snapped = shapely.set_precision(values, grid_size)
+        # 小於格網的多邊形對齊後會變成空幾何，保留未對齊的版本
+        collapsed = shapely.is_empty(snapped) & ~shapely.is_empty(values)
+        snapped[collapsed] = values[collapsed]
+        values = snapped
+    vertices_after = int(shapely.get_num_coordinates(values).sum())
+    still_invalid = int((present & ~shapely.is_valid(values)).sum())
+    return values, np.array([len(invalid), vertices_before, vertices_after, still_invalid])
+
+def _report_cleaning(kind, stats):
+    """輸出幾何整理的統計"""
+    repaired, vertices_before, vertices_after, still_invalid = stats.tolist()
+    print(f"{kind}幾何整理：修復 {repaired} 個無效幾何，頂點數 {vertices_before} -> {vertices_after}"
+          f"（格網 {GEOMETRY_GRID_SIZE:g}°）" + (f"，仍有 {still_invalid} 個無效幾何" if still_invalid else ""))
+
+def _center_coordinates(geometries, kind):
+    """計算每個幾何的中心點緯度與經度清單"""
+    center_lats = []
+    center_lons = []
+    for geometry in geometries:
+        rep_point = get_representative_point(geometry)
+        if rep_point is not None:
+            center_lats.append(rep_point.y)
+            center_lons.append(rep_point.x)
+        else:
+            logger.warning("跳過無法計算合適座標的%s", kind)
+            center_lats.append(None)
+            center_lons.append(None)
+    return center_lats, center_lons
+
+def _dissolve_groups(geometries, group_ids):
+    """
+    依 group_ids 合併幾何，返回 (群組編號, 合併後的幾何)
+    
+    村里界對齊格網後相鄰的邊完全重合，可用快得多的 coverage union；村里界有重疊（結果無效）時改用一般的 union
+    """
+    # 名稱缺漏的村里（編號為 -1）不屬於任何群組
+    order = np.flatnonzero(group_ids >= 0)
+    order = order[np.argsort(group_ids[order], kind='stable')]
+    groups, starts = np.unique(group_ids[order], return_index=True)
+    if len(groups) == 0:
+        return groups, np.empty(0, dtype=object)
+    parts = np.split(geometries[order], starts[1:])
+    try:
+        dissolved = np.array([shapely.coverage_union_all(part) for part in parts], dtype=object)
+        if not shapely.is_valid(dissolved).all():
+            raise ValueError("coverage union 結果無效")
+    except (ValueError, shapely.errors.GEOSException) as e:
+        logger.info("改用一般的 union 合併: %s", e)
+        dissolved = np.array([shapely.union_all(part) for part in parts], dtype=object)
+    return groups, dissolved
+
+def _preprocess_geometry_partition(wkb, kind, grid_size, with_area=False, group_ids=None):
+    """
+    處理一個分區（通常為一個縣市）的幾何：整理、中心點，以及面積與依 group_ids 合併的鄉鎮市區
+    
+    可在行程池中執行：幾何以 WKB 傳入與傳回，不在行程之間序列化 Shapely 物件
+    
+    Returns:
+        dict: 'wkb'、'center_lat'、'center_lon'、'stats'，另有 'area_km2' 與 'groups'（群組編號、合併後幾何的 WKB、中心點與整理統計）
+    """
+    geometries, stats = clean_geometries(shapely.from_wkb(wkb), grid_size)
+    center_lats, center_lons = _center_coordinates(geometries, kind)
+    result = {'wkb': shapely.to_wkb(geometries), 'center_lat': center_lats, 'center_lon': center_lons, 'stats': stats}
+    if with_area:
+        result['area_km2'] = calculate_area_km2(geometries)
+    if group_ids is not None:
+        groups, dissolved = _dissolve_groups(geometries, group_ids)
+        # 合併時村里界線的交點可能不在格網上，再整理一次
+        dissolved, group_stats = clean_geometries(dissolved, grid_size)
+        group_lats, group_lons = _center_coordinates(dissolved, kind)
+        result['groups'] = {'ids': groups, 'wkb': shapely.to_wkb(dissolved), 'center_lat': group_lats,
+                            'center_lon': group_lons, 'stats': group_stats}
+    return result
+
+def _run_geometry_partitions(tasks, vertices):
+    """
+    執行幾何分區工作，結果順序與 tasks 相同
+    
+    分區多於一個、GEOMETRY_WORKERS 大於 1 且頂點數足夠時使用行程池（spawn，不複製目前行程的執行緒與快照），
+    頂點數多的分區先送出；行程池無法使用時改在目前的行程處理
+    """
+    workers = min(GEOMETRY_WORKERS, len(tasks))
+    if workers > 1 and sum(vertices) >= GEOMETRY_POOL_MIN_VERTICES:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = {position: pool.submit(_preprocess_geometry_partition, *tasks[position])
+                           for position in np.argsort(vertices, kind='stable')[::-1].tolist()}
+                return [futures[position].result() for position in range(len(tasks))]
+        except (OSError, BrokenProcessPool) as e:
+            logger.warning("幾何前處理的行程池無法使用，改在目前的行程處理: %s", e)
+    return [_preprocess_geometry_partition(*task) for task in tasks]
+
+def preprocess_geometries(geometries, partition_keys, kind, with_area=False, group_ids=None):
+    """
+    整理幾何並計算中心點（及面積、依 group_ids 合併），依 partition_keys（縣市）分區後平行處理，結果依原始順序合併
+    
+    group_ids 的每個群組必須落在同一個分區內（例如鄉鎮市區屬於單一縣市）
+    
+    Returns:
+        dict: 'geometry'（與輸入相同索引的 GeoSeries）、'center_lat'、'center_lon'，
+              另有 'area_km2' 與 'groups'（依群組編號排序的合併幾何 GeoSeries 與中心點）
+    """
+    values = np.asarray(geometries.values)
+    vertex_counts = shapely.get_num_coordinates(values)
+    pooled = GEOMETRY_WORKERS > 1 and vertex_counts.sum() >= GEOMETRY_POOL_MIN_VERTICES
+    if pooled:
+        codes = pd.factorize(np.asarray(partition_keys))[0]
+        partitions = [np.flatnonzero(codes == code) for code in range(codes.max() + 1)]
     else:
+        partitions = [np.arange(len(values))]
+    tasks = [(shapely.to_wkb(values[rows]), kind, GEOMETRY_GRID_SIZE, with_area,
+              None if group_ids is None else group_ids[rows]) for rows in partitions]
+    started = time.perf_counter()
+    results = _run_geometry_partitions(tasks, [int(vertex_counts[rows].sum()) for rows in partitions])
+    if pooled:
+        print(f"{kind}幾何前處理：{len(partitions)} 個分區，{min(GEOMETRY_WORKERS, len(partitions))} 個行程"
+              f"（{time.perf_counter() - started:.2f}s）")
+    
+    merged = {'geometry': np.empty(len(values), dtype=object), 'center_lat': np.empty(len(values)), 'center_lon': np.empty(len(values))}
+    if with_area:
+        merged['area_km2'] = np.empty(len(values))
+    for rows, result in zip(partitions, results):
+        merged['geometry'][rows] = shapely.from_wkb(result['wkb'])
+        merged['center_lat'][rows] = np.array(result['center_lat'], dtype=float)
+        merged['center_lon'][rows] = np.array(result['center_lon'], dtype=float)
+        if with_area:
+            merged['area_km2'][rows] = result['area_km2']
+    _report_cleaning(kind, sum(result['stats'] for result in results))
+    merged['geometry'] = gpd.GeoSeries(merged['geometry'], index=geometries.index, crs=geometries.crs)
+    
+    if group_ids is not None:
+        size = int(group_ids.max()) + 1 if len(group_ids) else 0
+        groups = {'geometry': np.empty(size, dtype=object), 'center_lat': np.empty(size), 'center_lon': np.empty(size)}
+        for result in results:
+            ids = result['groups']['ids']
+            groups['geometry'][ids] = shapely.from_wkb(result['groups']['wkb'])
+            groups['center_lat'][ids] = np.array(result['groups']['center_lat'], dtype=float)
+            groups['center_lon'][ids] = np.array(result['groups']['center_lon'], dtype=float)
+        groups['stats'] = sum(result['groups']['stats'] for result in results)
+        merged['groups'] = groups
+    return merged
+
+def load_county_geometry(stage_timer):
+    """載入縣市界資料並整理幾何"""
+    if not COUNTY_GEOJSON_PATH.exists():
         raise FileNotFoundError(f"找不到縣市界檔案: {COUNTY_GEOJSON_PATH}")
     
-    # 載入村里界資料
-    if VILLAGE_GEOJSON_PATH.exists():
-        print("使用 json 模組直接讀取 GeoJSON...")
-        # 直接使用 json 模組讀取 GeoJSON，避免 fiona 版本問題
-        import json
-        with open(VILLAGE_GEOJSON_PATH, 'r', encoding='utf-8') as f:
-            village_geojson = json.load(f)
-        village_gdf = gpd.GeoDataFrame.from_features(village_geojson['features'])
-        
-        # 所有檔案已統一為 WGS84 (EPSG:4326)，直接設定 CRS
-        print("設定村里界為 WGS84 (EPSG:4326)")
-        village_gdf.set_crs(epsg=4326, inplace=True, allow_override=True)
-        print(f"村里界 CRS: {village_gdf.crs}")
-        
-        # 計算村里的中心點
-        representative_points = []
-        center_lats = []
-        center_lons = []
-        
-        for geometry in village_gdf['geometry']:
-            rep_point = get_representative_point(geometry)
-            if rep_point is not None:
-                representative_points.append(rep_point)
-                lat = rep_point.y
-                lon = rep_point.x
-                center_lats.append(lat)
-                center_lons.append(lon)
-            else:
-                print("跳過無法計算合適座標的村里")
-                representative_points.append(None)
-                center_lats.append(None)
-                center_lons.append(None)
-        
-        village_gdf['representative_point'] = representative_points
-        village_gdf['center_lat'] = center_lats
-        village_gdf['center_lon'] = center_lons
-        
-        # 計算村里面積
-        print("正在計算村里面積...")
-        village_gdf['area_km2'] = calculate_area_km2(village_gdf)
-        
-        village_data = village_gdf
-        print(f"已載入 {len(village_data)} 個村里，面積範圍：{village_gdf['area_km2'].min():.6f} - {village_gdf['area_km2'].max():.6f} km²")
-    else:
+    print("使用 json 模組直接讀取 GeoJSON...")
+    # 直接使用 json 模組讀取 GeoJSON，避免 fiona 版本問題
+    with open(COUNTY_GEOJSON_PATH, 'r', encoding='utf-8') as f:
+        county_geojson = json.load(f)
+    county_gdf = gpd.GeoDataFrame.from_features(county_geojson['features'])
+    del county_geojson
+    
+    # 所有檔案已統一為 WGS84 (EPSG:4326)，直接設定 CRS
+    print("設定縣市界為 WGS84 (EPSG:4326)")
+    county_gdf.set_crs(epsg=4326, inplace=True, allow_override=True)
+    print(f"縣市界 CRS: {county_gdf.crs}")
+    # 每個縣市各為一個分區；只保留中心點座標，不另外儲存 Shapely 點物件
+    processed = preprocess_geometries(county_gdf.geometry, np.arange(len(county_gdf)), '縣市')
+    county_gdf['geometry'] = processed['geometry']
+    county_gdf['center_lat'], county_gdf['center_lon'] = processed['center_lat'], processed['center_lon']
+    
+    print(f"已載入 {len(county_gdf)} 個縣市")
+    stage_timer.mark('county_geometry')
+    return {'county_data': county_gdf}
+
+def load_village_geometry(stage_timer):
+    """載入村里界資料，整理幾何後計算中心點與面積"""
+    if not VILLAGE_GEOJSON_PATH.exists():
         raise FileNotFoundError(f"找不到村里界檔案: {VILLAGE_GEOJSON_PATH}")
     
-    # 載入薪資資料（使用標準化檔案）
+    print("使用 json 模組直接讀取 GeoJSON...")
+    # 直接使用 json 模組讀取 GeoJSON，避免 fiona 版本問題
+    with open(VILLAGE_GEOJSON_PATH, 'r', encoding='utf-8') as f:
+        village_geojson = json.load(f)
+    village_gdf = gpd.GeoDataFrame.from_features(village_geojson['features'])
+    del village_geojson
+    
+    # 所有檔案已統一為 WGS84 (EPSG:4326)，直接設定 CRS
+    print("設定村里界為 WGS84 (EPSG:4326)")
+    village_gdf.set_crs(epsg=4326, inplace=True, allow_override=True)
+    print(f"村里界 CRS: {village_gdf.crs}")
+    stage_timer.mark('village_geometry')
+    
+    # 整理幾何、計算中心點與面積，並依（縣市, 鄉鎮市區）合併鄉鎮市區界，依縣市分區處理
+    print("正在整理村里幾何、計算面積並合併鄉鎮市區界...")
+    district_groups = village_gdf.groupby(DISTRICT_KEYS, sort=True, observed=True)
+    processed = preprocess_geometries(village_gdf.geometry, village_gdf['COUNTYNAME'], '村里', with_area=True,
+                                      group_ids=district_groups.ngroup().to_numpy())
+    village_gdf['geometry'] = processed['geometry']
+    village_gdf['center_lat'], village_gdf['center_lon'] = processed['center_lat'], processed['center_lon']
+    village_gdf['area_km2'] = processed['area_km2']
+    stage_timer.mark('geometry_preprocess')
+    
+    village_data = compact_dataframe(village_gdf)
+    print(f"已載入 {len(village_data)} 個村里，面積範圍：{village_gdf['area_km2'].min():.6f} - {village_gdf['area_km2'].max():.6f} km²")
+    district_data = build_district_data(village_gdf, processed['groups'])
+    stage_timer.mark('district_data')
+    return {'village_data': village_data, 'district_data': district_data}
+
+DISTRICT_KEYS = ['COUNTYNAME', 'TOWNNAME']
+
+def build_district_data(village_gdf, groups):
+    """
+    以合併後的村里多邊形建立鄉鎮市區圖層，只在村里界載入時執行一次
+    
+    合併後村里之間的內部界線消失，面積為所屬村里面積的總和（與村里人口密度使用相同的面積）
+    
+    Args:
+        groups: preprocess_geometries 的 'groups'，依（縣市, 鄉鎮市區）排序的合併幾何與中心點
+    """
+    grouped = village_gdf.groupby(DISTRICT_KEYS, sort=True, observed=True)
+    district_gdf = grouped['area_km2'].sum().reset_index()
+    district_gdf.insert(len(DISTRICT_KEYS), 'geometry', groups['geometry'])
+    district_gdf = gpd.GeoDataFrame(district_gdf, geometry='geometry', crs=village_gdf.crs)
+    district_gdf['village_count'] = grouped.size().to_numpy(dtype=np.int32)
+    district_gdf['center_lat'], district_gdf['center_lon'] = groups['center_lat'], groups['center_lon']
+    _report_cleaning('鄉鎮市區', groups['stats'])
+    
+    village_vertices = int(shapely.get_num_coordinates(np.asarray(village_gdf.geometry.values)).sum())
+    district_vertices = int(shapely.get_num_coordinates(np.asarray(district_gdf.geometry.values)).sum())
+    print(f"已合併 {len(district_gdf)} 個鄉鎮市區，頂點數 {village_vertices} -> {district_vertices}")
+    return compact_dataframe(district_gdf)
+
+def get_salary_files():
+    """返回所有年度的標準化薪資檔案（依年份排序），新年度的檔案放入目錄即會被載入"""
+    salary_files = [path for path in SALARY_DATA_DIR.glob("*_standardized.csv") if path.stem.split('_')[0].isdigit()]
+    return sorted(salary_files, key=lambda path: int(path.stem.split('_')[0]))
+
+def load_salary(stage_timer):
+    """載入所有年度的薪資資料並建立薪資矩陣"""
     print("正在載入標準化薪資資料...")
-    salary_files = []
-    for year in range(2011, 2024):  # 2011-2023
-        file_path = SALARY_DATA_DIR / f"{year}_standardized.csv"
-        if file_path.exists():
-            salary_files.append(file_path)
+    salary_files = get_salary_files()
     
     if not salary_files:
         raise FileNotFoundError(f"找不到薪資資料檔案在: {SALARY_DATA_DIR}")
@@ -395,295 +865,2624 @@ def load_and_process_data():
         df['年份'] = year
         all_salary_data.append(df)
     
-    salary_data = pd.concat(all_salary_data, ignore_index=True)
+    salary_data = compact_dataframe(pd.concat(all_salary_data, ignore_index=True))
+    del all_salary_data
     print(f"已載入 {len(salary_data)} 筆薪資資料記錄")
+    stage_timer.mark('salary_load')
+    
+    # 建立 村里 × 年份 薪資矩陣
+    salary_matrix = build_salary_matrix(salary_data)
+    print(f"已建立薪資矩陣：{len(salary_matrix['villages'])} 個村里 × {len(salary_matrix['years'])} 個年份")
+    stage_timer.mark('salary_matrix')
+    return {'salary_data': salary_data, 'salary_matrix': salary_matrix}
+
+def load_population_history(population_files):
+    """載入所有月份的人口資料（加上西元年份與月份欄位），供村里人口趨勢查詢"""
+    all_population_data = []
+    for file_path in sorted(population_files):
+        # 從檔案名稱中提取年份和月份
+        filename = file_path.stem  # 例如: opendata11407M030_standardized
+        if 'opendata' in filename:
+            year_month = filename.split('opendata')[1].split('_')[0]  # 11407M030
+            if len(year_month) >= 5:
+                year_str = year_month[:3]  # 114
+                month_str = year_month[3:5]  # 07
+                
+                # 轉換民國年為西元年
+                try:
+                    year = int(year_str) + 1911  # 114 + 1911 = 2025
+                    month = int(month_str)
+                    
+                    df = pd.read_csv(file_path, usecols=['縣市', '鄉鎮市區', '村里', '戶數', '人口數'])
+                    df['年份'] = year
+                    df['月份'] = month
+                    all_population_data.append(df)
+                except ValueError:
+                    continue
+    
+    if not all_population_data:
+        raise FileNotFoundError(f"無法載入人口資料檔案: {POPULATION_DATA_DIR}")
     
-    # 載入人口資料（使用最新的標準化檔案）
+    return compact_dataframe(pd.concat(all_population_data, ignore_index=True))
+
+def load_population(stage_timer):
+    """載入最新的人口資料與歷年人口資料（人口密度於快照建置時以村里 ID 合併面積計算）"""
     print("正在載入人口資料...")
     population_files = list(POPULATION_DATA_DIR.glob("*_standardized.csv"))
-    if population_files:
-        # 選擇最新的人口資料檔案
-        latest_population_file = max(population_files, key=lambda x: x.stem)
-        print(f"使用人口資料檔案: {latest_population_file.name}")
-        population_data = pd.read_csv(latest_population_file)
-        print(f"已載入 {len(population_data)} 筆人口資料記錄")
-    else:
+    if not population_files:
         raise FileNotFoundError(f"找不到人口資料檔案在: {POPULATION_DATA_DIR}")
     
-    # 建立村里薪資對應關係
-    print("正在建立村里薪資對應關係...")
-    village_salary_mapping = {}
-    
+    # 選擇最新的人口資料檔案
+    latest_population_file = max(population_files, key=lambda x: x.stem)
+    print(f"使用人口資料檔案: {latest_population_file.name}")
+    population_data = compact_dataframe(pd.read_csv(latest_population_file))
+    print(f"已載入 {len(population_data)} 筆人口資料記錄")
+    population_history = load_population_history(population_files)
+    print(f"已載入 {len(population_history)} 筆歷年人口資料記錄")
+    stage_timer.mark('population_load')
+    return {'population_data': population_data, 'population_history': population_history}
 
+def load_clinics(stage_timer):
+    """載入診所資料並標準化科別"""
+    print("正在載入診所資料...")
+    if not CLINIC_DATA_PATH.exists():
+        raise FileNotFoundError(f"找不到診所資料檔案: {CLINIC_DATA_PATH}")
     
-    # 取得最新年份（2023）的村里中位數資料
-    latest_salary = salary_data[salary_data['年份'] == 2023].copy()
+    clinic_data = pd.read_csv(CLINIC_DATA_PATH)
     
-    # 建立村里名稱對應表（直接使用標準化資料）
-    for _, row in latest_salary.iterrows():
-        county_name = row['縣市']
-        district_name = row['鄉鎮市區']
-        village_name = row['村里']
-        
-        key = f"{county_name}_{district_name}_{village_name}"
-        
-        mapping_data = {
-            'county': county_name,
-            'district': district_name,
-            'village': village_name,
-            'median_income': row['中位數'],
-            'total_income': row['綜合所得總額'],
-            'average_income': row['平均數']
-        }
-        
-        village_salary_mapping[key] = mapping_data
+    # 從縣市區名中提取縣市名稱 (例如：臺北市松山區 -> 臺北市)
+    clinic_data['縣市'] = clinic_data['縣市區名'].str[:3]
     
-    print(f"已建立 {len(village_salary_mapping)} 個村里的薪資對應關係")
+    # 標準化科別（相同的科別組合共用同一個 frozenset）
+    clinic_data['標準科別'] = _intern_specialty_sets(clinic_data['科別'].apply(standardize_specialties))
     
-    # 建立村里人口密度對應關係
-    print("正在建立村里人口密度對應關係...")
-    village_population_mapping = {}
+    # 移除無效的座標資料
+    clinic_data = clinic_data.dropna(subset=['經度', '緯度'])
+    clinic_data = clinic_data[(clinic_data['經度'] != 0) & (clinic_data['緯度'] != 0)]
+    clinic_data = compact_dataframe(clinic_data.reset_index(drop=True))
     
-    # 使用人口資料計算人口密度
-    for _, pop_row in population_data.iterrows():
-        county_name = pop_row['縣市']
-        district_name = pop_row['鄉鎮市區'] 
-        village_name = pop_row['村里']
-        population = pop_row['人口數']
-        
-        # 對應到村里地理資料，找到面積
-        village_match = village_data[
-            (village_data['COUNTYNAME'] == county_name) & 
-            (village_data['TOWNNAME'] == district_name) & 
-            (village_data['VILLNAME'] == village_name)
-        ]
-        
-        if not village_match.empty:
-            area_km2 = village_match.iloc[0]['area_km2']
-            if area_km2 > 0:  # 避免除以零
-                population_density = population / area_km2
-                
-                key = f"{county_name}_{district_name}_{village_name}"
-                village_population_mapping[key] = {
-                    'county': county_name,
-                    'district': district_name, 
-                    'village': village_name,
-                    'population': population,
-                    'area_km2': area_km2,
-                    'population_density': population_density
-                }
-    
-    print(f"已建立 {len(village_population_mapping)} 個村里的人口密度對應關係")
-    print(f"人口密度範圍：{min([v['population_density'] for v in village_population_mapping.values()]):.2f} - {max([v['population_density'] for v in village_population_mapping.values()]):.2f} 人/km²")
-
-    # 載入診所資料
-    print("正在載入診所資料...")
-    if CLINIC_DATA_PATH.exists():
-        clinic_data = pd.read_csv(CLINIC_DATA_PATH)
-        
-        # 從縣市區名中提取縣市名稱 (例如：臺北市松山區 -> 臺北市)
-        clinic_data['縣市'] = clinic_data['縣市區名'].str[:3]
-        
-        # 標準化科別
-        clinic_data['標準科別'] = clinic_data['科別'].apply(standardize_specialties)
-        
-        # 移除無效的座標資料
-        clinic_data = clinic_data.dropna(subset=['經度', '緯度'])
-        clinic_data = clinic_data[(clinic_data['經度'] != 0) & (clinic_data['緯度'] != 0)]
-        
-        print(f"已載入 {len(clinic_data)} 筆診所資料")
-        
-        # 統計科別分布
-        all_specialties = set()
-        for specialty_set in clinic_data['標準科別']:
-            all_specialties.update(specialty_set)
-        print(f"標準化後共有 {len(all_specialties)} 種科別: {sorted(all_specialties)}")
-    else:
-        raise FileNotFoundError(f"找不到診所資料檔案: {CLINIC_DATA_PATH}")
-
-@app.on_event("startup")
-async def startup_event():
-    """應用程式啟動時載入資料"""
-    try:
-        print("開始載入資料...")
-        load_and_process_data()
-        print("資料載入完成！")
-    except Exception as e:
-        print(f"資料載入失敗: {e}")
-        import traceback
-        traceback.print_exc()
-        raise e
+    print(f"已載入 {len(clinic_data)} 筆診所資料")
+    
+    # 統計科別分布
+    all_specialties = set()
+    for specialty_set in clinic_data['標準科別']:
+        all_specialties.update(specialty_set)
+    print(f"標準化後共有 {len(all_specialties)} 種科別: {sorted(all_specialties)}")
+    stage_timer.mark('clinic_load')
+    return {'clinic_data': clinic_data}
 
-@app.get("/")
-async def root():
-    """根路徑"""
-    return {"message": "台灣地圖 API 服務運行中"}
+def load_insurance(stage_timer):
+    """載入健保與勞保投保金額分級表，每個保險一個依投保金額排序的整數 DataFrame（查詢時以二分搜尋對應級距）"""
+    print("正在載入投保金額分級表...")
+    insurance_brackets = {}
+    for scheme, file_path in INSURANCE_TABLE_PATHS.items():
+        if not file_path.exists():
+            raise FileNotFoundError(f"找不到投保金額分級表: {file_path}")
+        with open(file_path, encoding='utf-8') as f:
+            records = list(json.load(f).values())
+        # 原始檔以投保金額字串為鍵值，數值有字串也有整數
+        table = pd.DataFrame.from_records(records).apply(pd.to_numeric).astype(np.int32)
+        insurance_brackets[scheme] = table.sort_values('base_salary', ignore_index=True)
+        print(f"{INSURANCE_SCHEME_NAMES[scheme]}: {len(table)} 級（{table['base_salary'].min()}-{table['base_salary'].max()} 元）")
+    stage_timer.mark('insurance_load')
+    return {'insurance_brackets': insurance_brackets}
 
-@app.get("/api/counties")
-async def get_counties():
-    """返回全台灣縣市的 GeoJSON 資料"""
-    if county_data is None:
-        raise HTTPException(status_code=500, detail="縣市資料尚未載入")
+class NameNormalizer:
+    """
+    行政區名稱正規化，對照表來自 name_mapping_reference.json（啟動時編譯一次）
     
-    # 轉換為 GeoJSON 格式
-    counties_geojson = {
-        "type": "FeatureCollection",
-        "features": []
-    }
+    縣市與鄉鎮市區先查對照表（例如 台北縣 -> 新北市），統一「台」為「臺」後再查一次；
+    村里名稱只套用對照表（例如 石𥕢里 -> 石曹里）
+    """
     
-    for _, row in county_data.iterrows():
-        # 確保幾何資料的座標順序正確 [longitude, latitude]
-        geometry = row['geometry']
-        
-        # Debug: 輸出座標值確認
-        county_name = row.get('COUNTYNAME', row.get('name', '未知縣市'))
-        center_lat_val = row['center_lat']
-        center_lon_val = row['center_lon']
-        print(f"API 返回 {county_name}: center_lat={center_lat_val}, center_lon={center_lon_val}")
-        
-        feature = {
-            "type": "Feature",
-            "properties": {
-                "name": county_name,
-                "center_lat": center_lat_val,
-                "center_lon": center_lon_val
-            },
-            "geometry": mapping(geometry)
-        }
-        counties_geojson["features"].append(feature)
+    def __init__(self, county_mapping=None, town_mapping=None, village_mapping=None):
+        self.county_mapping = dict(county_mapping or {})
+        self.town_mapping = dict(town_mapping or {})
+        self.village_mapping = dict(village_mapping or {})
     
-    return counties_geojson
-
-@app.get("/api/villages/{county_name}")
-async def get_villages(county_name: str, income_weight: float = 0.5, density_weight: float = 0.5):
-    """返回指定縣市的所有村里 GeoJSON 資料（包含薪資和人口密度）"""
-    if village_data is None or village_salary_mapping is None or village_population_mapping is None:
-        raise HTTPException(status_code=500, detail="村里資料尚未載入")
+    @classmethod
+    def from_file(cls, path):
+        if not path.exists():
+            logger.warning("找不到名稱對照表 %s，行政區名稱不做正規化", path)
+            return cls()
+        with open(path, encoding='utf-8') as f:
+            mapping = json.load(f).get('name_mapping', {})
+        return cls(mapping.get('county_mapping'), mapping.get('town_mapping'), mapping.get('village_mapping'))
     
-
+    @staticmethod
+    def _region(name, mapping):
+        name = str(name).strip()
+        name = mapping.get(name, name).replace('台', '臺')
+        return mapping.get(name, name)
     
-    # 篩選該縣市的村里
-    county_villages = village_data[village_data['COUNTYNAME'] == county_name].copy()
+    def county(self, name):
+        return self._region(name, self.county_mapping)
     
-    if county_villages.empty:
-        raise HTTPException(status_code=404, detail=f"找不到縣市: {county_name}")
+    def town(self, name):
+        return self._region(name, self.town_mapping)
     
-    # 計算該縣市村里的中位數分級和人口密度分級
-    county_village_incomes = []
-    county_village_densities = []
-    village_income_mapping = {}  # 儲存每個村里的收入
-    village_density_mapping = {}  # 儲存每個村里的人口密度
+    def village(self, name):
+        name = str(name).strip()
+        return self.village_mapping.get(name, name)
     
-    for _, row in county_villages.iterrows():
-        village_name = row.get('VILLNAME', row.get('name', '未知村里'))
-        district_name = row.get('TOWNNAME', '未知區')
+    def key(self, county, town, village):
+        return self.county(county), self.town(town), self.village(village)
+
+name_normalizer = NameNormalizer.from_file(NAME_MAPPING_PATH)
+
+def _factorize_keys(*columns):
+    """將多個名稱欄位的組合編碼：返回每列的組合代碼與不重複的組合（tuple）"""
+    codes, uniques = pd.MultiIndex.from_arrays(list(columns)).factorize()
+    return codes, list(uniques)
+
+class VillageRegistry:
+    """
+    標準村里編號：各資料集的（縣市, 鄉鎮市區, 村里）正規化後，依標準名稱排序編為整數 ID
+    
+    每個快照建置一次，資料集之間的合併與查詢都以 ID 陣列進行，不再組合字串鍵值。
+    ID 只在同一個快照內有效，任一資料集重新載入時會重新編號
+    """
+    
+    def __init__(self, normalizer, villages, regions):
+        """
+        Args:
+            normalizer: NameNormalizer
+            villages: 資料集名稱 -> (縣市, 鄉鎮市區, 村里) 三個欄位，'village'（村里界）為對照基準
+            regions: 只有縣市與鄉鎮市區的資料集（例如診所）名稱 -> (縣市, 鄉鎮市區)
+        """
+        self.normalizer = normalizer
+        factorized = {}
+        for name, columns in villages.items():
+            codes, uniques = _factorize_keys(*columns)
+            factorized[name] = (codes, uniques, [normalizer.key(*key) for key in uniques])
+        self.keys = sorted(set().union(*(canonical for _, _, canonical in factorized.values())))
+        self.key_ids = {key: village_id for village_id, key in enumerate(self.keys)}
         
-        # 直接使用標準化資料進行對應
-        key = f"{county_name}_{district_name}_{village_name}"
+        # 各資料集每一列的村里 ID
+        self.ids = {}
+        for name, (codes, _, canonical) in factorized.items():
+            lookup = np.array([self.key_ids[key] for key in canonical], dtype=np.int32)
+            self.ids[name] = lookup[codes]
         
-        # 處理薪資資料
-        median_income = None
-        if key in village_salary_mapping:
-            median_income = village_salary_mapping[key]['median_income']
+        # 縣市與鄉鎮市區編號（包含只有縣市、區層級的資料集）
+        region_keys = {}
+        for name, columns in regions.items():
+            codes, uniques = _factorize_keys(*columns)
+            region_keys[name] = (codes, uniques, [(normalizer.county(county), normalizer.town(town)) for county, town in uniques])
+        self.counties = sorted({key[0] for key in self.keys}.union(
+            county for _, _, canonical in region_keys.values() for county, _ in canonical))
+        self.towns = sorted({key[1] for key in self.keys}.union(
+            town for _, _, canonical in region_keys.values() for _, town in canonical))
+        self.county_ids = {county: county_id for county_id, county in enumerate(self.counties)}
+        self.town_ids = {town: town_id for town_id, town in enumerate(self.towns)}
+        self.county_of = np.array([self.county_ids[county] for county, _, _ in self.keys], dtype=np.int32)
+        self.town_of = np.array([self.town_ids[town] for _, town, _ in self.keys], dtype=np.int32)
+        self.region_ids = {}
+        for name, (codes, _, canonical) in region_keys.items():
+            county_lookup = np.array([self.county_ids[county] for county, _ in canonical], dtype=np.int32)
+            town_lookup = np.array([self.town_ids[town] for _, town in canonical], dtype=np.int32)
+            self.region_ids[name] = (county_lookup[codes], town_lookup[codes])
         
-        # 處理人口密度資料
-        population_density = None
-        if key in village_population_mapping:
-            population_density = village_population_mapping[key]['population_density']
+        # 每個 ID 在各資料集中的列位置（依 ID 排序的列索引與各 ID 的起訖位置）
+        self.rows = {}
+        for name, ids in self.ids.items():
+            order = np.argsort(ids, kind='stable')
+            self.rows[name] = (order, np.searchsorted(ids[order], np.arange(len(self.keys) + 1)))
         
-        # 儲存每個村里的資料（沒有數據的設為None）
-        village_key = f"{village_name}_{district_name}"
-        village_income_mapping[village_key] = median_income
-        village_density_mapping[village_key] = population_density
+        # 各資料集對應到村里界的比例；aliased 為經過名稱正規化才得到標準名稱的組合數
+        in_geometry = np.zeros(len(self.keys), dtype=bool)
+        in_geometry[self.ids['village']] = True
+        geometry_regions = {(county, town) for county, town, _ in (self.keys[i] for i in np.flatnonzero(in_geometry))}
+        self.match_rates = {}
+        for name, (_, uniques, canonical) in factorized.items():
+            if name == 'village':
+                continue
+            matched = int(in_geometry[np.unique(self.ids[name])].sum())
+            self.match_rates[name] = self._match_rate(len(set(canonical)), matched, uniques, canonical)
+        for name, (_, uniques, canonical) in region_keys.items():
+            matched = sum(1 for key in set(canonical) if key in geometry_regions)
+            self.match_rates[name] = self._match_rate(len(set(canonical)), matched, uniques, canonical)
+    
+    def shared_state(self):
+        """
+        寫入共享目錄的內容：(陣列, 可 JSON 序列化的對照資料)
         
-        if median_income is not None:
-            county_village_incomes.append(median_income)
-        if population_density is not None:
-            county_village_densities.append(population_density)
+        陣列以 .npy 儲存，各 worker 直接映射；名稱清單與對應率寫入 JSON，附掛時只重建名稱 -> 編號的字典
+        """
+        arrays = {'county_of': self.county_of, 'town_of': self.town_of}
+        for name, ids in self.ids.items():
+            arrays[f'ids_{name}'] = ids
+            arrays[f'rows_{name}_order'], arrays[f'rows_{name}_bounds'] = self.rows[name]
+        for name, (county_ids, town_ids) in self.region_ids.items():
+            arrays[f'region_{name}_county'], arrays[f'region_{name}_town'] = county_ids, town_ids
+        state = {
+            'keys': [list(key) for key in self.keys],
+            'counties': self.counties,
+            'towns': self.towns,
+            'datasets': list(self.ids),
+            'regions': list(self.region_ids),
+            'match_rates': self.match_rates,
+        }
+        return arrays, state
+    
+    @classmethod
+    def from_shared(cls, normalizer, arrays, state):
+        """由 shared_state() 寫入的內容還原（陣列為唯讀映射）"""
+        registry = cls.__new__(cls)
+        registry.normalizer = normalizer
+        registry.keys = [tuple(key) for key in state['keys']]
+        registry.key_ids = {key: village_id for village_id, key in enumerate(registry.keys)}
+        registry.counties, registry.towns = state['counties'], state['towns']
+        registry.county_ids = {county: county_id for county_id, county in enumerate(registry.counties)}
+        registry.town_ids = {town: town_id for town_id, town in enumerate(registry.towns)}
+        registry.county_of, registry.town_of = arrays['county_of'], arrays['town_of']
+        registry.ids = {name: arrays[f'ids_{name}'] for name in state['datasets']}
+        registry.rows = {name: (arrays[f'rows_{name}_order'], arrays[f'rows_{name}_bounds']) for name in state['datasets']}
+        registry.region_ids = {name: (arrays[f'region_{name}_county'], arrays[f'region_{name}_town']) for name in state['regions']}
+        registry.match_rates = state['match_rates']
+        return registry
+    
+    @staticmethod
+    def _match_rate(total, matched, uniques, canonical):
+        return {
+            "keys": total,
+            "matched": matched,
+            "rate": round(matched / total, 4) if total else None,
+            "aliased": sum(1 for raw, key in zip(uniques, canonical) if tuple(str(part) for part in raw) != key)
+        }
+    
+    def village_id(self, county_name, district_name, village_name):
+        """依名稱查詢標準村里 ID，找不到時返回 None"""
+        return self.key_ids.get(self.normalizer.key(county_name, district_name, village_name))
+    
+    def county_id(self, county_name):
+        """依名稱查詢縣市編號，找不到時返回 -1（不會與任何編號相符）"""
+        return self.county_ids.get(self.normalizer.county(county_name), -1)
+    
+    def town_id(self, district_name):
+        """依名稱查詢鄉鎮市區編號，找不到時返回 -1"""
+        return self.town_ids.get(self.normalizer.town(district_name), -1)
+    
+    def has_rows(self, dataset, village_id):
+        bounds = self.rows[dataset][1]
+        return bounds[village_id + 1] > bounds[village_id]
+    
+    def row_positions(self, dataset, village_ids):
+        """多個村里在資料集中的列位置（依原始順序）"""
+        order, bounds = self.rows[dataset]
+        parts = [order[bounds[village_id]:bounds[village_id + 1]] for village_id in village_ids]
+        if not parts:
+            return np.array([], dtype=np.intp)
+        return np.sort(np.concatenate(parts))
+    
+    def nbytes(self):
+        arrays = [self.county_of, self.town_of, *self.ids.values(), *(a for pair in self.rows.values() for a in pair),
+                  *(a for pair in self.region_ids.values() for a in pair)]
+        return int(sum(array.nbytes for array in arrays))
+
+def build_village_registry(snapshot, stage_timer):
+    """建立快照的標準村里編號並輸出各資料集的名稱對應率"""
+    matrix = snapshot.salary_matrix
+    frames = {
+        'village': ('village_data', 'COUNTYNAME', 'TOWNNAME', 'VILLNAME'),
+        'salary': ('salary_data', '縣市', '鄉鎮市區', '村里'),
+        'population': ('population_data', '縣市', '鄉鎮市區', '村里'),
+        'population_history': ('population_history', '縣市', '鄉鎮市區', '村里'),
+    }
+    villages = {name: tuple(getattr(snapshot, field)[column] for column in columns)
+                for name, (field, *columns) in frames.items()}
+    villages['salary_matrix'] = (matrix['counties'], matrix['districts'], matrix['villages'])
+    # 診所的縣市區名為「縣市 + 鄉鎮市區」，縣市名稱固定三個字
+    county_districts = snapshot.clinic_data['縣市區名'].astype(str)
+    regions = {'clinic': (snapshot.clinic_data['縣市'], county_districts.str[3:])}
+    registry = VillageRegistry(name_normalizer, villages, regions)
+    
+    print(f"標準村里編號: {len(registry.keys)} 個村里")
+    for name, rate in registry.match_rates.items():
+        print(f"  {name} 對應到村里界: {rate['matched']}/{rate['keys']}"
+              + (f"（{rate['rate'] * 100:.1f}%）" if rate['rate'] is not None else "")
+              + (f"，{rate['aliased']} 個經名稱正規化" if rate['aliased'] else ""))
+    stage_timer.mark('village_registry')
+    return registry
+
+def build_village_indicators(snapshot, registry):
+    """
+    以村里 ID 合併最新年度的薪資中位數，以及人口數與村里面積計算的人口密度
+    
+    Returns:
+        dict: 指標名稱 -> 以村里 ID 為索引的列表（沒有資料為 None）
+    """
+    size = len(registry.keys)
+    
+    # 同一村里有多筆時以最後一筆為準
+    median_income = [None] * size
+    salary_data = snapshot.salary_data
+    latest = (salary_data['年份'] == salary_data['年份'].max()).to_numpy()
+    for village_id, value in zip(registry.ids['salary'][latest].tolist(), salary_data['中位數'].to_numpy()[latest].tolist()):
+        median_income[village_id] = value
+    
+    # 村里面積取村里界中第一個同名村里
+    area_km2 = np.full(size, np.nan)
+    village_ids, first_rows = np.unique(registry.ids['village'], return_index=True)
+    area_km2[village_ids] = snapshot.village_data['area_km2'].to_numpy(dtype=float)[first_rows]
+    population_ids = registry.ids['population']
+    population_area = area_km2[population_ids]
+    has_area = population_area > 0  # 沒有面積（NaN）或面積為零的村里不計算密度
+    populations = snapshot.population_data['人口數'].to_numpy(dtype=float)
+    densities = populations[has_area] / population_area[has_area]
+    population = [None] * size
+    for village_id, value in zip(population_ids.tolist(), populations.tolist()):
+        population[village_id] = value
+    population_density = [None] * size
+    for village_id, value in zip(population_ids[has_area].tolist(), densities.tolist()):
+        population_density[village_id] = value
+    
+    return {'median_income': median_income, 'population': population, 'population_density': population_density}
+
+def _indicator_array(values):
+    """以 ID 為索引的指標列表轉為 float 陣列（None 為 NaN）"""
+    return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+def build_district_indicators(snapshot, stage_timer):
+    """
+    以村里 ID 彙總鄉鎮市區指標：人口加權的薪資中位數、總人口、人口密度（總人口 / 鄉鎮市區面積）與診所數
+    
+    Returns:
+        dict: 'county_ids' 為每個鄉鎮市區的縣市編號陣列，其餘為與 district_data 列順序相同的指標列表（沒有資料為 None）
+    """
+    registry, indicators = snapshot.village_registry, snapshot.village_indicators
+    district_data = snapshot.district_data
+    size = len(district_data)
+    county_ids = np.array([registry.county_id(name) for name in district_data['COUNTYNAME']], dtype=np.int32)
+    town_ids = np.array([registry.town_id(name) for name in district_data['TOWNNAME']], dtype=np.int32)
+    district_rows = {key: row for row, key in enumerate(zip(county_ids.tolist(), town_ids.tolist()))}
+    
+    # 村里界中每個村里（不重複 ID）所屬的鄉鎮市區列
+    village_ids = np.unique(registry.ids['village'])
+    rows = np.array([district_rows.get(key, -1) for key in zip(registry.county_of[village_ids].tolist(),
+                                                               registry.town_of[village_ids].tolist())], dtype=np.intp)
+    village_ids, rows = village_ids[rows >= 0], rows[rows >= 0]
+    population = _indicator_array(indicators['population'])[village_ids]
+    income = _indicator_array(indicators['median_income'])[village_ids]
+    has_population = ~np.isnan(population)
+    total_population = np.bincount(rows[has_population], weights=population[has_population], minlength=size)
+    population_villages = np.bincount(rows[has_population], minlength=size)
+    # 薪資以村里人口加權，只計入同時有薪資與人口資料的村里
+    weighted = has_population & ~np.isnan(income)
+    income_sum = np.bincount(rows[weighted], weights=(income * population)[weighted], minlength=size)
+    weight_sum = np.bincount(rows[weighted], weights=population[weighted], minlength=size)
+    area_km2 = district_data['area_km2'].to_numpy(dtype=float)
+    
+    # 診所依縣市區名對應到鄉鎮市區，相同機構名稱與地址只計算一次
+    clinic_county_ids, clinic_town_ids = registry.region_ids['clinic']
+    region_codes, inverse = np.unique(clinic_county_ids.astype(np.int64) * len(registry.towns) + clinic_town_ids,
+                                      return_inverse=True)
+    code_rows = np.array([district_rows.get(divmod(int(code), len(registry.towns)), -1) for code in region_codes], dtype=np.intp)
+    clinic_rows = code_rows[inverse.reshape(-1)]
+    located = clinic_rows >= 0
+    clinics = np.unique(np.stack([clinic_rows[located], snapshot.clinic_index.clinic_keys[located]]), axis=1)
+    clinic_count = np.bincount(clinics[0], minlength=size)
+    
+    district_indicators = {
+        'county_ids': county_ids,
+        'median_income': [value / weight if weight > 0 else None
+                          for value, weight in zip(income_sum.tolist(), weight_sum.tolist())],
+        'population': [int(round(total)) if count else None
+                       for total, count in zip(total_population.tolist(), population_villages.tolist())],
+        'population_density': [total / area if count and area > 0 else None
+                               for total, count, area in zip(total_population.tolist(), population_villages.tolist(), area_km2.tolist())],
+        'clinic_count': clinic_count.tolist(),
+    }
+    print(f"鄉鎮市區指標: {size} 個鄉鎮市區，{sum(1 for value in district_indicators['median_income'] if value is not None)} 個有薪資資料，"
+          f"{int(located.sum())}/{len(clinic_rows)} 筆診所對應到鄉鎮市區")
+    stage_timer.mark('district_indicators')
+    return district_indicators
+
+SUMMARY_NATIONAL = '全台'
+SUMMARY_PERCENTILES = (10, 25, 50, 75, 90)
+
+def _group_distribution(groups, values, weights, size):
+    """
+    依群組向量化計算分布統計（忽略 NaN）：村里數、百分位數、平均、人口加權平均、最小、最大與吉尼係數
+    
+    Returns:
+        DataFrame: 以群組編號 0..size-1 為索引（沒有資料的群組為 NaN）
+    """
+    frame = pd.DataFrame({'group': groups, 'value': values, 'weight': weights}).dropna(subset=['value'])
+    grouped = frame.groupby('group')['value']
+    result = pd.DataFrame({'villages': grouped.size(), 'mean': grouped.mean(), 'min': grouped.min(), 'max': grouped.max()})
+    quantiles = grouped.quantile([percentile / 100 for percentile in SUMMARY_PERCENTILES]).unstack()
+    for percentile in SUMMARY_PERCENTILES:
+        result[f'p{percentile}'] = quantiles[percentile / 100]
+    weighted = frame.dropna(subset=['weight'])
+    result['weighted_mean'] = ((weighted['value'] * weighted['weight']).groupby(weighted['group']).sum()
+                               / weighted.groupby('group')['weight'].sum())
+    # 吉尼係數：組內由小到大排序後 G = 2Σ(i·x_i) / (nΣx) - (n + 1) / n
+    ordered = frame.sort_values(['group', 'value'])
+    rank = ordered.groupby('group').cumcount() + 1
+    count, total = result['villages'], grouped.sum()
+    gini = 2 * (rank * ordered['value']).groupby(ordered['group']).sum() / (count * total) - (count + 1) / count
+    result['gini'] = gini.where(total > 0)
+    return result.reindex(range(size))
+
+def _group_pearson(groups, x, y):
+    """依群組計算 Pearson 相關係數（以組內離均差計算，變異為 0 的群組為 NaN）"""
+    dx = x - x.groupby(groups).transform('mean')
+    dy = y - y.groupby(groups).transform('mean')
+    sums = pd.DataFrame({'xy': dx * dy, 'xx': dx * dx, 'yy': dy * dy}).groupby(groups).sum()
+    denominator = np.sqrt(sums['xx'] * sums['yy'])
+    return (sums['xy'] / denominator).where(denominator > 0)
+
+def _group_correlation(groups, x, y, size):
+    """依群組計算兩個指標的 Pearson 與 Spearman（組內排名的 Pearson）相關係數，只使用兩者皆有值的列"""
+    frame = pd.DataFrame({'group': groups, 'x': x, 'y': y}).dropna()
+    ranks = frame.groupby('group')[['x', 'y']].rank()
+    return pd.DataFrame({
+        'pearson': _group_pearson(frame['group'], frame['x'], frame['y']),
+        'spearman': _group_pearson(frame['group'], ranks['x'], ranks['y'])
+    }).reindex(range(size))
+
+def build_summary_tables(snapshot, stage_timer):
+    """
+    一次計算所有縣市與全台的統計摘要，請求時只需要查表
+    
+    - income：（範圍, 年度）-> 村里薪資中位數的分布、人口加權平均、吉尼係數，以及與人口密度的相關係數
+    - density：範圍 -> 村里人口密度的分布、人口加權平均（居民感受的密度）、總人口、面積與整體密度
+    - clinics：（範圍, 科別）-> 診所數與每萬人診所數（相同機構名稱與地址只計算一次）
+    
+    人口與人口密度使用最新的人口資料；每個村里同時計入所屬縣市與全台
+    """
+    registry, indicators = snapshot.village_registry, snapshot.village_indicators
+    village_ids = np.unique(registry.ids['village'])
+    scope_counties = np.unique(registry.county_of[village_ids])
+    scopes = [registry.counties[county_id] for county_id in scope_counties.tolist()] + [SUMMARY_NATIONAL]
+    national = len(scopes) - 1
+    village_scopes = np.searchsorted(scope_counties, registry.county_of[village_ids])
+    scope_codes = np.concatenate([village_scopes, np.full(len(village_ids), national)])
+    population = np.tile(_indicator_array(indicators['population'])[village_ids], 2)
+    density = np.tile(_indicator_array(indicators['population_density'])[village_ids], 2)
+    
+    # 薪資：村里 × 年度的中位數攤平後，以 範圍 × 年度數 + 年度 為群組
+    matrix = snapshot.salary_matrix
+    years = matrix['years'].tolist()
+    matrix_rows = np.full(len(registry.keys), -1, dtype=np.intp)
+    matrix_rows[registry.ids['salary_matrix']] = np.arange(len(registry.ids['salary_matrix']))
+    rows = np.tile(matrix_rows[village_ids], 2)
+    incomes = np.asarray(matrix['matrices']['median'])[np.maximum(rows, 0)]
+    incomes[rows < 0] = np.nan
+    income_groups = (scope_codes[:, None] * len(years) + np.arange(len(years))).ravel()
+    group_count = len(scopes) * len(years)
+    income = _group_distribution(income_groups, incomes.ravel(), np.repeat(population, len(years)), group_count)
+    income = income.join(_group_correlation(income_groups, incomes.ravel(), np.repeat(density, len(years)), group_count))
+    income.index = pd.MultiIndex.from_product([scopes, years], names=['scope', 'year'])
+    
+    # 人口密度：面積以村里界的每一列加總（與村里人口密度使用相同的面積）
+    density_table = _group_distribution(scope_codes, density, population, len(scopes))
+    has_population = ~np.isnan(population)
+    density_table['population'] = np.bincount(scope_codes[has_population], weights=population[has_population], minlength=len(scopes))
+    row_scopes = np.searchsorted(scope_counties, registry.county_of[registry.ids['village']])
+    area_km2 = snapshot.village_data['area_km2'].to_numpy(dtype=float)
+    county_area = np.bincount(row_scopes, weights=area_km2, minlength=len(scopes))
+    county_area[national] = area_km2.sum()
+    density_table['area_km2'] = county_area
+    density_table['overall_density'] = density_table['population'] / county_area
+    density_table.index = pd.Index(scopes, name='scope')
+    
+    # 每萬人診所數：每筆（範圍, 科別, 機構）只計算一次
+    clinic_index = snapshot.clinic_index
+    clinic_counties = registry.region_ids['clinic'][0]
+    clinic_scopes = np.searchsorted(scope_counties, clinic_counties)
+    located = (clinic_scopes < len(scope_counties)) & (scope_counties[np.minimum(clinic_scopes, len(scope_counties) - 1)] == clinic_counties)
+    specialties = [CLINIC_GAP_ALL_SPECIALTIES] + sorted(clinic_index.specialty_masks)
+    key_count = int(clinic_index.clinic_keys.max()) + 1 if len(clinic_index.clinic_keys) else 1
+    codes = []
+    for specialty_index, specialty in enumerate(specialties):
+        mask = located if specialty_index == 0 else located & clinic_index.specialty_masks[specialty]
+        for clinic_scope in (clinic_scopes[mask], np.full(int(mask.sum()), national)):
+            codes.append(((clinic_scope.astype(np.int64) * len(specialties) + specialty_index) * key_count
+                          + clinic_index.clinic_keys[mask]))
+    groups = pd.unique(np.concatenate(codes)) // key_count
+    clinic_counts = np.bincount(groups, minlength=len(scopes) * len(specialties))
+    scope_population = np.repeat(density_table['population'].to_numpy(), len(specialties))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        per_10k = np.where(scope_population > 0, clinic_counts / scope_population * 10000, np.nan)
+    clinics = pd.DataFrame({'clinics': clinic_counts, 'per_10k': per_10k},
+                           index=pd.MultiIndex.from_product([scopes, specialties], names=['scope', 'specialty']))
+    
+    print(f"統計摘要: {len(scopes) - 1} 個縣市與全台 × {len(years)} 個年度，{len(specialties) - 1} 種科別")
+    stage_timer.mark('summaries')
+    return {'scopes': scopes, 'years': years, 'income': income, 'density': density_table, 'clinics': clinics}
+
+def build_derived_indexes(snapshot, stage_timer):
+    """建立由資料集推導的索引（村里編號、村里指標、搜尋索引、診所空間索引、村里定位、鄉鎮市區指標、統計摘要、診所供需）；共享資料模式下由 export_derived_indexes 寫入共享目錄"""
+    snapshot.village_registry = build_village_registry(snapshot, stage_timer)
+    snapshot.village_indicators = build_village_indicators(snapshot, snapshot.village_registry)
+    for name, label in (('median_income', '薪資'), ('population_density', '人口密度')):
+        count = sum(1 for value in snapshot.village_indicators[name] if value is not None)
+        if not count:
+            raise ValueError(f"資料驗證失敗：沒有任何村里的{label}資料對應到村里界")
+        print(f"已建立 {count} 個村里的{label}對應關係")
+    stage_timer.mark('village_indicators')
+    snapshot.search_index = build_search_index(snapshot, stage_timer)
+    snapshot.clinic_index = build_clinic_index(snapshot, stage_timer)
+    snapshot.village_locator = build_village_locator(snapshot, stage_timer)
+    snapshot.district_indicators = build_district_indicators(snapshot, stage_timer)
+    snapshot.summary_tables = build_summary_tables(snapshot, stage_timer)
+    # 預設服務半徑的診所供需指標在快照建置時先計算，其他半徑於第一次查詢時計算
+    gaps = compute_clinic_gaps(snapshot, CLINIC_GAP_DEFAULT_RADIUS_KM)
+    snapshot.clinic_gap_cache[CLINIC_GAP_DEFAULT_RADIUS_KM] = gaps
+    print(f"診所供需指標（半徑 {CLINIC_GAP_DEFAULT_RADIUS_KM} km）: {gaps['clinic_counts'].shape[0]} 個村里 × {len(gaps['specialties'])} 種科別，"
+          f"{gaps['pairs']} 組村里與診所配對")
+    stage_timer.mark('clinic_gaps')
+
+# 搜尋用的異體字對照：台→臺，以及地名、診所名稱常見的簡體字
+SEARCH_VARIANTS = str.maketrans(
+    '台区县乡镇东湾龙门连医诊儿长乐兴丰宁义华兰凤阳岭园厅苏云万寿庄头圣宝罗桥杨树荣关济广达库庙汤泽岛屿丽峡内雾莲凉厦恒妇产齿肤药疗卫复体综众协会馆号楼层',
+    '臺區縣鄉鎮東灣龍門連醫診兒長樂興豐寧義華蘭鳳陽嶺園廳蘇雲萬壽莊頭聖寶羅橋楊樹榮關濟廣達庫廟湯澤島嶼麗峽內霧蓮涼廈恆婦產齒膚藥療衛復體綜眾協會館號樓層'
+)
+SEARCH_TYPES = ('all', 'village', 'clinic')
+SEARCH_MAX_LIMIT = 50
+
+def normalize_search_text(text):
+    """搜尋用的正規化：全形轉半形、英文轉小寫、移除空白，並統一台/臺與簡體字"""
+    return ''.join(unicodedata.normalize('NFKC', str(text)).lower().translate(SEARCH_VARIANTS).split())
+
+def _optional_float(value):
+    return None if pd.isna(value) else float(value)
+
+SEARCH_ENTRY_KINDS = ('village', 'clinic')
+
+class SearchIndex:
+    """
+    村里與診所名稱的搜尋索引，隨快照一起建置
+    
+    - 項目：種類、來源列位置、正規化後的名稱與完整標籤（縣市區 + 名稱 / 名稱 + 地址），回應內容查詢時才由來源資料組成
+    - 前綴索引：正規化後的名稱與完整標籤排序後以 np.searchsorted 查詢（單一字元的查詢使用）
+    - 二元組（bigram）索引：排序後的二元組與 CSR 形式的項目編號，查詢時取最短的列表再逐一確認子字串
+    - 村里對照：正規化後的（縣市, 區, 村里）對應標準村里 ID，再由 VillageRegistry 取得該村里在各資料集中的列位置
+    
+    項目與索引都是 NumPy 陣列（字串為固定寬度的 Unicode 陣列），可寫入共享目錄由多個 worker 映射
+    """
+    
+    def __init__(self, village_data, clinic_data, registry, arrays=None):
+        """
+        Args:
+            arrays: 共享目錄中的索引陣列（shared_arrays() 的內容），None 表示由資料重新建立
+        """
+        if arrays is None:
+            arrays = self._build_arrays(village_data, clinic_data)
+        self.kinds = arrays['kinds']  # SEARCH_ENTRY_KINDS 的位置
+        self.rows = arrays['rows']  # village_data / clinic_data 的列位置
+        self.names = arrays['names']
+        self.labels = arrays['labels']
+        self.prefix_keys = arrays['prefix_keys']
+        self.prefix_ids = arrays['prefix_ids']
+        self.bigram_keys = arrays['bigram_keys']
+        self.bigram_offsets = arrays['bigram_offsets']
+        self.bigram_ids = arrays['bigram_ids']
+        self._entry_lists = None  # numpy 1.x 搜尋時才展開
+        # 回應內容使用的欄位（不複製資料）
+        self.village_columns = None if village_data is None else [
+            village_data[column].array for column in ('VILLNAME', 'COUNTYNAME', 'TOWNNAME', 'center_lat', 'center_lon')]
+        self.clinic_columns = None if clinic_data is None else [
+            clinic_data[column].array for column in ('機構名稱', '縣市', '地址', '緯度', '經度')]
+        
+        # 村里對照：名稱再經搜尋正規化，使查詢也能接受簡體字與全形字
+        self.registry = registry
+        self.village_keys = {}
+        self.county_villages = {}
+        self.villages = {}
+        for village_id, key in enumerate(registry.keys):
+            county, district, village = (normalize_search_text(part) for part in key)
+            self.village_keys[(county, district, village)] = village_id
+            self.county_villages.setdefault((county, village), []).append(village_id)
+            self.villages.setdefault(village, []).append(village_id)
+    
+    @staticmethod
+    def _build_arrays(village_data, clinic_data):
+        kinds, rows, names, labels = [], [], [], []
+        if village_data is not None:
+            for row, (county, district, village) in enumerate(zip(village_data['COUNTYNAME'], village_data['TOWNNAME'],
+                                                                  village_data['VILLNAME'])):
+                county, district, village = str(county), str(district), str(village)
+                kinds.append(0)
+                rows.append(row)
+                names.append(normalize_search_text(village))
+                labels.append(normalize_search_text(county + district + village))
+        if clinic_data is not None:
+            for row, (name, county_district, address) in enumerate(zip(clinic_data['機構名稱'], clinic_data['縣市區名'],
+                                                                       clinic_data['地址'])):
+                name = str(name)
+                kinds.append(1)
+                rows.append(row)
+                names.append(normalize_search_text(name))
+                labels.append(normalize_search_text(name + str(county_district) + str(address)))
+        
+        # 前綴索引：名稱與標籤都可作為前綴比對的對象
+        prefix_entries = sorted({(text, entry_id) for entry_id in range(len(names))
+                                 for text in (names[entry_id], labels[entry_id])})
+        
+        postings = {}
+        for entry_id, label in enumerate(labels):
+            for bigram in {label[i:i + 2] for i in range(len(label) - 1)}:
+                postings.setdefault(bigram, []).append(entry_id)
+        bigram_keys = sorted(postings)
+        return {
+            'kinds': np.array(kinds, dtype=np.int8),
+            'rows': np.array(rows, dtype=np.int32),
+            'names': np.array(names, dtype=str),
+            'labels': np.array(labels, dtype=str),
+            'prefix_keys': np.array([text for text, _ in prefix_entries], dtype=str),
+            'prefix_ids': np.array([entry_id for _, entry_id in prefix_entries], dtype=np.int32),
+            'bigram_keys': np.array(bigram_keys, dtype=str),
+            'bigram_offsets': np.cumsum([0] + [len(postings[bigram]) for bigram in bigram_keys], dtype=np.int64),
+            'bigram_ids': np.array([entry_id for bigram in bigram_keys for entry_id in postings[bigram]], dtype=np.int32),
+        }
+    
+    def shared_arrays(self):
+        """寫入共享目錄的索引陣列"""
+        return {name: getattr(self, name) for name in ('kinds', 'rows', 'names', 'labels', 'prefix_keys', 'prefix_ids',
+                                                       'bigram_keys', 'bigram_offsets', 'bigram_ids')}
+    
+    def _result(self, entry_id):
+        """項目在回應中的內容（不含分數）"""
+        row = int(self.rows[entry_id])
+        if self.kinds[entry_id] == 0:
+            village, county, district, lat, lon = (column[row] for column in self.village_columns)
+            return {"type": "village", "name": str(village), "county": str(county), "district": str(district),
+                    "lat": _optional_float(lat), "lon": _optional_float(lon)}
+        name, county, address, lat, lon = (column[row] for column in self.clinic_columns)
+        return {"type": "clinic", "name": str(name), "county": str(county), "address": str(address),
+                "lat": _optional_float(lat), "lon": _optional_float(lon)}
+    
+    def _candidates(self, token):
+        """可能包含 token 的項目編號陣列（尚未確認）"""
+        if len(token) == 1:
+            start, end = np.searchsorted(self.prefix_keys, [token, token + '\U0010ffff'])
+            return np.unique(self.prefix_ids[start:end])
+        postings = []
+        for i in range(len(token) - 1):
+            bigram = token[i:i + 2]
+            position = int(np.searchsorted(self.bigram_keys, bigram))
+            if position == len(self.bigram_keys) or self.bigram_keys[position] != bigram:
+                return np.zeros(0, dtype=np.int32)
+            postings.append((self.bigram_offsets[position], self.bigram_offsets[position + 1]))
+        start, end = min(postings, key=lambda bounds: bounds[1] - bounds[0])
+        return self.bigram_ids[start:end]
+    
+    @staticmethod
+    def _score_array(names, labels, token):
+        """向量化計分（需 numpy 2 的字串 ufunc）"""
+        return np.select([names == token, np.strings.startswith(names, token), np.strings.startswith(labels, token),
+                          np.strings.find(names, token) >= 0], [100, 80, 60, 40], 20)
+    
+    @staticmethod
+    def _score(name, label, token):
+        if name == token:
+            return 100
+        if name.startswith(token):
+            return 80
+        if label.startswith(token):
+            return 60
+        if token in name:
+            return 40
+        return 20
+    
+    def search(self, query, kind='all', limit=10):
+        """
+        搜尋村里與診所，多個以空白分隔的關鍵字需全部符合
+        
+        排序：名稱完全相同 > 名稱前綴 > 標籤前綴 > 名稱包含 > 標籤包含，同分時名稱較短者優先
+        
+        Returns:
+            (符合的總數, 前 limit 筆結果)
+        """
+        tokens = [token for token in (normalize_search_text(part) for part in query.split()) if token]
+        if not tokens:
+            return 0, []
+        primary = max(tokens, key=len)
+        entry_ids = self._candidates(primary)
+        if kind != 'all':
+            entry_ids = entry_ids[self.kinds[entry_ids] == SEARCH_ENTRY_KINDS.index(kind)]
+        if hasattr(np, 'strings'):
+            labels = self.labels[entry_ids]
+            for token in tokens:
+                found = np.strings.find(labels, token) >= 0
+                entry_ids, labels = entry_ids[found], labels[found]
+            names = self.names[entry_ids]
+            scores = self._score_array(names, labels, primary)
+            order = np.lexsort((entry_ids, self.kinds[entry_ids] != 0, np.strings.str_len(names), -scores))[:limit]
+            return len(entry_ids), [dict(self._result(entry_id), score=score)
+                                    for entry_id, score in zip(entry_ids[order].tolist(), scores[order].tolist())]
+        # numpy 1.x 的 np.char 為逐筆 Python 迴圈，改用各 worker 首次搜尋時展開的字串清單
+        if self._entry_lists is None:
+            self._entry_lists = (self.names.tolist(), self.labels.tolist(), (self.kinds != 0).tolist())
+        names, labels, is_clinic = self._entry_lists
+        matches = []
+        for entry_id in entry_ids.tolist():
+            label = labels[entry_id]
+            if not all(token in label for token in tokens):
+                continue
+            score = self._score(names[entry_id], label, primary)
+            matches.append((-score, len(names[entry_id]), is_clinic[entry_id], entry_id))
+        matches.sort()
+        return len(matches), [dict(self._result(entry_id), score=-score) for score, _, _, entry_id in matches[:limit]]
+    
+    def resolve_village(self, dataset, village_name, county_name=None, district_name=None):
+        """
+        找出符合條件且在資料集（VillageRegistry 的資料集名稱）中有資料的村里
+        
+        名稱先套用行政區名稱對照表再做搜尋正規化（臺/台、全形等）。
+        指定區域但找不到時，若該縣市只有一個同名村里則採用該村里
+        
+        Returns:
+            list: 標準村里 ID
+        """
+        normalizer = self.registry.normalizer
+        village = normalize_search_text(normalizer.village(village_name))
+        if county_name and district_name:
+            county = normalize_search_text(normalizer.county(county_name))
+            village_id = self.village_keys.get((county, normalize_search_text(normalizer.town(district_name)), village))
+            if village_id is not None and self.registry.has_rows(dataset, village_id):
+                return [village_id]
+            candidates = [candidate for candidate in self.county_villages.get((county, village), [])
+                          if self.registry.has_rows(dataset, candidate)]
+            logger.debug("%s%s 的可能區域: %s，前端傳送的區域: %s", county_name, village_name,
+                         [self.registry.keys[candidate][1] for candidate in candidates], district_name)
+            return candidates if len(candidates) == 1 else []
+        if county_name:
+            candidates = self.county_villages.get((normalize_search_text(normalizer.county(county_name)), village), [])
+        else:
+            candidates = self.villages.get(village, [])
+        return [candidate for candidate in candidates if self.registry.has_rows(dataset, candidate)]
+
+def build_search_index(snapshot, stage_timer):
+    """建置快照的搜尋索引"""
+    search_index = SearchIndex(snapshot.village_data, snapshot.clinic_data, snapshot.village_registry)
+    print(f"搜尋索引: {len(search_index.names)} 個項目，{len(search_index.bigram_keys)} 個二元組")
+    stage_timer.mark('search_index')
+    return search_index
+
+# 距離計算使用的平面投影座標系統（TWD97 TM2，單位公尺）
+PROJECTED_CRS = 'EPSG:3826'
+CLINIC_NEAR_MAX_RADIUS_KM = 50
+CLINIC_NEAR_MAX_K = 200
+CLINIC_NEAR_MAX_RESULTS = 1000
+
+class ClinicSpatialIndex:
+    """
+    診所的空間索引：座標投影到 TWD97 TM2 後建立 STRtree，距離以平面距離（公尺）計算
+    
+    不分縣市建立，查詢範圍可跨越縣市界；科別篩選使用預先建立的每個科別布林陣列。
+    投影座標、診所編號與科別陣列可寫入共享目錄，STRtree 則由每個 worker 以映射的座標建立
+    """
+    
+    def __init__(self, clinic_data, arrays=None, tree=None):
+        """
+        Args:
+            arrays: 共享目錄中的陣列（shared_arrays() 的內容），None 表示由資料重新計算
+            tree: 已建好的同一批座標的 STRtree（共享資料的建置者沿用）
+        """
+        from pyproj import Transformer
+        self.transformer = Transformer.from_crs('EPSG:4326', PROJECTED_CRS, always_xy=True)
+        if arrays is None:
+            arrays = self._build_arrays(clinic_data, self.transformer)
+        self.x, self.y = arrays['x'], arrays['y']
+        self.tree = tree if tree is not None else shapely.STRtree(shapely.points(self.x, self.y))
+        self.extent = (self.x.min(), self.y.min(), self.x.max(), self.y.max()) if len(self.x) else None
+        self.clinic_keys = arrays['clinic_keys']
+        # 科別 -> 布林陣列（依第一次出現的順序）
+        self.specialty_masks = dict(zip(arrays['specialties'].tolist(), arrays['specialty_masks']))
+    
+    @staticmethod
+    def _build_arrays(clinic_data, transformer):
+        x, y = transformer.transform(clinic_data['經度'].to_numpy(dtype=float), clinic_data['緯度'].to_numpy(dtype=float))
+        # 相同機構名稱與地址視為同一間診所（與 /api/clinics 的去重方式相同）
+        clinic_keys = pd.MultiIndex.from_frame(clinic_data[['機構名稱', '地址']].astype(str)).factorize()[0]
+        specialties = {}
+        for specialty_sets in clinic_data['標準科別']:
+            for specialty in specialty_sets:
+                specialties.setdefault(specialty, len(specialties))
+        specialty_masks = np.zeros((len(specialties), len(clinic_data)), dtype=bool)
+        for position, specialty_sets in enumerate(clinic_data['標準科別']):
+            for specialty in specialty_sets:
+                specialty_masks[specialties[specialty], position] = True
+        return {
+            'x': np.asarray(x, dtype=float),
+            'y': np.asarray(y, dtype=float),
+            'clinic_keys': np.asarray(clinic_keys),
+            'specialties': np.array(list(specialties), dtype=str),
+            'specialty_masks': specialty_masks,
+        }
+    
+    def shared_arrays(self):
+        """寫入共享目錄的陣列"""
+        return {
+            'x': self.x,
+            'y': self.y,
+            'clinic_keys': self.clinic_keys,
+            'specialties': np.array(list(self.specialty_masks), dtype=str),
+            'specialty_masks': np.array(list(self.specialty_masks.values()), dtype=bool).reshape(len(self.specialty_masks), len(self.x)),
+        }
+    
+    def _within(self, x, y, radius, allowed):
+        """半徑內（公尺）的診所列位置與距離，依距離排序並去除重複的診所"""
+        positions = self.tree.query(shapely.box(x - radius, y - radius, x + radius, y + radius))
+        if allowed is not None:
+            positions = positions[allowed[positions]]
+        distances = np.hypot(self.x[positions] - x, self.y[positions] - y)
+        inside = distances <= radius
+        positions, distances = positions[inside], distances[inside]
+        order = np.lexsort((positions, distances))
+        positions, distances = positions[order], distances[order]
+        _, first = np.unique(self.clinic_keys[positions], return_index=True)
+        first.sort()
+        return positions[first], distances[first]
+    
+    def query(self, lat, lon, radius_km=None, k=None, specialties=None):
+        """
+        查詢某點附近的診所
+        
+        Args:
+            radius_km: 搜尋半徑（公里），None 表示不限
+            k: 最多返回的最近診所數量，None 表示返回半徑內全部
+            specialties: 科別集合（符合任一即可），None 表示不篩選
+        
+        Returns:
+            (列位置陣列, 距離陣列（公尺）)，依距離排序
+        """
+        allowed = None
+        if specialties:
+            allowed = np.zeros(len(self.x), dtype=bool)
+            for specialty in specialties:
+                if specialty in self.specialty_masks:
+                    allowed |= self.specialty_masks[specialty]
+        if self.extent is None:
+            return np.array([], dtype=np.intp), np.array([])
+        x, y = self.transformer.transform(lon, lat)
+        if k is None:
+            return self._within(x, y, radius_km * 1000, allowed)
+        
+        # 最近 k 間：由小範圍開始逐步擴大，範圍內已有 k 間時，範圍外的診所必定更遠
+        min_x, min_y, max_x, max_y = self.extent
+        farthest = np.hypot(max(abs(x - min_x), abs(x - max_x)), max(abs(y - min_y), abs(y - max_y)))
+        limit = farthest if radius_km is None else min(radius_km * 1000, farthest)
+        radius = min(2000.0, limit)
+        while True:
+            positions, distances = self._within(x, y, radius, allowed)
+            if len(positions) >= k or radius >= limit:
+                return positions[:k], distances[:k]
+            radius = min(radius * 4, limit)
+    
+    def within(self, geometry):
+        """多邊形（TWD97 TM2 座標）內與邊界上的診所列位置，去除重複的診所"""
+        positions = self.tree.query(geometry, predicate='intersects')
+        _, first = np.unique(self.clinic_keys[positions], return_index=True)
+        return np.sort(positions[first])
+
+def build_clinic_index(snapshot, stage_timer):
+    """建置快照的診所空間索引"""
+    clinic_index = ClinicSpatialIndex(snapshot.clinic_data)
+    print(f"診所空間索引: {len(clinic_index.x)} 間診所，{len(clinic_index.specialty_masks)} 種科別")
+    stage_timer.mark('clinic_index')
+    return clinic_index
+
+# 診所供需分數：可用的服務半徑（公里，每個半徑快取一份所有村里 × 科別的矩陣）
+CLINIC_GAP_RADII_KM = (1, 2, 3, 5, 10)
+CLINIC_GAP_DEFAULT_RADIUS_KM = 3
+CLINIC_GAP_ALL_SPECIALTIES = '全部'
+
+def compute_clinic_gaps(snapshot, radius_km):
+    """
+    計算所有村里（village_data 每一列）在服務半徑內各科別的診所數，以及每間診所服務人口的全國百分位
+    
+    以村里中心點一次批次查詢診所 STRtree（dwithin，EPSG:3826 公尺），相同機構名稱與地址的診所只計算一次；
+    每間診所服務人口為 人口數 / (半徑內診所數 + 1)，百分位越高表示供給越不足
+    
+    Returns:
+        dict: 'specialties'（第 0 欄為全部科別）、'clinic_counts'（村里 × 科別）、'population_per_clinic'、
+              'supply_ranks'（村里 × 科別，0-1）、'population'、'median_income'、'income_ranks'（每個村里）與 'pairs'
+    """
+    index = snapshot.clinic_index
+    registry, indicators = snapshot.village_registry, snapshot.village_indicators
+    village_data = snapshot.village_data
+    size = len(village_data)
+    population = _indicator_array(indicators['population'])[registry.ids['village']]
+    median_income = _indicator_array(indicators['median_income'])[registry.ids['village']]
+    
+    x, y = index.transformer.transform(village_data['center_lon'].to_numpy(dtype=float),
+                                       village_data['center_lat'].to_numpy(dtype=float))
+    x, y = np.asarray(x), np.asarray(y)
+    positions = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    village_hits, clinic_hits = index.tree.query(shapely.points(x[positions], y[positions]),
+                                                 predicate='dwithin', distance=radius_km * 1000)
+    _, first_rows = np.unique(index.clinic_keys, return_index=True)
+    representative = np.zeros(len(index.x), dtype=bool)
+    representative[first_rows] = True
+    keep = representative[clinic_hits]
+    village_hits, clinic_hits = positions[village_hits[keep]], clinic_hits[keep]
+    
+    specialties = [CLINIC_GAP_ALL_SPECIALTIES] + sorted(index.specialty_masks)
+    clinic_counts = np.zeros((size, len(specialties)), dtype=np.int32)
+    clinic_counts[:, 0] = np.bincount(village_hits, minlength=size)
+    for column, specialty in enumerate(specialties[1:], 1):
+        clinic_counts[:, column] = np.bincount(village_hits[index.specialty_masks[specialty][clinic_hits]], minlength=size)
+    
+    population_per_clinic = population[:, None] / (clinic_counts + 1)
+    return {
+        'specialties': specialties,
+        'clinic_counts': clinic_counts,
+        'population_per_clinic': population_per_clinic,
+        'supply_ranks': pd.DataFrame(population_per_clinic).rank(pct=True).to_numpy(),
+        'population': population,
+        'median_income': median_income,
+        'income_ranks': pd.Series(median_income).rank(pct=True).to_numpy(),
+        'pairs': len(village_hits),
+    }
+
+# 六角形網格圖層：可用的網格大小（公里，相鄰網格中心的距離），每個大小於第一次查詢時建置並隨快照快取
+HEX_CELL_SIZES_KM = (1, 2, 5, 10)
+HEX_DEFAULT_CELL_KM = 5
+
+def _hexagon_vertices(x, y, width):
+    """尖頂六角形（相鄰網格中心距離為 width）的封閉頂點座標，形狀為 (網格數, 7, 2)"""
+    radius = width / math.sqrt(3)
+    angles = np.radians(30 + 60 * np.arange(7))
+    return np.stack([x[:, None] + radius * np.cos(angles), y[:, None] + radius * np.sin(angles)], axis=-1)
+
+def _ring_signed_areas(x, y, ring_of, size):
+    """每個環的有號面積（鞋帶公式，環以 ring_of 分組、頂點連續且不含重複的結尾頂點）"""
+    following = np.arange(1, len(ring_of) + 1)
+    last = np.flatnonzero(np.r_[ring_of[1:] != ring_of[:-1], True]) if len(ring_of) else np.zeros(0, dtype=np.intp)
+    following[last] = np.r_[0, last[:-1] + 1]
+    return np.bincount(ring_of, weights=x * y[following] - x[following] * y, minlength=size) / 2
+
+def _hexagon_clip_areas(geometries, geometry_hits, centers_x, centers_y, width):
+    """
+    計算多邊形與六角形配對的交集面積：六角形為凸多邊形，以向量化的 Sutherland–Hodgman 演算法
+    將所有配對的環依序以六個邊的半平面裁切，再以鞋帶公式計算面積（比逐對計算多邊形交集快得多）
+    
+    Args:
+        geometries: 多邊形陣列（投影座標）
+        geometry_hits: 每個配對的多邊形位置
+        centers_x, centers_y: 每個配對的六角形中心
+        width: 六角形相鄰中心的距離（邊到中心的距離為 width / 2）
+    """
+    parts, part_of = shapely.get_parts(geometries, return_index=True)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coordinates, ring_of = shapely.get_coordinates(rings, return_index=True)
+    closing = np.r_[ring_of[1:] != ring_of[:-1], True]
+    coordinates, ring_of = coordinates[~closing], ring_of[~closing]
+    # 外環為每個部分的第一個環，內環（洞）的面積扣除；不假設環的方向
+    exterior = np.r_[True, ring_part[1:] != ring_part[:-1]]
+    ring_signs = np.where(exterior, 1.0, -1.0) * np.sign(_ring_signed_areas(coordinates[:, 0], coordinates[:, 1], ring_of, len(rings)))
+    ring_geometry = part_of[ring_part]
+    
+    # 展開每個配對的頂點：配對 p 取其多邊形的所有頂點，環編號改為（配對, 環）的流水號
+    vertex_starts = np.searchsorted(ring_geometry[ring_of], np.arange(len(geometries) + 1))
+    ring_starts = np.searchsorted(ring_geometry, np.arange(len(geometries) + 1))
+    vertex_counts = np.diff(vertex_starts)[geometry_hits]
+    ring_counts = np.diff(ring_starts)[geometry_hits]
+    pair_of = np.repeat(np.arange(len(geometry_hits)), vertex_counts)
+    vertex_offsets = np.cumsum(vertex_counts) - vertex_counts
+    vertices = vertex_starts[geometry_hits][pair_of] + np.arange(len(pair_of)) - vertex_offsets[pair_of]
+    ring_offsets = np.cumsum(ring_counts) - ring_counts
+    group = ring_of[vertices] - ring_starts[geometry_hits][pair_of] + ring_offsets[pair_of]
+    group_rings = np.repeat(ring_starts[geometry_hits], ring_counts) + np.arange(ring_counts.sum()) - np.repeat(ring_offsets, ring_counts)
+    x = coordinates[vertices, 0] - centers_x[pair_of]
+    y = coordinates[vertices, 1] - centers_y[pair_of]
+    
+    half = width / 2
+    for angle in np.radians(60 * np.arange(6)):
+        # 每個頂點依序輸出：與前一個頂點跨越邊界時的交點，以及在半平面內時的頂點本身
+        distance = x * math.cos(angle) + y * math.sin(angle) - half
+        inside = distance <= 0
+        previous = np.arange(-1, len(group) - 1)
+        first = np.flatnonzero(np.r_[True, group[1:] != group[:-1]]) if len(group) else np.zeros(0, dtype=np.intp)
+        previous[first] = np.r_[first[1:], len(group)] - 1
+        crossing = inside != inside[previous]
+        emitted = crossing.astype(np.intp) + inside
+        offsets = np.cumsum(emitted) - emitted
+        new_x, new_y = np.empty(emitted.sum()), np.empty(emitted.sum())
+        new_group = np.empty(emitted.sum(), dtype=group.dtype)
+        rows = np.flatnonzero(crossing)
+        t = distance[previous[rows]] / (distance[previous[rows]] - distance[rows])
+        new_x[offsets[rows]] = x[previous[rows]] + t * (x[rows] - x[previous[rows]])
+        new_y[offsets[rows]] = y[previous[rows]] + t * (y[rows] - y[previous[rows]])
+        new_group[offsets[rows]] = group[rows]
+        rows = np.flatnonzero(inside)
+        positions = offsets[rows] + crossing[rows]
+        new_x[positions], new_y[positions], new_group[positions] = x[rows], y[rows], group[rows]
+        x, y, group = new_x, new_y, new_group
+    
+    areas = _ring_signed_areas(x, y, group, len(group_rings)) * ring_signs[group_rings]
+    return np.bincount(np.repeat(np.arange(len(geometry_hits)), ring_counts), weights=areas, minlength=len(geometry_hits))
+
+def compute_hex_grid(snapshot, cell_km):
+    """
+    建置覆蓋台灣的等面積六角形網格（EPSG:3826，網格以座標原點對齊，不隨資料範圍移動），並彙總每格的人口、薪資與各科別診所數
+    
+    村里多邊形投影後以網格的 STRtree 批次找出相交的配對，交集面積以向量化的凸多邊形裁切計算；
+    村里人口依落在網格內的面積比例分配，薪資中位數以分配後的人口加權平均。
+    診所依座標歸入所在的網格，相同機構名稱與地址只計算一次。只保留與村里相交的網格，
+    網格所屬縣市為網格內面積最大的村里所屬縣市
     
-    # 計算薪資九等分分級
-    income_ranges = []
-    if county_village_incomes:
+    Returns:
+        dict: 'cell_km'、'cell_area_km2'、'geometry'（WGS84 六角形陣列）、'center_lat'、'center_lon'、'county_ids'、'land_km2'、
+              'population'、'median_income'、'population_density'、'specialties'（第 0 欄為全部科別）、'clinic_counts'（網格 × 科別）
+    """
+    from pyproj import Transformer
+    index, locator = snapshot.clinic_index, snapshot.village_locator
+    registry, indicators = snapshot.village_registry, snapshot.village_indicators
+    width = cell_km * 1000
+    cell_area = width * width * math.sqrt(3) / 2
+    
+    villages = shapely.transform(locator.geometries, lambda xy: np.column_stack(index.transformer.transform(xy[:, 0], xy[:, 1])))
+    village_areas = shapely.area(villages)
+    min_x, min_y, max_x, max_y = shapely.total_bounds(villages)
+    row_height = width * math.sqrt(3) / 2
+    grid_rows, grid_columns = np.meshgrid(np.arange(math.floor(min_y / row_height), math.ceil(max_y / row_height) + 1),
+                                          np.arange(math.floor(min_x / width) - 1, math.ceil(max_x / width) + 1), indexing='ij')
+    centers_x = ((grid_columns + (grid_rows % 2) * 0.5) * width).ravel()
+    centers_y = (grid_rows * row_height).ravel()
+    cells = shapely.polygons(_hexagon_vertices(centers_x, centers_y, width))
+    cell_tree = shapely.STRtree(cells)
+    
+    village_hits, cell_hits = cell_tree.query(villages, predicate='intersects')
+    areas = _hexagon_clip_areas(villages, village_hits, centers_x[cell_hits], centers_y[cell_hits], width)
+    keep = areas > 0
+    village_hits, cell_hits, areas = village_hits[keep], cell_hits[keep], areas[keep]
+    kept, positions = np.unique(cell_hits, return_inverse=True)
+    size = len(kept)
+    
+    # 村里人口依面積比例分配（同一村里有多個多邊形時以合計面積為分母）
+    village_ids = registry.ids['village'][village_hits]
+    id_areas = np.bincount(registry.ids['village'], weights=village_areas, minlength=len(registry.keys))[village_ids]
+    population = _indicator_array(indicators['population'])[village_ids]
+    income = _indicator_array(indicators['median_income'])[village_ids]
+    shares = np.divide(areas, id_areas, out=np.zeros_like(areas), where=id_areas > 0) * population
+    has_population = ~np.isnan(shares)
+    weighted = has_population & ~np.isnan(income)
+    cell_population = np.bincount(positions[has_population], weights=shares[has_population], minlength=size)
+    cell_population[np.bincount(positions[has_population], minlength=size) == 0] = np.nan
+    income_sum = np.bincount(positions[weighted], weights=(income * shares)[weighted], minlength=size)
+    weight_sum = np.bincount(positions[weighted], weights=shares[weighted], minlength=size)
+    median_income = np.divide(income_sum, weight_sum, out=np.full(size, np.nan), where=weight_sum > 0)
+    order = np.lexsort((-areas, positions))
+    _, first = np.unique(positions[order], return_index=True)
+    county_ids = registry.county_of[village_ids[order[first]]]
+    
+    # 診所：每個機構只取一列，落在兩個網格邊界上時取編號較小者
+    _, representative = np.unique(index.clinic_keys, return_index=True)
+    clinic_hits, clinic_cells = cell_tree.query(shapely.points(index.x[representative], index.y[representative]), predicate='intersects')
+    order = np.lexsort((clinic_cells, clinic_hits))
+    clinic_hits, clinic_cells = clinic_hits[order], clinic_cells[order]
+    _, first = np.unique(clinic_hits, return_index=True)
+    cell_lookup = np.full(len(cells), -1)
+    cell_lookup[kept] = np.arange(size)
+    clinic_positions = cell_lookup[clinic_cells[first]]
+    on_land = clinic_positions >= 0
+    clinic_rows, clinic_positions = representative[clinic_hits[first][on_land]], clinic_positions[on_land]
+    specialties = [CLINIC_GAP_ALL_SPECIALTIES] + sorted(index.specialty_masks)
+    clinic_counts = np.zeros((size, len(specialties)), dtype=np.int32)
+    clinic_counts[:, 0] = np.bincount(clinic_positions, minlength=size)
+    for column, specialty in enumerate(specialties[1:], 1):
+        clinic_counts[:, column] = np.bincount(clinic_positions[index.specialty_masks[specialty][clinic_rows]], minlength=size)
+    
+    # 輸出的六角形頂點轉回經緯度
+    to_wgs84 = Transformer.from_crs(PROJECTED_CRS, 'EPSG:4326', always_xy=True)
+    vertices = _hexagon_vertices(centers_x[kept], centers_y[kept], width)
+    vertices = np.stack(to_wgs84.transform(vertices[..., 0], vertices[..., 1]), axis=-1)
+    if GEOMETRY_GRID_SIZE > 0:
+        # 六角形不需要與村里界共用頂點，四捨五入到格網精度的小數位數即可（set_precision 對大量網格很慢）
+        vertices = np.round(vertices, max(0, math.ceil(-math.log10(GEOMETRY_GRID_SIZE) - 1e-9)))
+    geometry = shapely.polygons(vertices)
+    center_lon, center_lat = to_wgs84.transform(centers_x[kept], centers_y[kept])
+    return {
+        'cell_km': cell_km,
+        'cell_area_km2': cell_area / 1e6,
+        'geometry': geometry,
+        'center_lat': np.asarray(center_lat),
+        'center_lon': np.asarray(center_lon),
+        'county_ids': county_ids,
+        'land_km2': np.bincount(positions, weights=areas, minlength=size) / 1e6,
+        'population': cell_population,
+        'median_income': median_income,
+        'population_density': cell_population / (cell_area / 1e6),
+        'specialties': specialties,
+        'clinic_counts': clinic_counts,
+        'pairs': len(cell_hits),
+        'clinics_outside': int((~on_land).sum()) + len(representative) - len(first),
+    }
+
+def get_hex_grid(snapshot, cell_km):
+    """返回快照中指定大小的六角形網格（第一次查詢時建置）"""
+    if cell_km not in snapshot.hex_grid_cache:
+        started = time.perf_counter()
+        grid = compute_hex_grid(snapshot, cell_km)
+        snapshot.hex_grid_cache[cell_km] = grid
+        logger.info("六角形網格（%s km）: %d 格，%d 組網格與村里配對，%d 間診所不在網格內（%.2fs）",
+                    cell_km, len(grid['geometry']), grid['pairs'], grid['clinics_outside'], time.perf_counter() - started)
+    return snapshot.hex_grid_cache[cell_km]
+
+LOCATE_MAX_POINTS = 10000
+
+class VillageLocator:
+    """
+    以座標查詢所在村里：村里多邊形預先 prepare 後建立 STRtree，批次查詢一次完成所有點的空間比對
+    
+    每個村里的回應內容（名稱、薪資、人口密度與縣市內等級）在建置時預先組好
+    """
+    
+    def __init__(self, village_data, registry, indicators):
+        self.geometries = np.asarray(village_data.geometry.values)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+        # 面積涵蓋比例以經緯度面積計算（同一村里範圍內的投影變形可忽略），同一村里有多個多邊形時合併計算
+        self.village_ids = registry.ids['village']
+        self.row_areas = shapely.area(self.geometries)
+        self.village_areas = np.bincount(self.village_ids, weights=self.row_areas, minlength=len(registry.keys))
+        
+        village_ids = registry.ids['village'].tolist()
+        incomes = [indicators['median_income'][village_id] for village_id in village_ids]
+        densities = [indicators['population_density'][village_id] for village_id in village_ids]
+        # 等級與 /api/villages 相同：在同一縣市的村里之間分級
+        income_levels = [0] * len(village_ids)
+        density_levels = [0] * len(village_ids)
+        county_of_rows = registry.county_of[registry.ids['village']]
+        for county_id in np.unique(county_of_rows):
+            rows = np.flatnonzero(county_of_rows == county_id).tolist()
+            county_incomes = [incomes[row] for row in rows]
+            county_densities = [densities[row] for row in rows]
+            for row, level in zip(rows, classify_levels(county_incomes, [v for v in county_incomes if v is not None])):
+                income_levels[row] = level
+            for row, level in zip(rows, classify_levels(county_densities, [v for v in county_densities if v is not None])):
+                density_levels[row] = level
+        
+        self.properties = [
+            {
+                "county": str(county),
+                "district": str(district),
+                "village": str(village),
+                "median_income": income,
+                "population_density": density,
+                "income_level": income_level,
+                "density_level": density_level,
+                "area_km2": float(area_km2),
+                "center_lat": _optional_float(center_lat),
+                "center_lon": _optional_float(center_lon)
+            }
+            for county, district, village, income, density, income_level, density_level, area_km2, center_lat, center_lon in zip(
+                village_data['COUNTYNAME'], village_data['TOWNNAME'], village_data['VILLNAME'], incomes, densities,
+                income_levels, density_levels, village_data['area_km2'], village_data['center_lat'], village_data['center_lon'])
+        ]
+    
+    def locate(self, lats, lons):
+        """
+        批次查詢每個點所在的村里
+        
+        Returns:
+            ndarray: 每個點對應的村里列位置，不在任何村里內為 -1（落在相鄰村里的邊界上時取列位置較小者）
+        """
+        points = shapely.points(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+        point_index, geometry_index = self.tree.query(points, predicate='intersects')
+        result = np.full(len(points), -1, dtype=np.intp)
+        order = np.lexsort((geometry_index, point_index))
+        point_index, geometry_index = point_index[order], geometry_index[order]
+        _, first = np.unique(point_index, return_index=True)
+        result[point_index[first]] = geometry_index[first]
+        return result
+    
+    def coverage(self, polygon):
+        """
+        查詢與多邊形相交的村里及其被涵蓋的面積比例
+        
+        多邊形 prepare 後以 STRtree 批次找出相交的村里，完全在範圍內的村里以 covers 批次判定（比例為 1），
+        只有跨越邊界的村里才計算交集面積
+        
+        Returns:
+            (村里 ID 陣列, 涵蓋比例陣列, 每個村里的代表列位置)，只包含涵蓋面積大於零的村里（沒有相交時皆為空陣列）
+        """
+        shapely.prepare(polygon)
+        rows = self.tree.query(polygon, predicate='intersects')
+        if len(rows) == 0:
+            return self.village_ids[:0], np.zeros(0), rows
+        geometries = self.geometries[rows]
+        areas = self.row_areas[rows].copy()
+        partial = ~shapely.covers(polygon, geometries)
+        areas[partial] = shapely.area(shapely.intersection(geometries[partial], polygon))
+        village_ids, first, inverse = np.unique(self.village_ids[rows], return_index=True, return_inverse=True)
+        covered = np.bincount(inverse, weights=areas, minlength=len(village_ids))
+        total = self.village_areas[village_ids]
+        fractions = np.minimum(np.divide(covered, total, out=np.ones_like(covered, dtype=float), where=total > 0), 1.0)
+        keep = covered > 0
+        return village_ids[keep], fractions[keep], rows[first[keep]]
+
+def build_village_locator(snapshot, stage_timer):
+    """建置快照的座標查詢村里索引"""
+    locator = VillageLocator(snapshot.village_data, snapshot.village_registry, snapshot.village_indicators)
+    print(f"村里定位索引: {len(locator.geometries)} 個村里多邊形")
+    stage_timer.mark('village_locator')
+    return locator
+
+def validate_snapshot(snapshot, previous=None):
+    """
+    檢查新快照是否完整可用，有問題時拋出 ValueError（舊快照會繼續服務）
+    
+    除了必要欄位與矩陣形狀外，資料筆數比舊快照少一半以上時也視為異常
+    （通常是檔案尚未複製完成或格式錯誤）
+    """
+    problems = []
+    required_columns = {
+        'county_data': ['geometry', 'center_lat', 'center_lon'],
+        'village_data': ['geometry', 'COUNTYNAME', 'TOWNNAME', 'VILLNAME', 'area_km2'],
+        'district_data': ['geometry', 'COUNTYNAME', 'TOWNNAME', 'area_km2', 'village_count'],
+        'salary_data': ['縣市', '鄉鎮市區', '村里', '中位數', '平均數', '綜合所得總額', '年份'],
+        'population_data': ['縣市', '鄉鎮市區', '村里', '人口數'],
+        'population_history': ['縣市', '鄉鎮市區', '村里', '戶數', '人口數', '年份', '月份'],
+        'clinic_data': ['縣市', '縣市區名', '經度', '緯度', '標準科別'],
+    }
+    for field, columns in required_columns.items():
+        frame = getattr(snapshot, field)
+        if frame is None or len(frame) == 0:
+            problems.append(f"{field} 沒有資料")
+            continue
+        missing = [column for column in columns if column not in frame.columns]
+        if missing:
+            problems.append(f"{field} 缺少欄位 {missing}")
+        if previous is not None and getattr(previous, field) is not None and len(frame) < len(getattr(previous, field)) / 2:
+            problems.append(f"{field} 筆數由 {len(getattr(previous, field))} 減少為 {len(frame)}")
+    
+    for scheme in INSURANCE_TABLE_PATHS:
+        table = snapshot.insurance_brackets.get(scheme)
+        if table is None or len(table) == 0:
+            problems.append(f"{INSURANCE_SCHEME_NAMES[scheme]}分級表沒有資料")
+            continue
+        missing = [column for column in INSURANCE_REQUIRED_COLUMNS[scheme] if column not in table.columns]
+        if missing:
+            problems.append(f"{INSURANCE_SCHEME_NAMES[scheme]}分級表缺少欄位 {missing}")
+        elif not (np.diff(table['base_salary'].to_numpy()) > 0).all():
+            problems.append(f"{INSURANCE_SCHEME_NAMES[scheme]}分級表的投保金額重複")
+    
+    matrix = snapshot.salary_matrix
+    expected_shape = (len(matrix['villages']), len(matrix['years']))
+    for metric, values in matrix['matrices'].items():
+        if values.shape != expected_shape:
+            problems.append(f"薪資矩陣 {metric} 形狀 {values.shape} 與 {expected_shape} 不符")
+    
+    if problems:
+        raise ValueError("資料驗證失敗：" + "；".join(problems))
+
+def build_snapshot(previous=None, datasets=None):
+    """
+    建置新的資料快照（不會替換目前的快照）
+    
+    Args:
+        previous: 目前的快照，未重建的資料集直接沿用
+        datasets: 需要重建的資料集名稱（None 表示全部重建）
+    
+    Returns:
+        DataSnapshot: 已通過驗證的新快照
+    """
+    signatures = compute_dataset_signatures()
+    if previous is None or datasets is None:
+        datasets = set(DATASET_FIELDS)
+    datasets = set(datasets)
+    for name, dependencies in DATASET_DEPENDENCIES.items():
+        if datasets.intersection(dependencies):
+            datasets.add(name)
+    
+    print(f"=== 開始載入資料：{sorted(datasets)} ===")
+    stage_timings = {}
+    stage_timer = StageTimer(stage_timings)
+    fields = previous.datasets() if previous is not None else {}
+    
+    print("正在載入地理資料...")
+    if 'county' in datasets:
+        fields.update(load_county_geometry(stage_timer))
+    if 'village' in datasets:
+        fields.update(load_village_geometry(stage_timer))
+    if 'salary' in datasets:
+        fields.update(load_salary(stage_timer))
+    if 'population' in datasets:
+        fields.update(load_population(stage_timer))
+    if 'clinic' in datasets:
+        fields.update(load_clinics(stage_timer))
+    if 'insurance' in datasets:
+        fields.update(load_insurance(stage_timer))
+    
+    # 釋放載入過程中的暫存物件
+    import gc
+    gc.collect()
+    
+    # 沿用的資料集保留原本的簽章，使之後仍能偵測到它們的變更
+    if previous is not None:
+        signatures = {name: (signature if name in datasets else previous.signatures.get(name))
+                      for name, signature in signatures.items()}
+    snapshot = DataSnapshot('processed', signatures, stage_timings, **fields)
+    validate_snapshot(snapshot, previous)
+    stage_timer.mark('validate')
+    build_derived_indexes(snapshot, stage_timer)
+    
+    stage_timer.finish()
+    print("各階段耗時：" + ", ".join(f"{stage}={seconds:.2f}s" for stage, seconds in stage_timings.items()))
+    return snapshot
+
+def install_snapshot(snapshot):
+    """以新快照原子性地替換目前的快照，並清除以舊資料建置的回應快取"""
+    global data_snapshot
+    previous = data_snapshot
+    snapshot.version = previous.version + 1 if previous is not None else 1
+    data_snapshot = snapshot
+    clear_response_cache()
+    logger.info("已切換至資料快照 v%d（%s）", snapshot.version, snapshot.source)
+    cache_warmer.schedule()
+
+def current_snapshot():
+    """返回目前的資料快照，尚未載入時回應 503"""
+    snapshot = data_snapshot
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="資料尚未載入")
+    return snapshot
+
+def load_and_process_data():
+    """載入並處理所有地理、薪資、人口和診所資料，並設為目前的快照"""
+    snapshot = build_snapshot()
+    install_snapshot(snapshot)
+    return snapshot
+
+def get_dataset_inputs():
+    """返回各資料集的原始輸入檔案"""
+    return {
+        'county': [COUNTY_GEOJSON_PATH],
+        'village': [VILLAGE_GEOJSON_PATH],
+        'salary': get_salary_files(),
+        'population': sorted(POPULATION_DATA_DIR.glob("*_standardized.csv")),
+        'clinic': [CLINIC_DATA_PATH],
+        'insurance': list(INSURANCE_TABLE_PATHS.values()),
+    }
+
+def get_input_files():
+    """返回所有原始輸入檔案路徑（用於判斷共享資料是否過期）"""
+    return [file_path for files in get_dataset_inputs().values() for file_path in files]
+
+def _file_signature(files):
+    """根據檔案的路徑、大小與修改時間計算簽章"""
+    digest = hashlib.sha256(f"format-{SHARED_DATA_FORMAT_VERSION}".encode())
+    for file_path in files:
+        if file_path.exists():
+            stat = file_path.stat()
+            digest.update(f"{file_path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+def compute_dataset_signatures():
+    """計算每個資料集輸入檔案的簽章（用於判斷哪些資料集需要重新載入）"""
+    return {name: _file_signature(files) for name, files in get_dataset_inputs().items()}
+
+def compute_input_signature():
+    """根據所有輸入檔案的路徑、大小與修改時間計算簽章"""
+    return _file_signature(get_input_files())
+
+def _write_arrow_table(df, file_path):
+    """將 DataFrame 寫成未壓縮的 Arrow IPC（Feather v2）檔案，以便記憶體映射"""
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    feather.write_feather(table, file_path, compression='uncompressed')
+
+def _read_arrow_table(file_path):
+    """以記憶體映射方式讀取 Arrow IPC 檔案，數值欄位不另外複製"""
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    table = feather.read_table(file_path, memory_map=True)
+    # 字串欄位維持 Arrow 儲存，避免還原成 Python 字串物件
+    string_types = {pa.string(): pd.StringDtype('pyarrow'), pa.large_string(): pd.StringDtype('pyarrow')}
+    return table.to_pandas(split_blocks=True, types_mapper=string_types.get)
+
+def _save_arrays(target_dir, component, arrays):
+    """將陣列寫成 {component}_{name}.npy（不含 Python 物件，可直接映射），返回陣列名稱清單"""
+    for name, values in arrays.items():
+        np.save(target_dir / f"{component}_{name}.npy", np.asarray(values), allow_pickle=False)
+    return list(arrays)
+
+def _load_arrays(source_dir, component, names):
+    """以唯讀記憶體映射讀取 _save_arrays 寫入的陣列"""
+    return {name: np.asarray(np.load(source_dir / f"{component}_{name}.npy", mmap_mode='r')) for name in names}
+
+def _save_geometries(target_dir, component, values):
+    """
+    將幾何陣列以座標緩衝區（shapely.to_ragged_array 的座標與各層偏移量）寫入共享目錄，返回附掛時需要的描述
+    
+    Polygon 與 MultiPolygon 混合時緩衝區統一為 MultiPolygon，另存每列的幾何類型以還原；
+    含有其他類型（make_valid 後無法取出面的幾何）時改存 WKB
+    """
+    values = np.asarray(values)
+    try:
+        geometry_type, coordinates, offsets = shapely.to_ragged_array(values)
+    except ValueError:
+        _write_arrow_table(pd.DataFrame({'geometry': shapely.to_wkb(values)}), target_dir / f"{component}_geometry.arrow")
+        return {'format': 'wkb'}
+    arrays = {'coordinates': coordinates, 'types': shapely.get_type_id(values).astype(np.int8)}
+    arrays.update({f'offsets_{level}': level_offsets for level, level_offsets in enumerate(offsets)})
+    return {'format': 'ragged', 'geometry_type': int(geometry_type), 'levels': len(offsets),
+            'arrays': _save_arrays(target_dir, component, arrays)}
+
+def _load_geometries(source_dir, component, state):
+    """由 _save_geometries 寫入的座標緩衝區建立幾何陣列（GEOS 物件由每個 worker 各自建立）"""
+    if state['format'] == 'wkb':
+        return shapely.from_wkb(_read_arrow_table(source_dir / f"{component}_geometry.arrow")['geometry'].to_numpy())
+    arrays = _load_arrays(source_dir, component, state['arrays'])
+    offsets = tuple(arrays[f'offsets_{level}'] for level in range(state['levels']))
+    values = shapely.from_ragged_array(shapely.GeometryType(state['geometry_type']), arrays['coordinates'], offsets)
+    types = arrays['types']
+    polygons = np.flatnonzero(types == shapely.GeometryType.POLYGON)
+    values[polygons] = shapely.get_geometry(values[polygons], 0)
+    values[polygons[shapely.is_missing(values[polygons])]] = shapely.Polygon()
+    values[types < 0] = None
+    return values
+
+def _attach_geodataframe(source_dir, component, state, built_frame=None):
+    """讀取共享目錄中的 GeoDataFrame，建置者直接沿用已建立的幾何"""
+    frame = _read_arrow_table(source_dir / f"{component}.arrow")
+    if built_frame is not None:
+        geometries = built_frame.geometry.values
+    else:
+        geometries = _load_geometries(source_dir, component, state)
+    return gpd.GeoDataFrame(frame, geometry=geometries, crs='EPSG:4326')
+
+# 寫入共享目錄的診所供需矩陣（預設服務半徑）
+CLINIC_GAP_ARRAYS = ('clinic_counts', 'population_per_clinic', 'supply_ranks', 'population', 'median_income', 'income_ranks')
+SUMMARY_TABLE_NAMES = ('income', 'density', 'clinics')
+
+def _optional_list(values, cast=float):
+    """_indicator_array 的反向：NaN 還原為 None"""
+    return [None if math.isnan(value) else cast(value) for value in values.tolist()]
+
+def export_derived_indexes(snapshot, target_dir):
+    """
+    將推導的索引寫入共享目錄，附掛的 worker 不必重新建立，返回 indexes.json 中的描述
+    
+    村里編號、搜尋索引、診所投影座標與科別陣列、村里與鄉鎮市區指標、預設半徑的診所供需矩陣寫成 .npy，
+    統計摘要寫成 Arrow，名稱清單與對應率等小型資料寫入 indexes.json
+    """
+    registry_arrays, registry_state = snapshot.village_registry.shared_state()
+    district = snapshot.district_indicators
+    gaps = snapshot.clinic_gap_cache[CLINIC_GAP_DEFAULT_RADIUS_KM]
+    summaries = snapshot.summary_tables
+    for name in SUMMARY_TABLE_NAMES:
+        _write_arrow_table(summaries[name].reset_index(), target_dir / f"summary_{name}.arrow")
+    return {
+        'registry': registry_state,
+        'arrays': {
+            'registry': _save_arrays(target_dir, 'registry', registry_arrays),
+            'search': _save_arrays(target_dir, 'search', snapshot.search_index.shared_arrays()),
+            'clinic_index': _save_arrays(target_dir, 'clinic_index', snapshot.clinic_index.shared_arrays()),
+            'village_indicators': _save_arrays(target_dir, 'village_indicators', {
+                name: _indicator_array(values) for name, values in snapshot.village_indicators.items()}),
+            'district_indicators': _save_arrays(target_dir, 'district_indicators', {
+                name: values if name == 'county_ids' else _indicator_array(values) for name, values in district.items()}),
+            'clinic_gaps': _save_arrays(target_dir, 'clinic_gaps', {name: gaps[name] for name in CLINIC_GAP_ARRAYS}),
+        },
+        # 指標列表的數值型別（薪資欄位可能是整數），還原時維持相同的 JSON 輸出
+        'village_indicator_types': {name: 'int' if all(isinstance(value, int) for value in values if value is not None) else 'float'
+                                    for name, values in snapshot.village_indicators.items()},
+        'clinic_gaps': {'radius_km': CLINIC_GAP_DEFAULT_RADIUS_KM, 'specialties': gaps['specialties'], 'pairs': gaps['pairs']},
+        'summaries': {'scopes': summaries['scopes'], 'years': summaries['years'],
+                      'index': {name: list(summaries[name].index.names) for name in SUMMARY_TABLE_NAMES}},
+    }
+
+def attach_derived_indexes(snapshot, source_dir, state, stage_timer, built=None):
+    """
+    由共享目錄還原推導的索引，陣列皆為唯讀映射，不重新計算
+    
+    每個 worker 仍各自建立的只有：GEOS 幾何的 STRtree（診所與村里定位）與村里定位的回應內容、
+    名稱 -> 編號的字典，以及小型的指標列表與統計摘要 DataFrame；建置者直接沿用已建立的 STRtree 與村里定位
+    """
+    import pyarrow.feather as feather
+    arrays = {component: _load_arrays(source_dir, component, names) for component, names in state['arrays'].items()}
+    registry = VillageRegistry.from_shared(name_normalizer, arrays['registry'], state['registry'])
+    snapshot.village_registry = registry
+    snapshot.village_indicators = {name: _optional_list(values, int if state['village_indicator_types'][name] == 'int' else float)
+                                   for name, values in arrays['village_indicators'].items()}
+    district = arrays['district_indicators']
+    snapshot.district_indicators = {
+        'county_ids': district['county_ids'],
+        'median_income': _optional_list(district['median_income']),
+        'population': _optional_list(district['population'], int),
+        'population_density': _optional_list(district['population_density']),
+        'clinic_count': district['clinic_count'].astype(np.int64).tolist(),
+    }
+    snapshot.search_index = SearchIndex(snapshot.village_data, snapshot.clinic_data, registry, arrays['search'])
+    summaries = state['summaries']
+    snapshot.summary_tables = {'scopes': summaries['scopes'], 'years': summaries['years']}
+    for name in SUMMARY_TABLE_NAMES:
+        table = feather.read_table(source_dir / f"summary_{name}.arrow", memory_map=True).to_pandas()
+        snapshot.summary_tables[name] = table.set_index(summaries['index'][name])
+    gaps = dict(arrays['clinic_gaps'], specialties=state['clinic_gaps']['specialties'], pairs=state['clinic_gaps']['pairs'])
+    snapshot.clinic_gap_cache[state['clinic_gaps']['radius_km']] = gaps
+    stage_timer.mark('derived_indexes')
+    
+    snapshot.clinic_index = ClinicSpatialIndex(snapshot.clinic_data, arrays['clinic_index'],
+                                               built.clinic_index.tree if built is not None else None)
+    stage_timer.mark('clinic_index')
+    if built is not None:
+        snapshot.village_locator = built.village_locator
+    else:
+        snapshot.village_locator = build_village_locator(snapshot, stage_timer)
+
+def export_shared_data(snapshot, target_dir):
+    """將已處理的資料快照（資料集、幾何座標緩衝區與推導的索引）寫入共享目錄"""
+    target_dir.mkdir(parents=True, exist_ok=True)
+    county_data, village_data, salary_data = snapshot.county_data, snapshot.village_data, snapshot.salary_data
+    population_data, clinic_data, salary_matrix = snapshot.population_data, snapshot.clinic_data, snapshot.salary_matrix
+    
+    geometries = {}
+    for component, gdf in (('county', county_data), ('village', village_data), ('district', snapshot.district_data)):
+        _write_arrow_table(pd.DataFrame(gdf.drop(columns=['geometry'])), target_dir / f"{component}.arrow")
+        geometries[component] = _save_geometries(target_dir, component, gdf.geometry.values)
+    _write_arrow_table(salary_data, target_dir / "salary.arrow")
+    _write_arrow_table(population_data, target_dir / "population.arrow")
+    _write_arrow_table(snapshot.population_history, target_dir / "population_history.arrow")
+    
+    clinic_frame = clinic_data.copy()
+    clinic_frame['標準科別'] = clinic_frame['標準科別'].map(sorted)
+    _write_arrow_table(clinic_frame, target_dir / "clinic.arrow")
+    
+    # 薪資矩陣以 .npy 儲存，可直接以 mmap_mode 映射
+    _write_arrow_table(pd.DataFrame({
+        '縣市': salary_matrix['counties'],
+        '鄉鎮市區': salary_matrix['districts'],
+        '村里': salary_matrix['villages']
+    }), target_dir / "salary_matrix_keys.arrow")
+    np.save(target_dir / "salary_matrix_years.npy", salary_matrix['years'])
+    for metric, matrix in salary_matrix['matrices'].items():
+        np.save(target_dir / f"salary_matrix_{metric}.npy", matrix)
+    for scheme, table in snapshot.insurance_brackets.items():
+        _write_arrow_table(table, target_dir / f"insurance_{scheme}.arrow")
+    
+    state = export_derived_indexes(snapshot, target_dir)
+    state['geometries'] = geometries
+    with open(target_dir / "indexes.json", 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+
+def attach_shared_data(source_dir, built=None):
+    """
+    以唯讀記憶體映射方式載入共享目錄中的資料，返回新的快照（尚未替換目前的快照）
+    
+    Args:
+        built: 剛寫入此共享目錄的快照（建置者本身），其幾何與空間索引直接沿用，不再由緩衝區建立
+    """
+    stage_timings = {}
+    stage_timer = StageTimer(stage_timings)
+    with open(source_dir / "indexes.json", encoding='utf-8') as f:
+        state = json.load(f)
+    
+    salary_data = _read_arrow_table(source_dir / "salary.arrow")
+    population_data = _read_arrow_table(source_dir / "population.arrow")
+    population_history = _read_arrow_table(source_dir / "population_history.arrow")
+    
+    clinic_data = _read_arrow_table(source_dir / "clinic.arrow")
+    clinic_data['標準科別'] = _intern_specialty_sets(clinic_data['標準科別'])
+    
+    keys = _read_arrow_table(source_dir / "salary_matrix_keys.arrow")
+    salary_matrix = {
+        'counties': keys['縣市'].to_numpy(),
+        'districts': keys['鄉鎮市區'].to_numpy(),
+        'villages': keys['村里'].to_numpy(),
+        'years': np.load(source_dir / "salary_matrix_years.npy"),
+        'matrices': {
+            metric: np.load(source_dir / f"salary_matrix_{metric}.npy", mmap_mode='r')
+            for metric in SALARY_GROWTH_METRICS
+        }
+    }
+    insurance_brackets = {scheme: _read_arrow_table(source_dir / f"insurance_{scheme}.arrow") for scheme in INSURANCE_TABLE_PATHS}
+    with open(source_dir / "manifest.json", encoding='utf-8') as f:
+        signatures = json.load(f).get('dataset_signatures', {})
+    stage_timer.mark('attach')
+    
+    geometries = state['geometries']
+    county_data = _attach_geodataframe(source_dir, 'county', geometries['county'], built and built.county_data)
+    village_data = _attach_geodataframe(source_dir, 'village', geometries['village'], built and built.village_data)
+    district_data = _attach_geodataframe(source_dir, 'district', geometries['district'], built and built.district_data)
+    stage_timer.mark('geometry')
+    print(f"已映射共享資料: {source_dir}")
+    snapshot = DataSnapshot('shared', signatures, stage_timings,
+                            county_data=county_data, village_data=village_data, district_data=district_data, salary_data=salary_data,
+                            population_data=population_data, population_history=population_history,
+                            clinic_data=clinic_data, salary_matrix=salary_matrix, insurance_brackets=insurance_brackets)
+    attach_derived_indexes(snapshot, source_dir, state, stage_timer, built)
+    stage_timer.finish()
+    return snapshot
+
+def load_with_shared_data(shared_dir, previous=None, datasets=None):
+    """
+    多 worker 模式的資料載入
+    
+    第一個取得檔案鎖的 worker 負責處理資料並寫入共享目錄，其餘 worker 等待後直接映射，
+    因此整個執行個體只會處理一次資料。輸入檔案變更時會依簽章建立新的共享資料版本，
+    重新載入時只重建 datasets 指定的資料集，其餘沿用 previous。
+    """
+    shared_dir = Path(shared_dir)
+    shared_dir.mkdir(parents=True, exist_ok=True)
+    signature = compute_input_signature()
+    snapshot_dir = shared_dir / f"snapshot-{signature}"
+    
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+        print("警告：此平台不支援 fcntl 檔案鎖，多個 worker 可能同時處理資料")
+    
+    built = None
+    with open(shared_dir / ".lock", 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
         try:
-            income_levels = pd.qcut(county_village_incomes, q=9, labels=False, duplicates='drop')
-            income_levels = [int(level) for level in income_levels]
-            
-            # 確保長度匹配
-            if len(income_levels) != len(county_village_incomes):
-                print(f"警告：薪資等級數量 {len(income_levels)} 與收入數量 {len(county_village_incomes)} 不匹配")
-                income_levels = [0] * len(county_village_incomes)  # 使用預設值
-            
-            # 計算每個等級的薪資範圍
-            unique_levels = sorted(set(income_levels))
-            
-            for level in unique_levels:
-                level_incomes = [county_village_incomes[j] for j, l in enumerate(income_levels) if l == level]
-                if level_incomes:
-                    min_income = min(level_incomes)
-                    max_income = max(level_incomes)
-                    income_ranges.append({
-                        'level': level,
-                        'min': min_income,
-                        'max': max_income
-                    })
-            
-            # 確保有9個等級（補齊缺失的等級）
-            while len(income_ranges) < 9:
-                income_ranges.append({
-                    'level': len(income_ranges),
-                    'min': 0,
-                    'max': 0
-                })
+            if not (snapshot_dir / "manifest.json").exists():
+                print(f"共享資料不存在，開始處理並寫入: {snapshot_dir}")
+                built = build_snapshot(previous, datasets)
                 
-        except Exception as e:
-            print(f"薪資分級計算錯誤: {e}")
-            income_levels = [0] * len(county_village_incomes)
-            income_ranges = [{'level': i, 'min': 0, 'max': 0} for i in range(9)]
+                # 先寫入暫存目錄再更名，避免其他 worker 讀到不完整的檔案
+                build_dir = shared_dir / f".build-{signature}-{os.getpid()}"
+                shutil.rmtree(build_dir, ignore_errors=True)
+                export_shared_data(built, build_dir)
+                with open(build_dir / "manifest.json", 'w', encoding='utf-8') as f:
+                    json.dump({
+                        'format_version': SHARED_DATA_FORMAT_VERSION,
+                        'signature': signature,
+                        'dataset_signatures': built.signatures,
+                        'files': sorted(p.name for p in build_dir.iterdir())
+                    }, f, ensure_ascii=False, indent=2)
+                os.replace(build_dir, snapshot_dir)
+                
+                # 清除過期的共享資料版本（其他 worker 已映射的檔案在解除映射前仍可讀取）
+                for old_dir in shared_dir.glob("snapshot-*"):
+                    if old_dir != snapshot_dir:
+                        shutil.rmtree(old_dir, ignore_errors=True)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    # 建置者也改為映射共享檔案，使所有 worker 共用同一份記憶體頁面（幾何與空間索引沿用剛建好的，不重新建立）
+    snapshot = attach_shared_data(snapshot_dir, built)
+    del built
+    install_snapshot(snapshot)
+    return snapshot
+
+def clear_response_cache():
+    """清除已快取的回應（資料重新載入時呼叫）"""
+    global response_cache_bytes
+    response_cache.clear()
+    response_cache_bytes = 0
+
+def _entry_size(entry):
+    return len(entry['body']) + len(entry['gzip'] or b'')
+
+def _store_response_cache(key, entry):
+    """將序列化後的回應放入 LRU 快取，超過容量上限時淘汰最久未使用的項目"""
+    global response_cache_bytes
+    size = _entry_size(entry)
+    if size > RESPONSE_CACHE_MAX_BYTES:
+        return
+    response_cache[key] = entry
+    response_cache_bytes += size
+    while response_cache_bytes > RESPONSE_CACHE_MAX_BYTES:
+        _, evicted = response_cache.popitem(last=False)
+        response_cache_bytes -= _entry_size(evicted)
+
+# 回應建置過程的分段計時（Server-Timing），在工作執行緒中設定
+request_timings = contextvars.ContextVar('request_timings', default=None)
+
+def timing_mark(stage):
+    """標記回應建置的一個階段結束（例如 lookup、classify），記錄於 Server-Timing 標頭"""
+    clock = request_timings.get()
+    if clock is not None:
+        clock.mark(stage)
+
+# ===== 取樣分析 =====
+
+PROFILE_INTERVAL_RANGE_MS = (1.0, 100.0)
+profile_records = deque(maxlen=PROFILE_BUFFER_SIZE)  # 最近完成的取樣分析（RequestProfile），只在事件迴圈中修改
+profile_sequence = 0
+
+class RequestProfile:
+    """
+    單一請求的取樣分析：建置回應期間由另一個執行緒每隔 interval 秒讀取建置執行緒的呼叫堆疊（sys._current_frames），
+    依堆疊累計取樣次數，可輸出 flamegraph.pl / speedscope 使用的 folded 格式
+    
+    堆疊只保留 _render_json 以下的部分（回應建置、序列化與壓縮），函式以「名稱 (檔名:定義行號)」表示；
+    取樣執行緒需要取得 GIL，建置執行緒長時間持有 GIL 時實際間隔可能較長（至少約 sys.getswitchinterval()）
+    """
+    
+    def __init__(self, profile_id, method, path, query, interval):
+        self.id = profile_id
+        self.method = method
+        self.path = path
+        self.query = query
+        self.interval = interval
+        self.route = None
+        self.status = None
+        self.created_at = time.time()
+        self.duration = None
+        self.build_duration = None
+        self.timings = None
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+    
+    def start(self, thread_id):
+        """開始取樣指定的執行緒"""
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample, args=(thread_id,), name=f'profiler-{self.id}', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """停止取樣並等待取樣執行緒結束"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.build_duration = time.perf_counter() - self._started
+    
+    def _sample(self, thread_id):
+        root = _render_json.__code__
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                if code is root:
+                    break
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+    
+    def folded(self):
+        """folded 格式：每行為以分號分隔的堆疊（由外而內，第一層為路由）與取樣次數"""
+        label = f"{self.method} {self.route or self.path}"
+        return ''.join(f"{label};{stack} {count}\n" for stack, count in self.stacks.most_common())
+    
+    def summary(self, top=10):
+        """取樣分析的摘要：請求資訊、各階段耗時與自身時間最多的函式"""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "query": self.query,
+            "route": self.route,
+            "status": self.status,
+            "created_at": datetime.fromtimestamp(self.created_at, timezone.utc).isoformat(timespec='seconds'),
+            "duration_ms": None if self.duration is None else round(self.duration * 1000, 2),
+            "build_ms": None if self.build_duration is None else round(self.build_duration * 1000, 2),
+            "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in (self.timings or {}).items()},
+            "interval_ms": round(self.interval * 1000, 3),
+            "samples": self.samples,
+            "top_functions": [
+                {"function": function, "samples": count, "share": round(count / self.samples, 4)}
+                for function, count in leaves.most_common(top)
+            ]
+        }
+
+def _is_admin(request):
+    """X-Admin-Token 標頭是否與 ADMIN_TOKEN 相符（未設定 ADMIN_TOKEN 時一律不符）"""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get('x-admin-token', ''), ADMIN_TOKEN)
+
+def _check_admin_token(request):
+    """檢查 X-Admin-Token 標頭，未設定 ADMIN_TOKEN 時回應 404，權杖錯誤時回應 403"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="未設定 ADMIN_TOKEN，管理端點已停用")
+    if not _is_admin(request):
+        raise HTTPException(status_code=403, detail="管理權杖錯誤")
+
+def _requested_profile(request):
+    """
+    請求要求取樣分析時（X-Profile 標頭或 profile 參數）建立 RequestProfile，否則返回 None
+    
+    權杖不符（或未設定 ADMIN_TOKEN）時忽略要求，只有 PROFILE_SAMPLE_RATE 比例的要求會實際取樣，
+    其餘請求照常使用快取回應
+    """
+    flag = request.headers.get('x-profile') or request.query_params.get('profile')
+    if flag is None or flag.lower() in ('', '0', 'false'):
+        return None
+    if not _is_admin(request) or random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    interval_ms = request.headers.get('x-profile-interval-ms') or request.query_params.get('profile_interval_ms')
+    try:
+        interval_ms = float(interval_ms) if interval_ms else PROFILE_INTERVAL_MS
+    except ValueError:
+        raise HTTPException(status_code=400, detail="profile_interval_ms 必須是數字")
+    low, high = PROFILE_INTERVAL_RANGE_MS
+    if not low <= interval_ms <= high:
+        raise HTTPException(status_code=400, detail=f"profile_interval_ms 必須介於 {low:g} 到 {high:g} 之間")
+    global profile_sequence
+    profile_sequence += 1
+    return RequestProfile(profile_sequence, request.method, request.url.path, request.url.query, interval_ms / 1000)
+
+def _render_json(builder, args, submitted_at, profile=None):
+    """
+    執行回應建置函式、序列化為 JSON（與 JSONResponse 相同格式）並壓縮，於工作執行緒中執行
+    
+    Args:
+        profile: 要求取樣分析時的 RequestProfile，建置期間取樣目前的執行緒
+    
+    Returns:
+        dict: body（JSON）、gzip（壓縮後內容或 None）、timings（各階段秒數）
+    """
+    timings = {}
+    clock = StageTimer(timings)
+    timings['queue'] = clock.started - submitted_at
+    token = request_timings.set(clock)
+    if profile is not None:
+        profile.timings = timings
+        profile.start(threading.get_ident())
+    try:
+        payload = builder(*args)
+        clock.mark('build')
+        body = JSONResponse(payload).body
+        clock.mark('serialize')
+        gzip_body = None
+        if len(body) >= GZIP_MIN_BYTES:
+            gzip_body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+            clock.mark('compress')
+    finally:
+        if profile is not None:
+            profile.stop()
+        request_timings.reset(token)
+    return {'body': body, 'gzip': gzip_body, 'timings': timings}
+
+def _json_response(request, entry, cache_status):
+    """依 Accept-Encoding 選擇壓縮版本，並附上 Server-Timing 標頭"""
+    headers = {'Vary': 'Accept-Encoding'}
+    server_timing = [f'cache;desc="{cache_status}"']
+    if cache_status != 'hit':
+        server_timing += [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in entry['timings'].items()]
+    headers['Server-Timing'] = ', '.join(server_timing)
+    
+    if entry['gzip'] is not None and 'gzip' in request.headers.get('accept-encoding', ''):
+        headers['Content-Encoding'] = 'gzip'
+        return Response(content=entry['gzip'], media_type='application/json', headers=headers)
+    return Response(content=entry['body'], media_type='application/json', headers=headers)
+
+ADMISSION_DEFAULT_COST = 0.05  # 沒有量測紀錄時的預估建置秒數
+ADMISSION_COST_KEYS_MAX = 4096  # 依參數記錄成本的鍵值上限（例如搜尋字串），超過時只記錄路由層級
+
+class AdmissionController:
+    """
+    CPU 密集回應建置的准入控制（只在事件迴圈中使用，不需要鎖）
+    
+    - 同時執行數受全域（total_limit）與每個路由（route_limit）限制
+    - 無法立即執行的請求進入有上限的佇列，依預估成本（每個路由與第一個參數的建置耗時移動平均）由低到高取得名額，
+      便宜的請求不會被大型縣市的請求擋住
+    - 佇列已滿或預估等待超過 max_wait 時立即拒絕，實際等待超過 max_wait 時也放棄
+    """
+    
+    def __init__(self, total_limit, route_limit, queue_max, max_wait):
+        self.total_limit = total_limit
+        self.route_limit = route_limit
+        self.queue_max = queue_max
+        self.max_wait = max_wait
+        self.running = {}  # 路由 -> 執行中的數量
+        self.running_total = 0
+        self.running_cost = 0.0  # 執行中請求的預估成本總和（秒）
+        self.waiters = []  # [預估成本, 順序, 路由, Future]
+        self.sequence = 0
+        self.costs = {}  # 成本鍵值 -> 建置秒數的指數移動平均
+        self.stats = {}  # 路由 -> admitted / queued / rejected / timed_out
+    
+    def estimate(self, cost_key):
+        """預估建置秒數：優先使用相同路由與參數的紀錄，其次為路由層級"""
+        for key in (cost_key, cost_key[:1]):
+            if key in self.costs:
+                return self.costs[key]
+        return ADMISSION_DEFAULT_COST
+    
+    def _record(self, cost_key, seconds):
+        for key in (cost_key[:1], cost_key):
+            if key not in self.costs and len(self.costs) >= ADMISSION_COST_KEYS_MAX:
+                continue
+            previous = self.costs.get(key)
+            self.costs[key] = seconds if previous is None else previous * 0.8 + seconds * 0.2
+    
+    def _route_stats(self, route):
+        return self.stats.setdefault(route, {'admitted': 0, 'queued': 0, 'rejected': 0, 'timed_out': 0})
+    
+    def _start(self, route, cost):
+        self.running[route] = self.running.get(route, 0) + 1
+        self.running_total += 1
+        self.running_cost += cost
+    
+    def _dispatch(self):
+        """依預估成本（相同時依到達順序）讓等待中的請求取得空出的名額"""
+        for waiter in sorted(self.waiters, key=lambda item: (item[0], item[1])):
+            if self.running_total >= self.total_limit:
+                break
+            cost, _, route, future = waiter
+            if self.running.get(route, 0) < self.route_limit:
+                self._start(route, cost)
+                self.waiters.remove(waiter)
+                future.set_result(None)
+    
+    def _reject(self, route, wait, reason):
+        self._route_stats(route)[reason] += 1
+        log_sampled(logging.WARNING, "拒絕 %s 請求（%s，預估等待 %.1fs，佇列 %d）", route, reason, wait, len(self.waiters))
+        return HTTPException(status_code=503, detail="伺服器忙碌中，請稍後再試",
+                             headers={'Retry-After': str(max(1, math.ceil(wait)))})
+    
+    async def acquire(self, route, cost_key):
+        """
+        取得一個執行名額，返回預估成本（release 時傳回）
+        
+        Raises:
+            HTTPException: 503（附 Retry-After），佇列已滿或等待過久
+        """
+        cost = self.estimate(cost_key)
+        future = asyncio.get_running_loop().create_future()
+        self.sequence += 1
+        waiter = [cost, self.sequence, route, future]
+        self.waiters.append(waiter)
+        self._dispatch()
+        if not future.done():
+            # 預估等待：排在前面（成本較低）的請求與執行中的請求平均分配到所有名額
+            ahead = sum(item[0] for item in self.waiters if item is not waiter and item[0] <= cost)
+            wait = (ahead + self.running_cost) / self.total_limit
+            if len(self.waiters) > self.queue_max or wait > self.max_wait:
+                self.waiters.remove(waiter)
+                raise self._reject(route, wait, 'rejected')
+            self._route_stats(route)['queued'] += 1
+            try:
+                await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # 用戶端中斷：已取得名額時歸還，否則移出佇列
+                if future.done():
+                    self.release(route, cost)
+                else:
+                    self.waiters.remove(waiter)
+                raise
+            if not future.done():
+                self.waiters.remove(waiter)
+                raise self._reject(route, self.max_wait, 'timed_out')
+        self._route_stats(route)['admitted'] += 1
+        return cost
+    
+    def try_acquire(self, route, cost_key):
+        """
+        以最低優先順序取得名額（快取預熱使用）：佇列中有請求或沒有空出的名額時不排隊，直接返回 None
+        
+        不計入路由的 admitted / queued 統計；成功時返回預估成本（release 時傳回）
+        """
+        if self.waiters or self.running_total >= self.total_limit or self.running.get(route, 0) >= self.route_limit:
+            return None
+        cost = self.estimate(cost_key)
+        self._start(route, cost)
+        return cost
+    
+    def release(self, route, cost, cost_key=None, seconds=None):
+        """歸還名額；提供 seconds 時更新該路由與參數的成本紀錄"""
+        self.running[route] -= 1
+        self.running_total -= 1
+        self.running_cost = max(0.0, self.running_cost - cost)
+        if cost_key is not None and seconds is not None:
+            self._record(cost_key, seconds)
+        self._dispatch()
+    
+    def status(self):
+        """准入控制狀態（/api/health 與 /metrics 使用）"""
+        queued = {}
+        for _, _, route, _ in self.waiters:
+            queued[route] = queued.get(route, 0) + 1
+        return {
+            "total_limit": self.total_limit,
+            "route_limit": self.route_limit,
+            "queue_max": self.queue_max,
+            "max_wait_seconds": self.max_wait,
+            "running": self.running_total,
+            "queue_depth": len(self.waiters),
+            "routes": {
+                route: {"running": self.running.get(route, 0), "queued_now": queued.get(route, 0), **stats,
+                        "estimated_cost_ms": round(self.estimate((route,)) * 1000, 1)}
+                for route, stats in sorted(self.stats.items())
+            }
+        }
+
+admission = AdmissionController(CPU_WORKERS, ADMISSION_ROUTE_LIMIT, ADMISSION_QUEUE_MAX, ADMISSION_MAX_WAIT)
+
+async def run_cpu_bound(request, key, builder, *args):
+    """
+    執行 CPU 密集的回應建置並返回 JSON 回應
+    
+    - 請求開始時取得目前的資料快照，建置函式以 builder(snapshot, *args) 呼叫，全程使用同一份資料
+    - 已快取的結果直接返回
+    - 相同鍵值的並行請求只運算一次，所有等待者共用結果（single-flight）
+    - 需要新運算的請求先經過准入控制（admission），快取命中與合併的請求不佔用名額也不排隊
+    - 運算（含 JSON 序列化與壓縮）在 cpu_executor 中執行，不阻塞事件迴圈
+    - 要求取樣分析的請求（request.state.profile）不使用快取也不與其他請求合併，一定重新建置
+    """
+    snapshot = current_snapshot()
+    profile = getattr(request.state, 'profile', None)
+    # 鍵值包含快照版本，重新載入後不會取得以舊資料建置的結果
+    cache_warmer.record(key)
+    key = (snapshot.version,) + key
+    args = (snapshot,) + args
+    entry = response_cache.get(key) if profile is None else None
+    if entry is not None:
+        response_cache.move_to_end(key)
+        response_stats['cache_hits'] += 1
+        return _json_response(request, entry, 'hit')
+    
+    if not CPU_OFFLOAD:
+        response_stats['cache_misses'] += 1
+        entry = _render_json(builder, args, time.perf_counter(), profile)
+        _observe_handler_stages(key[1], entry['timings'])
+        return _json_response(request, entry, 'miss')
+    
+    future = inflight_requests.get(key) if profile is None else None
+    cost = None
+    if future is None:
+        route, cost_key = key[1], key[1:3]
+        cost = await admission.acquire(route, cost_key)
+        # 等待名額期間，相同的請求可能已經完成或開始運算
+        entry = response_cache.get(key) if profile is None else None
+        future = inflight_requests.get(key) if profile is None else None
+        if entry is not None or future is not None:
+            admission.release(route, cost)
+            if entry is not None:
+                response_stats['cache_hits'] += 1
+                return _json_response(request, entry, 'hit')
+    if future is not None:
+        response_stats['coalesced'] += 1
+        cache_status = 'coalesced'
     else:
-        income_levels = [0] * len(county_villages)
-        income_ranges = []
+        response_stats['cache_misses'] += 1
+        cache_status = 'miss'
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        future = loop.run_in_executor(cpu_executor, _render_json, builder, args, started, profile)
+        if profile is None:
+            inflight_requests[key] = future
+        
+        def on_done(done_future, key=key, cost=cost, started=started):
+            if inflight_requests.get(key) is done_future:
+                del inflight_requests[key]
+            admission.release(key[1], cost, key[1:3], time.perf_counter() - started)
+            if not done_future.cancelled() and done_future.exception() is None:
+                entry = done_future.result()
+                _observe_handler_stages(key[1], entry['timings'])
+                # 建置期間已切換快照時不快取舊資料的結果
+                if data_snapshot is snapshot:
+                    _store_response_cache(key, entry)
+        future.add_done_callback(on_done)
+    
+    # shield：單一請求被取消時不影響其他等待相同結果的請求
+    entry = await asyncio.shield(future)
+    return _json_response(request, entry, cache_status)
+
+# ===== 快取預熱 =====
+
+WARMUP_POPULARITY_DECAY = 0.5  # 載入先前的請求次數時打折，使近期的熱門程度比重較高
+WARMUP_POPULARITY_MAX = 1000  # 記錄的路由與縣市組合上限（不存在的縣市名稱也會被請求）
+
+def _lower_thread_priority():
+    """降低預熱執行緒的排程優先順序（Linux 的 setpriority 可以只作用於單一執行緒），不支援時略過"""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+warmup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='warmup', initializer=_lower_thread_priority)
+
+class CacheWarmer:
+    """
+    資料快照切換後，在背景預先建置全台縣市與各縣市的村里、鄉鎮市區、診所回應並放入回應快取
+    
+    - 依熱門程度（各路由與縣市的請求次數，跨次啟動保存）由高到低建置，沒有紀錄的依村里數由多到少
+    - 一次只建置一個回應，在低優先順序的專用執行緒中執行；每個回應以最低優先順序向准入控制取得名額，
+      有即時請求在排隊或沒有空出的名額時略過該回應（busy），不等待
+    - 建置中的回應登記在 inflight_requests，相同的即時請求直接共用結果
+    - 快取容量不足以放入下一個回應時停止，不淘汰即時請求的快取
+    """
+    
+    # 路由 -> (建置函式, 縣市名稱之後的預設參數)，與各端點未指定參數時的快取鍵值相同
+    ROUTES = {
+        'villages': ('build_villages_response', (0.5, 0.5)),
+        'clinics': ('build_clinics_response', (None,)),
+        'districts': ('build_districts_response', (0.5, 0.5)),
+    }
     
-    # 計算人口密度九等分分級
-    density_ranges = []
-    if county_village_densities:
+    def __init__(self, popularity_path):
+        self.popularity_path = popularity_path
+        self.popularity = {}  # "路由/縣市" -> 請求次數
+        self.dirty = False
+        self.loop = None
+        self.task = None
+        self.status = {'state': 'idle', 'snapshot_version': None, 'total': 0, 'built': 0, 'skipped': 0, 'busy': 0, 'failed': 0,
+                       'current': None, 'started_at': None, 'finished_at': None, 'elapsed_seconds': None}
+    
+    def load_popularity(self):
+        """載入先前保存的熱門程度（檔案不存在或格式錯誤時從零開始）"""
+        try:
+            with open(self.popularity_path, encoding='utf-8') as f:
+                counts = json.load(f)['counts']
+            self.popularity = {key: float(count) * WARMUP_POPULARITY_DECAY for key, count in counts.items()}
+            print(f"已載入 {len(self.popularity)} 筆回應熱門程度: {self.popularity_path}")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.warning("無法讀取回應熱門程度 %s: %s", self.popularity_path, e)
+    
+    def save_popularity(self):
+        """將熱門程度寫入檔案（先寫暫存檔再替換；多個 worker 時以最後寫入者為準）"""
+        if not self.dirty:
+            return
+        self.dirty = False
         try:
-            density_levels = pd.qcut(county_village_densities, q=9, labels=False, duplicates='drop') 
-            density_levels = [int(level) for level in density_levels]
-            
-            # 確保長度匹配
-            if len(density_levels) != len(county_village_densities):
-                print(f"警告：人口密度等級數量 {len(density_levels)} 與密度數量 {len(county_village_densities)} 不匹配")
-                density_levels = [0] * len(county_village_densities)
-            
-            # 計算每個等級的人口密度範圍
-            unique_levels = sorted(set(density_levels))
-            
-            for level in unique_levels:
-                level_densities = [county_village_densities[j] for j, l in enumerate(density_levels) if l == level]
-                if level_densities:
-                    min_density = min(level_densities)
-                    max_density = max(level_densities)
-                    density_ranges.append({
-                        'level': level,
-                        'min': min_density,
-                        'max': max_density
-                    })
-            
-            # 確保有9個等級
-            while len(density_ranges) < 9:
-                density_ranges.append({
-                    'level': len(density_ranges),
-                    'min': 0,
-                    'max': 0
-                })
+            self.popularity_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.popularity_path.with_name(f"{self.popularity_path.name}.{os.getpid()}.tmp")
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'saved_at': time.time(), 'counts': dict(self.popularity)}, f, ensure_ascii=False)
+            os.replace(temp_path, self.popularity_path)
+        except OSError as e:
+            logger.warning("無法寫入回應熱門程度 %s: %s", self.popularity_path, e)
+    
+    def record(self, key):
+        """記錄一次可預熱路由的請求（不論參數，以路由與縣市計）"""
+        if key[0] in self.ROUTES and key[1]:
+            name = f"{key[0]}/{key[1]}"
+            if name not in self.popularity and len(self.popularity) >= WARMUP_POPULARITY_MAX:
+                return
+            self.popularity[name] = self.popularity.get(name, 0) + 1
+            self.dirty = True
+    
+    def plan(self, snapshot):
+        """返回依序建置的 (快取鍵值, 建置函式, 參數)：先全台縣市，再依熱門程度排序的各縣市回應"""
+        county_counts = snapshot.village_data['COUNTYNAME'].astype(str).value_counts()
+        counties = county_counts.index.tolist()
+        items = []
+        for route_index, (route, (builder_name, defaults)) in enumerate(self.ROUTES.items()):
+            for county_index, county_name in enumerate(counties):
+                popularity = self.popularity.get(f"{route}/{county_name}", 0)
+                items.append((-popularity, route_index, county_index, (route, county_name) + defaults, builder_name))
+        items.sort(key=lambda item: item[:3])
+        plan = [(('counties',), build_counties_response, ())]
+        plan += [(key, globals()[builder_name], key[1:]) for *_, key, builder_name in items]
+        return plan
+    
+    def schedule(self):
+        """快照切換後重新開始預熱（可從任何執行緒呼叫；事件迴圈尚未啟動時不執行）"""
+        if WARMUP_ENABLED and self.loop is not None:
+            self.loop.call_soon_threadsafe(self._start)
+    
+    def _start(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        self.task = asyncio.ensure_future(self.run(data_snapshot))
+    
+    async def run(self, snapshot):
+        loop = asyncio.get_running_loop()
+        plan = self.plan(snapshot)
+        started = time.perf_counter()
+        self.status.update(state='running', snapshot_version=snapshot.version, total=len(plan), built=0, skipped=0, busy=0,
+                           failed=0, current=None, started_at=time.time(), finished_at=None, elapsed_seconds=None)
+        try:
+            for key, builder, args in plan:
+                if data_snapshot is not snapshot:
+                    self.status['state'] = 'superseded'
+                    return
+                cache_key = (snapshot.version,) + key
+                if cache_key in response_cache or cache_key in inflight_requests:
+                    self.status['skipped'] += 1
+                    continue
+                # 與即時請求使用相同的路由與成本鍵值（counties 以外為路由與縣市）
+                cost = admission.try_acquire(key[0], key[:2])
+                if cost is None:
+                    self.status['busy'] += 1
+                    continue
+                self.status['current'] = '/'.join(str(part) for part in key[:2])
+                started_build = time.perf_counter()
+                future = loop.run_in_executor(warmup_executor, _render_json, builder, (snapshot,) + args, started_build)
+                inflight_requests[cache_key] = future
                 
+                def on_done(done, cache_key=cache_key, key=key, cost=cost, started_build=started_build):
+                    inflight_requests.pop(cache_key, None)
+                    admission.release(key[0], cost, key[:2], time.perf_counter() - started_build)
+                future.add_done_callback(on_done)
+                try:
+                    entry = await asyncio.shield(future)
+                except HTTPException:
+                    # 例如沒有診所的縣市（404），不影響其他回應的預熱
+                    self.status['failed'] += 1
+                    continue
+                if response_cache_bytes + _entry_size(entry) > RESPONSE_CACHE_MAX_BYTES:
+                    self.status['state'] = 'cache_full'
+                    return
+                if data_snapshot is snapshot:
+                    _store_response_cache(cache_key, entry)
+                self.status['built'] += 1
+            self.status['state'] = 'done'
+        except asyncio.CancelledError:
+            self.status['state'] = 'superseded'
+            raise
+        except Exception:
+            logger.exception("快取預熱失敗")
+            self.status['state'] = 'failed'
+        finally:
+            self.status.update(current=None, finished_at=time.time(), elapsed_seconds=round(time.perf_counter() - started, 3))
+            logger.info("快取預熱結束（%s）：建置 %d、略過 %d（忙碌 %d）、失敗 %d，共 %.2fs", self.status['state'],
+                        self.status['built'], self.status['skipped'], self.status['busy'], self.status['failed'],
+                        time.perf_counter() - started)
+    
+    async def save_periodically(self, interval):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            await loop.run_in_executor(None, self.save_popularity)
+    
+    def report(self):
+        """預熱進度（/api/health 使用）"""
+        total = self.status['total']
+        finished = self.status['built'] + self.status['skipped'] + self.status['busy'] + self.status['failed']
+        return {
+            **self.status,
+            "enabled": WARMUP_ENABLED,
+            "progress": round(finished / total, 3) if total else None,
+            "tracked_routes": len(self.popularity),
+            "popularity_path": str(self.popularity_path)
+        }
+
+# 未指定路徑時寫入共享資料目錄（多個 worker 共用），否則寫入系統暫存目錄
+cache_warmer = CacheWarmer(Path(WARMUP_POPULARITY_PATH) if WARMUP_POPULARITY_PATH else
+                           Path(SHARED_DATA_DIR or tempfile.gettempdir()) / "warmup_popularity.json")
+
+# ===== 監控指標（Prometheus 文字格式）=====
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 10240, 102400, 524288, 1048576, 5242880, 10485760)
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = [f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for name, value in pairs]
+    return '{' + ','.join(escaped) + '}'
+
+class Histogram:
+    """簡易的 Prometheus histogram，依標籤分組累計"""
+    
+    def __init__(self, name, help_text, buckets, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        self._series = {}  # 標籤值 -> [各區間次數..., 總和, 次數]
+        self._lock = threading.Lock()
+    
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, ('le', bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, label_values)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, label_values)} {series[-1]}")
+        return lines
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', '每個路由的請求延遲（秒）',
+                            LATENCY_BUCKETS, ('route', 'method', 'status'))
+RESPONSE_SIZE = Histogram('http_response_size_bytes', '每個路由的回應大小（位元組，壓縮後）',
+                          SIZE_BUCKETS, ('route',))
+HANDLER_STAGE_LATENCY = Histogram('handler_stage_duration_seconds', '回應建置各階段耗時（秒）',
+                                  LATENCY_BUCKETS, ('handler', 'stage'))
+
+def _observe_handler_stages(handler, timings):
+    for stage, seconds in timings.items():
+        HANDLER_STAGE_LATENCY.observe(seconds, handler, stage)
+
+def _gauge(name, help_text, samples, metric_type='gauge'):
+    """輸出 gauge / counter，samples 為 (標籤 dict, 數值) 的清單"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return lines
+
+def render_metrics():
+    """產生 Prometheus 文字格式的所有指標"""
+    lookups = response_stats['cache_hits'] + response_stats['cache_misses'] + response_stats['coalesced']
+    lines = []
+    lines += REQUEST_LATENCY.render()
+    lines += RESPONSE_SIZE.render()
+    lines += HANDLER_STAGE_LATENCY.render()
+    lines += _gauge('response_cache_requests_total', '回應快取查詢次數（依結果）',
+                    [({'result': result}, response_stats[stat]) for result, stat in
+                     (('hit', 'cache_hits'), ('miss', 'cache_misses'), ('coalesced', 'coalesced'))], 'counter')
+    lines += _gauge('response_cache_hit_ratio', '回應快取命中率（含合併的並行請求）',
+                    [({}, (response_stats['cache_hits'] + response_stats['coalesced']) / lookups if lookups else 0)])
+    lines += _gauge('response_cache_entries', '回應快取項目數', [({}, len(response_cache))])
+    lines += _gauge('response_cache_bytes', '回應快取大小（位元組）', [({}, response_cache_bytes)])
+    lines += _gauge('inflight_computations', '進行中的回應建置數', [({}, len(inflight_requests))])
+    lines += _gauge('warmup_responses_total', '快取預熱的回應數（依結果）',
+                    [({'result': result}, cache_warmer.status[result]) for result in ('built', 'skipped', 'busy', 'failed')],
+                    'counter')
+    admission_status = admission.status()
+    lines += _gauge('admission_queue_depth', '等待執行名額的請求數', [({}, admission_status['queue_depth'])])
+    lines += _gauge('admission_running', '佔用執行名額的回應建置數', [({}, admission_status['running'])])
+    lines += _gauge('admission_requests_total', '准入控制結果（依路由）',
+                    [({'route': route, 'result': result}, stats[result]) for route, stats in admission_status['routes'].items()
+                     for result in ('admitted', 'queued', 'rejected', 'timed_out')], 'counter')
+    snapshot = data_snapshot
+    if snapshot is not None:
+        lines += _gauge('data_load_stage_seconds', '目前資料快照建置各階段耗時（秒）',
+                        [({'stage': stage}, seconds) for stage, seconds in snapshot.stage_timings.items()])
+        lines += _gauge('data_snapshot_version', '目前資料快照版本', [({}, snapshot.version)])
+        lines += _gauge('data_snapshot_age_seconds', '目前資料快照載入後經過的秒數', [({}, time.time() - snapshot.loaded_at)])
+    lines += _gauge('data_reloads_total', '資料重新載入次數（依結果）',
+                    [({'result': result}, count) for result, count in reload_status['counts'].items()], 'counter')
+    return '\n'.join(lines) + '\n'
+
+_route_templates = {}
+
+def _route_label(request):
+    """以路由樣板（例如 /api/villages/{county_name}）作為標籤，避免標籤數量隨參數增加"""
+    endpoint = request.scope.get('endpoint')
+    if endpoint is None:
+        return 'unmatched'
+    if endpoint not in _route_templates:
+        _route_templates[endpoint] = next(
+            (route.path for route in app.routes if getattr(route, 'endpoint', None) is endpoint), endpoint.__name__
+        )
+    return _route_templates[endpoint]
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    """要求取樣分析的請求：建立 RequestProfile 供 run_cpu_bound 使用，完成後存入最近的分析紀錄並以 X-Profile-Id 標頭返回編號"""
+    try:
+        profile = _requested_profile(request)
+    except HTTPException as e:
+        return JSONResponse(status_code=e.status_code, content={"detail": e.detail})
+    if profile is None:
+        return await call_next(request)
+    
+    request.state.profile = profile
+    started = time.perf_counter()
+    response = await call_next(request)
+    profile.duration = time.perf_counter() - started
+    profile.status = response.status_code
+    profile.route = _route_label(request)
+    profile_records.append(profile)
+    response.headers['X-Profile-Id'] = str(profile.id)
+    logger.info("取樣分析 #%d: %s %s %.1fms，%d 個樣本", profile.id, request.method, profile.route,
+                profile.duration * 1000, profile.samples)
+    return response
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """記錄每個請求的延遲與回應大小，並在 Server-Timing 標頭加上總耗時"""
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    
+    route = _route_label(request)
+    REQUEST_LATENCY.observe(elapsed, route, request.method, str(response.status_code))
+    content_length = response.headers.get('content-length')
+    if content_length is not None:
+        RESPONSE_SIZE.observe(int(content_length), route)
+    
+    total = f"total;dur={elapsed * 1000:.1f}"
+    existing = response.headers.get('server-timing')
+    response.headers['Server-Timing'] = f"{existing}, {total}" if existing else total
+    response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+@app.on_event("startup")
+async def startup_event():
+    """應用程式啟動時載入資料，完成後在背景預熱快取"""
+    cache_warmer.loop = asyncio.get_running_loop()
+    if WARMUP_ENABLED:
+        cache_warmer.load_popularity()
+    try:
+        print("開始載入資料...")
+        if SHARED_DATA_DIR:
+            load_with_shared_data(SHARED_DATA_DIR)
+        else:
+            load_and_process_data()
+        print("資料載入完成！")
+    except Exception as e:
+        print(f"資料載入失敗: {e}")
+        import traceback
+        traceback.print_exc()
+        raise e
+    
+    if DATA_WATCH_INTERVAL > 0:
+        asyncio.create_task(watch_data_files(DATA_WATCH_INTERVAL))
+        print(f"已啟用資料檔案監看（每 {DATA_WATCH_INTERVAL:g} 秒檢查一次）")
+    if WARMUP_ENABLED and WARMUP_SAVE_INTERVAL > 0:
+        asyncio.create_task(cache_warmer.save_periodically(WARMUP_SAVE_INTERVAL))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """停止時保存回應熱門程度，供下次啟動的預熱排序使用"""
+    if WARMUP_ENABLED:
+        cache_warmer.save_popularity()
+
+def changed_datasets(snapshot, signatures):
+    """比較快照建置時與目前的輸入檔案簽章，返回有變更的資料集"""
+    return {name for name, signature in signatures.items() if snapshot.signatures.get(name) != signature}
+
+def reload_data(trigger='manual', force=False):
+    """
+    重新載入有變更的資料集，驗證後原子性地替換資料快照（於背景執行緒執行）
+    
+    建置或驗證失敗時保留目前的快照繼續服務，錯誤記錄於 reload_status。
+    
+    Args:
+        trigger: 觸發來源（admin / watcher / manual）
+        force: 為 True 時重建所有資料集
+        
+    Returns:
+        list: 重建的資料集名稱（沒有變更時為空）
+    """
+    with reload_lock:
+        reload_status.update(state='running', trigger=trigger, last_started=time.time())
+        result = 'failed'
+        try:
+            previous = data_snapshot
+            signatures = compute_dataset_signatures()
+            datasets = set(signatures) if force or previous is None else changed_datasets(previous, signatures)
+            if datasets:
+                logger.info("開始重新載入資料集 %s（%s）", sorted(datasets), trigger)
+                if SHARED_DATA_DIR:
+                    load_with_shared_data(SHARED_DATA_DIR, previous, datasets)
+                else:
+                    install_snapshot(build_snapshot(previous, datasets))
+            result = 'updated' if datasets else 'unchanged'
+            reload_status.update(last_result=result, last_rebuilt=sorted(datasets), last_error=None)
+            return sorted(datasets)
         except Exception as e:
-            print(f"人口密度分級計算錯誤: {e}")
-            density_levels = [0] * len(county_village_densities)
-            density_ranges = [{'level': i, 'min': 0, 'max': 0} for i in range(9)]
-    else:
-        density_levels = [0] * len(county_villages)
-        density_ranges = []
+            logger.exception("重新載入資料失敗，繼續使用目前的資料快照")
+            reload_status.update(last_result=result, last_rebuilt=[], last_error=str(e))
+            raise
+        finally:
+            reload_status['counts'][result] += 1
+            reload_status.update(state='idle', last_finished=time.time())
+
+def start_reload(trigger, force=False):
+    """在背景執行緒開始重新載入；已有重新載入進行中時返回 False"""
+    if reload_status['state'] == 'running':
+        return False
+    reload_status['state'] = 'running'
+    future = reload_executor.submit(reload_data, trigger, force)
+    # 失敗已記錄於 reload_status，這裡只避免未取得的例外被回報為錯誤
+    future.add_done_callback(lambda done: done.exception())
+    return True
+
+async def watch_data_files(interval):
+    """
+    定期檢查輸入檔案簽章，有變更時觸發背景重新載入
+    
+    檔案可能仍在複製中，連續兩次檢查的簽章相同才開始重新載入；
+    同一組簽章只嘗試一次，驗證失敗的檔案要再次變更後才會重試
+    """
+    loop = asyncio.get_running_loop()
+    pending = None
+    attempted = None
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            snapshot = data_snapshot
+            signatures = await loop.run_in_executor(reload_executor, compute_dataset_signatures)
+            if snapshot is None or not changed_datasets(snapshot, signatures) or signatures == attempted:
+                pending = None
+                continue
+            if signatures == pending:
+                if start_reload('watcher'):
+                    attempted = signatures
+                    pending = None
+            else:
+                pending = signatures
+        except Exception as e:
+            logger.warning("檢查資料檔案失敗: %s", e)
+
+@app.get("/")
+async def root():
+    """根路徑"""
+    return {"message": "台灣地圖 API 服務運行中"}
+
+def build_counties_response(data):
+    """返回全台灣縣市的 GeoJSON 資料"""
+    if data.county_data is None:
+        raise HTTPException(status_code=500, detail="縣市資料尚未載入")
+    
+    # 轉換為 GeoJSON 格式
+    counties_geojson = {
+        "type": "FeatureCollection",
+        "features": []
+    }
+    
+    for _, row in data.county_data.iterrows():
+        # 確保幾何資料的座標順序正確 [longitude, latitude]
+        geometry = row['geometry']
+        
+        # Debug: 輸出座標值確認
+        county_name = row.get('COUNTYNAME', row.get('name', '未知縣市'))
+        center_lat_val = row['center_lat']
+        center_lon_val = row['center_lon']
+        logger.debug("API 返回 %s: center_lat=%s, center_lon=%s", county_name, center_lat_val, center_lon_val)
+        
+        feature = {
+            "type": "Feature",
+            "properties": {
+                "name": county_name,
+                "center_lat": center_lat_val,
+                "center_lon": center_lon_val
+            },
+            "geometry": mapping(geometry)
+        }
+        counties_geojson["features"].append(feature)
+    
+    return counties_geojson
+
+@app.get("/api/counties")
+async def get_counties(request: Request):
+    """返回全台灣縣市的 GeoJSON 資料"""
+    return await run_cpu_bound(request, ('counties',), build_counties_response)
+
+def build_villages_response(data, county_name: str, income_weight: float = 0.5, density_weight: float = 0.5):
+    """返回指定縣市的所有村里 GeoJSON 資料（包含薪資和人口密度）"""
+    if data.village_data is None or data.village_indicators is None:
+        raise HTTPException(status_code=500, detail="村里資料尚未載入")
+    
+    # 以標準村里 ID 篩選該縣市的村里（縣市名稱經過正規化，台北市與臺北市相同）
+    registry = data.village_registry
+    county_id = registry.county_id(county_name)
+    county_mask = registry.county_of[registry.ids['village']] == county_id
+    county_villages = data.village_data[county_mask]
+    
+    if county_villages.empty:
+        raise HTTPException(status_code=404, detail=f"找不到縣市: {county_name}")
+    
+    # 計算該縣市村里的中位數分級和人口密度分級
+    county_village_incomes = []
+    county_village_densities = []
+    village_incomes = []  # 每個村里的收入（與 county_villages 的列順序相同，沒有數據的為 None）
+    village_densities = []  # 每個村里的人口密度
+    
+    for village_id in registry.ids['village'][county_mask].tolist():
+        median_income = data.village_indicators['median_income'][village_id]
+        population_density = data.village_indicators['population_density'][village_id]
+        village_incomes.append(median_income)
+        village_densities.append(population_density)
+        
+        if median_income is not None:
+            county_village_incomes.append(median_income)
+        if population_density is not None:
+            county_village_densities.append(population_density)
+    timing_mark('lookup')
+    
+    # 計算薪資與人口密度九等分分級的範圍（圖例使用）
+    income_ranges = compute_level_ranges(county_village_incomes, '薪資')
+    density_ranges = compute_level_ranges(county_village_densities, '人口密度')
+    timing_mark('classify')
     
     # 轉換為 GeoJSON 格式
     villages_geojson = {
@@ -693,48 +3492,15 @@ async def get_villages(county_name: str, income_weight: float = 0.5, density_wei
         "density_ranges": density_ranges
     }
     
-    for _, row in county_villages.iterrows():
+    # 計算每個村里在縣市內的收入與人口密度等級
+    village_income_levels = classify_levels(village_incomes, county_village_incomes)
+    village_density_levels = classify_levels(village_densities, county_village_densities)
+    
+    for (_, row), median_income, population_density, income_level, density_level in zip(
+            county_villages.iterrows(), village_incomes, village_densities, village_income_levels, village_density_levels):
         village_name = row.get('VILLNAME', row.get('name', '未知村里'))
         district_name = row.get('TOWNNAME', '未知區')
         
-        # 取得該村里的收入和人口密度
-        village_key = f"{village_name}_{district_name}"
-        median_income = village_income_mapping.get(village_key)
-        population_density = village_density_mapping.get(village_key)
-        
-        # 計算收入等級
-        income_level = 0
-        if median_income is not None and county_village_incomes:
-            try:
-                # 使用簡單的百分位數計算，避免重複pd.qcut
-                sorted_incomes = sorted(county_village_incomes)
-                n = len(sorted_incomes)
-                for level in range(9):
-                    threshold_idx = int((level + 1) * n / 9) - 1
-                    if threshold_idx < n and median_income <= sorted_incomes[threshold_idx]:
-                        income_level = level
-                        break
-                else:
-                    income_level = 8  # 最高等級
-            except:
-                income_level = 0
-                
-        # 計算人口密度等級
-        density_level = 0
-        if population_density is not None and county_village_densities:
-            try:
-                sorted_densities = sorted(county_village_densities)
-                n = len(sorted_densities)
-                for level in range(9):
-                    threshold_idx = int((level + 1) * n / 9) - 1
-                    if threshold_idx < n and population_density <= sorted_densities[threshold_idx]:
-                        density_level = level
-                        break
-                else:
-                    density_level = 8  # 最高等級
-            except:
-                density_level = 0
-        
         # 使用預先計算的中心點
         center_lat = row.get('center_lat', row['geometry'].centroid.y)
         center_lon = row.get('center_lon', row['geometry'].centroid.x)
@@ -761,55 +3527,255 @@ async def get_villages(county_name: str, income_weight: float = 0.5, density_wei
         }
         villages_geojson["features"].append(feature)
     
-    return villages_geojson
+    return villages_geojson
+
+@app.get("/api/villages/{county_name}")
+async def get_villages(request: Request, county_name: str, income_weight: float = 0.5, density_weight: float = 0.5):
+    """返回指定縣市的所有村里 GeoJSON 資料（包含薪資和人口密度）"""
+    return await run_cpu_bound(request, ('villages', county_name, income_weight, density_weight),
+                               build_villages_response, county_name, income_weight, density_weight)
+
+def build_districts_response(data, county_name: str, income_weight: float = 0.5, density_weight: float = 0.5):
+    """返回指定縣市的所有鄉鎮市區 GeoJSON 資料（人口加權薪資、人口密度與診所數，分級與配色方式與村里相同）"""
+    if data.district_data is None or data.district_indicators is None:
+        raise HTTPException(status_code=500, detail="鄉鎮市區資料尚未載入")
+    
+    indicators = data.district_indicators
+    positions = np.flatnonzero(indicators['county_ids'] == data.village_registry.county_id(county_name)).tolist()
+    if not positions:
+        raise HTTPException(status_code=404, detail=f"找不到縣市: {county_name}")
+    
+    district_incomes = [indicators['median_income'][position] for position in positions]
+    district_densities = [indicators['population_density'][position] for position in positions]
+    county_district_incomes = [value for value in district_incomes if value is not None]
+    county_district_densities = [value for value in district_densities if value is not None]
+    timing_mark('lookup')
+    
+    income_ranges = compute_level_ranges(county_district_incomes, '鄉鎮市區薪資')
+    density_ranges = compute_level_ranges(county_district_densities, '鄉鎮市區人口密度')
+    income_levels = classify_levels(district_incomes, county_district_incomes)
+    density_levels = classify_levels(district_densities, county_district_densities)
+    timing_mark('classify')
+    
+    district_data = data.district_data
+    geometries = district_data.geometry.values
+    columns = {column: district_data[column].tolist() for column in ('TOWNNAME', 'center_lat', 'center_lon', 'area_km2', 'village_count')}
+    features = []
+    for position, median_income, population_density, income_level, density_level in zip(
+            positions, district_incomes, district_densities, income_levels, density_levels):
+        features.append({
+            "type": "Feature",
+            "properties": {
+                "name": str(columns['TOWNNAME'][position]),
+                "county": county_name,
+                "center_lat": _optional_float(columns['center_lat'][position]),
+                "center_lon": _optional_float(columns['center_lon'][position]),
+                "income_level": income_level,
+                "density_level": density_level,
+                "median_income": median_income,
+                "population": indicators['population'][position],
+                "population_density": population_density,
+                "area_km2": float(columns['area_km2'][position]),
+                "village_count": int(columns['village_count'][position]),
+                "clinic_count": indicators['clinic_count'][position],
+                "bivariate_color": get_bivariate_color(income_level, density_level, income_weight, density_weight)
+            },
+            "geometry": mapping(geometries[position])
+        })
+    
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "income_ranges": income_ranges,
+        "density_ranges": density_ranges
+    }
+
+@app.get("/api/districts/{county_name}")
+async def get_districts(request: Request, county_name: str, income_weight: float = 0.5, density_weight: float = 0.5):
+    """返回指定縣市的所有鄉鎮市區 GeoJSON 資料（合併後的鄉鎮市區界，適合中低縮放等級）"""
+    return await run_cpu_bound(request, ('districts', county_name, income_weight, density_weight),
+                               build_districts_response, county_name, income_weight, density_weight)
+
+def build_hexgrid_response(data, cell_km: int = HEX_DEFAULT_CELL_KM, county_name: Optional[str] = None, specialty: Optional[str] = None,
+                           bbox: Optional[tuple] = None, income_weight: float = 0.5, density_weight: float = 0.5):
+    """
+    返回六角形網格圖層的 GeoJSON（人口、人口密度、人口加權薪資與診所數，分級與配色方式與村里相同）
+    
+    等級在返回的網格之間計算（指定縣市時為縣市內，否則為全台或 bbox 範圍內）
+    """
+    grid = get_hex_grid(data, cell_km)
+    specialty = specialty or CLINIC_GAP_ALL_SPECIALTIES
+    if specialty not in grid['specialties']:
+        raise HTTPException(status_code=400, detail=f"不支援的科別: {specialty}，可用科別: {grid['specialties']}")
+    column = grid['specialties'].index(specialty)
+    
+    selected = np.ones(len(grid['geometry']), dtype=bool)
+    if county_name:
+        selected &= grid['county_ids'] == data.village_registry.county_id(county_name)
+        if not selected.any():
+            raise HTTPException(status_code=404, detail=f"找不到縣市: {county_name}")
+    if bbox is not None:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        selected &= ((grid['center_lon'] >= min_lon) & (grid['center_lon'] <= max_lon)
+                     & (grid['center_lat'] >= min_lat) & (grid['center_lat'] <= max_lat))
+    positions = np.flatnonzero(selected).tolist()
+    
+    columns = {name: [None if math.isnan(value) else value for value in grid[name][positions].tolist()]
+               for name in ('median_income', 'population', 'population_density')}
+    known_incomes = [value for value in columns['median_income'] if value is not None]
+    known_densities = [value for value in columns['population_density'] if value is not None]
+    timing_mark('lookup')
+    
+    income_ranges = compute_level_ranges(known_incomes, '網格薪資')
+    density_ranges = compute_level_ranges(known_densities, '網格人口密度')
+    income_levels = classify_levels(columns['median_income'], known_incomes)
+    density_levels = classify_levels(columns['population_density'], known_densities)
+    timing_mark('classify')
+    
+    counties = data.village_registry.counties
+    clinic_counts = grid['clinic_counts'][positions, column].tolist()
+    features = []
+    for position, median_income, population, population_density, clinic_count, income_level, density_level in zip(
+            positions, columns['median_income'], columns['population'], columns['population_density'], clinic_counts,
+            income_levels, density_levels):
+        features.append({
+            "type": "Feature",
+            "properties": {
+                "id": position,
+                "county": counties[grid['county_ids'][position]],
+                "center_lat": round(float(grid['center_lat'][position]), 6),
+                "center_lon": round(float(grid['center_lon'][position]), 6),
+                "income_level": income_level,
+                "density_level": density_level,
+                "median_income": None if median_income is None else round(median_income, 1),
+                "population": None if population is None else round(population, 1),
+                "population_density": None if population_density is None else round(population_density, 2),
+                "land_km2": round(float(grid['land_km2'][position]), 4),
+                "clinic_count": clinic_count,
+                "clinics_per_10k": round(clinic_count / population * 10000, 3) if population else None,
+                "bivariate_color": get_bivariate_color(income_level, density_level, income_weight, density_weight)
+            },
+            "geometry": mapping(grid['geometry'][position])
+        })
+    
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "cell_km": grid['cell_km'],
+        "cell_area_km2": round(grid['cell_area_km2'], 4),
+        "specialty": specialty,
+        "income_ranges": income_ranges,
+        "density_ranges": density_ranges
+    }
 
-@app.get("/api/village_salary/{village_name}")
-async def get_village_salary(village_name: str, county_name: Optional[str] = None, district_name: Optional[str] = None):
+@app.get("/api/hexgrid")
+async def get_hexgrid(request: Request, cell_km: int = HEX_DEFAULT_CELL_KM, county_name: Optional[str] = None,
+                      specialty: Optional[str] = None, bbox: Optional[str] = None,
+                      income_weight: float = 0.5, density_weight: float = 0.5):
+    """
+    返回等面積六角形網格圖層（EPSG:3826 建置），大小一致的網格比村里更容易比較人口與診所密度
+    
+    - cell_km: 網格大小（相鄰網格中心的距離，公里），可用 1、2、5、10
+    - county_name: 只返回屬於該縣市的網格（跨縣市的網格歸入面積較大的一方）
+    - specialty: 診所數使用的科別（預設全部科別）
+    - bbox: min_lon,min_lat,max_lon,max_lat，只返回中心點在範圍內的網格（用於分塊載入）
+    """
+    if cell_km not in HEX_CELL_SIZES_KM:
+        raise HTTPException(status_code=400, detail=f"不支援的網格大小: {cell_km}，可用大小（公里）: {list(HEX_CELL_SIZES_KM)}")
+    bounds = None
+    if bbox:
+        try:
+            bounds = tuple(float(value) for value in bbox.split(','))
+        except ValueError:
+            bounds = ()
+        if len(bounds) != 4 or not all(math.isfinite(value) for value in bounds) or bounds[0] > bounds[2] or bounds[1] > bounds[3]:
+            raise HTTPException(status_code=400, detail="bbox 必須為 min_lon,min_lat,max_lon,max_lat")
+    return await run_cpu_bound(request, ('hexgrid', cell_km, county_name, specialty, bounds, income_weight, density_weight),
+                               build_hexgrid_response, cell_km, county_name, specialty, bounds, income_weight, density_weight)
+
+SUMMARY_TREND_FIELDS = ('p50', 'mean', 'weighted_mean', 'gini')
+
+def _summary_record(row, fields=None):
+    """將摘要表的一列轉為字典（村里數與診所數為整數，NaN 為 None）"""
+    record = {}
+    for field, value in row.items():
+        if fields is not None and field not in fields:
+            continue
+        if pd.isna(value):
+            record[field] = None
+        elif field in ('villages', 'clinics'):
+            record[field] = int(value)
+        else:
+            record[field] = float(value)
+    return record
+
+def build_summary_response(data, county_name: Optional[str] = None, year: Optional[int] = None):
+    """
+    從快照建置時計算的摘要表取出縣市（未指定時為全台）的統計摘要
+    
+    全台的回應另外附上各縣市的比較表（薪資中位數、人口加權平均、吉尼係數、人口密度與每萬人診所數）
+    """
+    tables = data.summary_tables
+    scope = SUMMARY_NATIONAL
+    if county_name:
+        # 與其他縣市端點相同，以標準化的名稱對應（例如台北市 -> 臺北市）
+        county_id = data.village_registry.county_id(county_name)
+        scope = data.village_registry.counties[county_id] if county_id >= 0 else None
+    if scope not in tables['scopes']:
+        raise HTTPException(status_code=404, detail=f"找不到縣市: {county_name}")
+    years = tables['years']
+    year = years[-1] if year is None else year
+    if year not in years:
+        raise HTTPException(status_code=400, detail=f"year 必須介於 {years[0]} 到 {years[-1]}")
+    
+    income_table, density_table, clinic_table = tables['income'], tables['density'], tables['clinics']
+    income = _summary_record(income_table.loc[(scope, year)])
+    correlation = {"pearson": income.pop('pearson'), "spearman": income.pop('spearman')}
+    result = {
+        "scope": scope,
+        "year": year,
+        "years": years,
+        "income": income,
+        "income_density_correlation": correlation,
+        "income_trend": [{"year": trend_year, **_summary_record(row, SUMMARY_TREND_FIELDS)}
+                         for trend_year, row in income_table.loc[scope].iterrows()],
+        "density": _summary_record(density_table.loc[scope]),
+        "clinics": {specialty: _summary_record(row) for specialty, row in clinic_table.loc[scope].iterrows()}
+    }
+    timing_mark('lookup')
+    if county_name is None:
+        result["counties"] = [{
+            "county": county,
+            "median_income": _summary_record(income_table.loc[(county, year)], ('p50', 'weighted_mean', 'gini')),
+            "population_density": _summary_record(density_table.loc[county], ('p50', 'weighted_mean', 'overall_density')),
+            "clinics_per_10k": _optional_float(clinic_table.loc[(county, CLINIC_GAP_ALL_SPECIALTIES), 'per_10k'])
+        } for county in tables['scopes'][:-1]]
+    return result
+
+@app.get("/api/summary")
+async def get_summary(request: Request, county_name: Optional[str] = None, year: Optional[int] = None):
+    """
+    返回縣市（未指定時為全台）的統計摘要
+    
+    - 村里薪資中位數的百分位數、人口加權平均、吉尼係數與歷年趨勢
+    - 薪資與人口密度的相關係數（Pearson / Spearman）
+    - 人口密度的百分位數、人口加權平均與整體密度
+    - 各科別的診所數與每萬人診所數
+    - year: 薪資年度（預設最新年度）
+    """
+    return await run_cpu_bound(request, ('summary', county_name, year), build_summary_response, county_name, year)
+
+def build_village_salary_response(data, village_name: str, county_name: Optional[str] = None, district_name: Optional[str] = None):
     """返回指定村里所有年份的薪資資料（使用標準化資料）"""
-    print(f"API 請求: village_name={village_name}, county_name={county_name}, district_name={district_name}")
+    log_sampled(logging.INFO, "薪資 API 請求: village_name=%s, county_name=%s, district_name=%s", village_name, county_name, district_name)
     
-    if salary_data is None:
+    if data.salary_data is None:
         raise HTTPException(status_code=500, detail="薪資資料尚未載入")
     
-    # 篩選該村里的所有年份資料（直接使用標準化資料）
-    if county_name and district_name:
-        # 精確匹配縣市、區、村里
-        print(f"精確匹配: {county_name} {district_name} {village_name}")
-        village_salary = salary_data[
-            (salary_data['村里'] == village_name) & 
-            (salary_data['縣市'] == county_name) &
-            (salary_data['鄉鎮市區'] == district_name)
-        ]
-        print(f"精確匹配結果筆數: {len(village_salary)}")
-        
-        # 如果精確匹配失敗，顯示該村里在該縣市的所有可能區域
-        if village_salary.empty:
-            possible_districts = salary_data[
-                (salary_data['村里'] == village_name) & 
-                (salary_data['縣市'] == county_name)
-            ]['鄉鎮市區'].unique()
-            print(f"該村里在 {county_name} 的可能區域: {list(possible_districts)}")
-            print(f"前端傳送的區域: {district_name}")
-            
-            # 嘗試模糊匹配
-            if len(possible_districts) == 1:
-                actual_district = possible_districts[0]
-                print(f"嘗試使用實際區域: {actual_district}")
-                village_salary = salary_data[
-                    (salary_data['村里'] == village_name) & 
-                    (salary_data['縣市'] == county_name) &
-                    (salary_data['鄉鎮市區'] == actual_district)
-                ]
-                print(f"模糊匹配結果筆數: {len(village_salary)}")
-    elif county_name:
-        # 只匹配縣市和村里
-        village_salary = salary_data[
-            (salary_data['村里'] == village_name) & 
-            (salary_data['縣市'] == county_name)
-        ]
-    else:
-        # 只用村里名稱搜尋
-        village_salary = salary_data[salary_data['村里'] == village_name]
+    # 以搜尋索引找出村里（區域不符時若該縣市只有一個同名村里則採用），再直接取出該村里的所有年份資料
+    village_ids = data.search_index.resolve_village('salary', village_name, county_name, district_name)
+    village_salary = data.salary_data.iloc[data.village_registry.row_positions('salary', village_ids)]
+    timing_mark('lookup')
     
     if village_salary.empty:
         if district_name:
@@ -837,59 +3803,23 @@ async def get_village_salary(village_name: str, county_name: Optional[str] = Non
     
     return result
 
-@app.get("/api/village_population/{village_name}")
-async def get_village_population(village_name: str, county_name: Optional[str] = None, district_name: Optional[str] = None):
+@app.get("/api/village_salary/{village_name}")
+async def get_village_salary(request: Request, village_name: str, county_name: Optional[str] = None, district_name: Optional[str] = None):
+    """返回指定村里所有年份的薪資資料（使用標準化資料）"""
+    return await run_cpu_bound(request, ('village_salary', village_name, county_name, district_name),
+                               build_village_salary_response, village_name, county_name, district_name)
+
+def build_village_population_response(data, village_name: str, county_name: Optional[str] = None, district_name: Optional[str] = None):
     """返回指定村里所有年份的人口資料"""
-    print(f"人口API 請求: village_name={village_name}, county_name={county_name}, district_name={district_name}")
+    log_sampled(logging.INFO, "人口 API 請求: village_name=%s, county_name=%s, district_name=%s", village_name, county_name, district_name)
     
-    if population_data is None:
+    if data.population_history is None:
         raise HTTPException(status_code=500, detail="人口資料尚未載入")
     
-    # 載入所有可用的人口資料檔案
-    all_population_data = []
-    population_files = list(POPULATION_DATA_DIR.glob("*_standardized.csv"))
-    
-    for file_path in population_files:
-        # 從檔案名稱中提取年份和月份
-        filename = file_path.stem  # 例如: opendata11407M030_standardized
-        if 'opendata' in filename:
-            year_month = filename.split('opendata')[1].split('_')[0]  # 11407M030
-            if len(year_month) >= 5:
-                year_str = year_month[:3]  # 114
-                month_str = year_month[3:5]  # 07
-                
-                # 轉換民國年為西元年
-                try:
-                    year = int(year_str) + 1911  # 114 + 1911 = 2025
-                    month = int(month_str)
-                    
-                    df = pd.read_csv(file_path)
-                    df['年份'] = year
-                    df['月份'] = month
-                    all_population_data.append(df)
-                except ValueError:
-                    continue
-    
-    if not all_population_data:
-        raise HTTPException(status_code=500, detail="無法載入人口資料檔案")
-    
-    # 合併所有年份資料
-    combined_population = pd.concat(all_population_data, ignore_index=True)
-    
-    # 篩選該村里的資料
-    if county_name and district_name:
-        village_population = combined_population[
-            (combined_population['村里'] == village_name) & 
-            (combined_population['縣市'] == county_name) &
-            (combined_population['鄉鎮市區'] == district_name)
-        ]
-    elif county_name:
-        village_population = combined_population[
-            (combined_population['村里'] == village_name) & 
-            (combined_population['縣市'] == county_name)
-        ]
-    else:
-        village_population = combined_population[combined_population['村里'] == village_name]
+    # 所有月份的人口資料已在載入時合併，以搜尋索引找出該村里的列
+    village_ids = data.search_index.resolve_village('population_history', village_name, county_name, district_name)
+    village_population = data.population_history.iloc[data.village_registry.row_positions('population_history', village_ids)]
+    timing_mark('lookup')
     
     if village_population.empty:
         if district_name:
@@ -918,6 +3848,279 @@ async def get_village_population(village_name: str, county_name: Optional[str] =
     
     return result
 
+@app.get("/api/village_population/{village_name}")
+async def get_village_population(request: Request, village_name: str, county_name: Optional[str] = None, district_name: Optional[str] = None):
+    """返回指定村里所有年份的人口資料"""
+    return await run_cpu_bound(request, ('village_population', village_name, county_name, district_name),
+                               build_village_population_response, village_name, county_name, district_name)
+
+def build_salary_growth_response(data, county_name: Optional[str] = None, district_name: Optional[str] = None,
+                                 metric: str = 'median', start_year: Optional[int] = None, end_year: Optional[int] = None,
+                                 rank_by: str = 'cagr', top_n: int = 10):
+    """返回指定範圍內（全台、縣市或鄉鎮市區）薪資成長最快與最慢的村里排名"""
+    if data.salary_matrix is None:
+        raise HTTPException(status_code=500, detail="薪資資料尚未載入")
+    
+    if metric not in SALARY_GROWTH_METRICS:
+        raise HTTPException(status_code=400, detail=f"不支援的指標: {metric}，可用指標: {list(SALARY_GROWTH_METRICS)}")
+    if rank_by not in SALARY_GROWTH_RANK_FIELDS:
+        raise HTTPException(status_code=400, detail=f"不支援的排名依據: {rank_by}，可用依據: {SALARY_GROWTH_RANK_FIELDS}")
+    if top_n < 1 or top_n > 500:
+        raise HTTPException(status_code=400, detail="top_n 必須介於 1 到 500 之間")
+    
+    years = data.salary_matrix['years']
+    start_year = int(years[0]) if start_year is None else start_year
+    end_year = int(years[-1]) if end_year is None else end_year
+    if start_year not in years or end_year not in years:
+        raise HTTPException(status_code=400, detail=f"年份必須介於 {int(years[0])} 到 {int(years[-1])} 之間")
+    if start_year >= end_year:
+        raise HTTPException(status_code=400, detail="start_year 必須早於 end_year")
+    
+    # 同一組年份的成長指標只計算一次，所有縣市與排名共用
+    growth_key = (start_year, end_year)
+    if growth_key not in data.salary_growth_cache:
+        data.salary_growth_cache[growth_key] = compute_salary_growth(data.salary_matrix, start_year, end_year)
+    growth = data.salary_growth_cache[growth_key][metric]
+    
+    # 篩選範圍
+    scope_mask = np.ones(len(data.salary_matrix['villages']), dtype=bool)
+    matrix_ids = data.village_registry.ids['salary_matrix']
+    if county_name:
+        scope_mask &= data.village_registry.county_of[matrix_ids] == data.village_registry.county_id(county_name)
+    if district_name:
+        scope_mask &= data.village_registry.town_of[matrix_ids] == data.village_registry.town_id(district_name)
+    if not scope_mask.any():
+        raise HTTPException(status_code=404, detail=f"找不到範圍: {county_name or ''}{district_name or ''}")
+    
+    # 排除缺少起訖年份資料的村里後排序
+    values = growth[rank_by]
+    candidates = np.flatnonzero(scope_mask & ~np.isnan(values))
+    order = candidates[np.argsort(values[candidates], kind='stable')]
+    
+    def to_records(indices):
+        # 起始或結束年份為 0 的村里沒有百分比變化與 CAGR（NaN），以 null 表示
+        records = []
+        for idx in indices:
+            record = {
+                "縣市": data.salary_matrix['counties'][idx],
+                "區": data.salary_matrix['districts'][idx],
+                "村里": data.salary_matrix['villages'][idx]
+            }
+            for field, name in (('start', 'start_value'), ('end', 'end_value'), ('abs_change', 'abs_change'),
+                                ('pct_change', 'pct_change'), ('cagr', 'cagr')):
+                value = float(growth[field][idx])
+                record[name] = value if math.isfinite(value) else None
+            records.append(record)
+        return records
+    
+    result = {
+        "county": county_name,
+        "district": district_name,
+        "metric": metric,
+        "start_year": start_year,
+        "end_year": end_year,
+        "rank_by": rank_by,
+        "village_count": int(len(order)),
+        "top": to_records(order[::-1][:top_n]),
+        "bottom": to_records(order[:top_n])
+    }
+    return result
+
+@app.get("/api/salary_growth")
+async def get_salary_growth(request: Request, county_name: Optional[str] = None, district_name: Optional[str] = None,
+                            metric: str = 'median', start_year: Optional[int] = None, end_year: Optional[int] = None,
+                            rank_by: str = 'cagr', top_n: int = 10):
+    """返回指定範圍內（全台、縣市或鄉鎮市區）薪資成長最快與最慢的村里排名"""
+    return await run_cpu_bound(request, ('salary_growth', county_name, district_name, metric, start_year, end_year, rank_by, top_n),
+                               build_salary_growth_response, county_name, district_name,
+                               metric, start_year, end_year, rank_by, top_n)
+
+# 投保金額分級表：保險代碼 -> 名稱、必要欄位，以及被保險人（員工）、投保單位（雇主）、政府每月負擔的保費欄位
+INSURANCE_SCHEME_NAMES = {'nhi': '健保', 'bli': '勞保'}
+INSURANCE_COST_COLUMNS = {
+    'nhi': {'employee': ['fee1'], 'employer': ['cost_company'], 'government': ['cost_government']},
+    # 勞保為普通事故保險費加上就業保險費
+    'bli': {'employee': ['fee_orig', 'fee_addition'], 'employer': ['cost_company_orig', 'cost_company_addition'],
+            'government': ['cost_government_orig', 'cost_government_addition']},
+}
+INSURANCE_REQUIRED_COLUMNS = {
+    'nhi': ['level', 'base_salary', 'fee1', 'fee2', 'fee3', 'fee4', 'cost_company', 'cost_government'],
+    'bli': ['level', 'base_salary'] + [column for columns in INSURANCE_COST_COLUMNS['bli'].values() for column in columns],
+}
+INSURANCE_ROLES = ('employee', 'employer', 'government')
+INSURANCE_MAX_DEPENDENTS = 3  # 健保眷屬超過 3 人以 3 人計（fee1-fee4）
+INSURANCE_MAX_SALARIES = 10000
+INSURANCE_INCOME_METRICS = ('median', 'average')
+# 薪資資料為每年綜合所得（千元），換算為每月金額（元）後對應投保級距
+ANNUAL_INCOME_TO_MONTHLY = 1000 / 12
+
+def lookup_insurance(brackets, salaries, dependents: int = 0):
+    """
+    將月薪（元）向量化對應到健保與勞保的投保金額級距，返回每月保費
+    
+    投保金額取不低於月薪的最低級距（np.searchsorted），高於最高級距者以最高級距計；
+    健保的被保險人保費依眷屬人數取 fee1-fee4
+    
+    Returns:
+        dict: 保險代碼 -> {level, insured_salary, employee, employer, government} 整數陣列（與 salaries 等長）
+    """
+    salaries = np.asarray(salaries, dtype=float)
+    result = {}
+    for scheme, table in brackets.items():
+        base_salaries = table['base_salary'].to_numpy()
+        rows = np.minimum(np.searchsorted(base_salaries, salaries, side='left'), len(base_salaries) - 1)
+        columns = dict(INSURANCE_COST_COLUMNS[scheme])
+        if scheme == 'nhi':
+            columns['employee'] = [f'fee{dependents + 1}']
+        costs = {'level': table['level'].to_numpy()[rows], 'insured_salary': base_salaries[rows]}
+        for role, names in columns.items():
+            costs[role] = sum(table[name].to_numpy(dtype=np.int64) for name in names)[rows]
+        result[scheme] = costs
+    return result
+
+def _insurance_records(costs, valid):
+    """將 lookup_insurance 的結果轉為每筆 {nhi, bli, total} 的字典，valid 為 False 的位置為 None"""
+    columns = {scheme: {field: values.tolist() for field, values in fields.items()} for scheme, fields in costs.items()}
+    totals = {role: sum(fields[role] for fields in costs.values()).tolist() for role in INSURANCE_ROLES}
+    records = []
+    for index, is_valid in enumerate(valid.tolist()):
+        if not is_valid:
+            records.append(None)
+            continue
+        record = {scheme: {field: values[index] for field, values in fields.items()} for scheme, fields in columns.items()}
+        record['total'] = {role: values[index] for role, values in totals.items()}
+        records.append(record)
+    return records
+
+def _validate_dependents(dependents: int):
+    if not 0 <= dependents <= INSURANCE_MAX_DEPENDENTS:
+        raise HTTPException(status_code=400, detail=f"dependents 必須介於 0 到 {INSURANCE_MAX_DEPENDENTS}")
+
+def build_insurance_response(data, salaries, dependents: int = 0):
+    """返回每個月薪對應的健保與勞保級距及每月保費（員工、雇主、政府）"""
+    salaries = np.asarray(salaries, dtype=float)
+    costs = lookup_insurance(data.insurance_brackets, salaries, dependents)
+    timing_mark('lookup')
+    records = _insurance_records(costs, np.ones(len(salaries), dtype=bool))
+    return {
+        "dependents": dependents,
+        "count": len(records),
+        "results": [{"salary": salary, **record} for salary, record in zip(salaries.tolist(), records)]
+    }
+
+@app.get("/api/insurance")
+async def get_insurance(request: Request, salary: float, dependents: int = 0):
+    """
+    返回月薪（元）對應的健保與勞保投保金額級距及每月保費
+    
+    - salary: 月薪（元）
+    - dependents: 健保眷屬人數（0-3）
+    """
+    if not (math.isfinite(salary) and salary >= 0):
+        raise HTTPException(status_code=400, detail="salary 必須是非負數")
+    _validate_dependents(dependents)
+    return await run_cpu_bound(request, ('insurance', salary, dependents), build_insurance_response, (salary,), dependents)
+
+def _parse_insurance_salaries(body):
+    """解析批次保費查詢的請求內容：{"salaries": [月薪, ...], "dependents": 0}"""
+    try:
+        payload = json.loads(body)
+        salaries = np.array(payload['salaries'], dtype=float)
+        dependents = int(payload.get('dependents', 0))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail='請求內容須為 {"salaries": [月薪, ...], "dependents": 0}')
+    if salaries.ndim != 1 or not (np.isfinite(salaries) & (salaries >= 0)).all():
+        raise HTTPException(status_code=400, detail="salaries 必須是非負數的陣列")
+    if len(salaries) > INSURANCE_MAX_SALARIES:
+        raise HTTPException(status_code=400, detail=f"一次最多 {INSURANCE_MAX_SALARIES} 筆月薪")
+    _validate_dependents(dependents)
+    return salaries, dependents
+
+@app.post("/api/insurance")
+async def get_insurance_batch(request: Request):
+    """
+    批次查詢月薪對應的健保與勞保級距及每月保費（一次最多 10000 筆，結果順序與輸入相同）
+    
+    請求內容：{"salaries": [月薪, ...], "dependents": 0}
+    """
+    salaries, dependents = _parse_insurance_salaries(await request.body())
+    # 以解析後的內容作為快取鍵值，相同的批次只運算一次
+    digest = hashlib.sha256(salaries.tobytes()).hexdigest()
+    return await run_cpu_bound(request, ('insurance_batch', digest, dependents), build_insurance_response, salaries, dependents)
+
+def build_village_insurance_response(data, county_name: Optional[str] = None, metric: str = 'median',
+                                     year: Optional[int] = None, dependents: int = 0):
+    """
+    以村里的薪資中位數或平均數（換算為月薪）估算每個村里的健保與勞保每月保費
+    
+    所有村里一次以向量化查詢對應級距；沒有該年度薪資資料的村里 insurance 為 null
+    """
+    if metric not in INSURANCE_INCOME_METRICS:
+        raise HTTPException(status_code=400, detail=f"metric 必須是 {'、'.join(INSURANCE_INCOME_METRICS)} 之一")
+    matrix = data.salary_matrix
+    years = matrix['years'].tolist()
+    year = years[-1] if year is None else year
+    if year not in years:
+        raise HTTPException(status_code=400, detail=f"year 必須介於 {years[0]} 到 {years[-1]}")
+    
+    registry = data.village_registry
+    village_ids = registry.ids['village']
+    if county_name:
+        positions = np.flatnonzero(registry.county_of[village_ids] == registry.county_id(county_name))
+        if not len(positions):
+            raise HTTPException(status_code=404, detail=f"找不到縣市: {county_name}")
+    else:
+        positions = np.arange(len(village_ids))
+    # 薪資矩陣的列以村里 ID 對應（與匯出相同），沒有資料的村里為 NaN
+    matrix_rows = np.full(len(registry.keys), -1, dtype=np.intp)
+    matrix_rows[registry.ids['salary_matrix']] = np.arange(len(registry.ids['salary_matrix']))
+    rows = matrix_rows[village_ids[positions]]
+    incomes = np.asarray(matrix['matrices'][metric][:, years.index(year)])[np.maximum(rows, 0)]
+    incomes[rows < 0] = np.nan
+    timing_mark('lookup')
+    
+    valid = np.isfinite(incomes)
+    monthly_salaries = incomes * ANNUAL_INCOME_TO_MONTHLY
+    costs = lookup_insurance(data.insurance_brackets, np.where(valid, monthly_salaries, 0), dependents)
+    records = _insurance_records(costs, valid)
+    timing_mark('compute')
+    
+    properties = data.village_locator.properties
+    villages = []
+    for position, income, monthly_salary, record in zip(positions.tolist(), incomes.tolist(), monthly_salaries.tolist(), records):
+        item = properties[position]
+        villages.append({
+            "county": item['county'],
+            "district": item['district'],
+            "village": item['village'],
+            "income": None if record is None else income,
+            "monthly_salary": None if record is None else round(monthly_salary),
+            "insurance": record
+        })
+    return {
+        "county": county_name,
+        "metric": metric,
+        "year": year,
+        "dependents": dependents,
+        "village_count": len(villages),
+        "matched": int(valid.sum()),
+        "villages": villages
+    }
+
+@app.get("/api/insurance/villages")
+async def get_village_insurance(request: Request, county_name: Optional[str] = None, metric: str = 'median',
+                                year: Optional[int] = None, dependents: int = 0):
+    """
+    估算縣市（未指定時為全台）每個村里的健保與勞保每月保費
+    
+    - metric: 以村里薪資的 median（中位數）或 average（平均數）換算月薪
+    - year: 薪資年度（預設最新年度）
+    - dependents: 健保眷屬人數（0-3）
+    """
+    _validate_dependents(dependents)
+    return await run_cpu_bound(request, ('insurance_villages', county_name, metric, year, dependents),
+                               build_village_insurance_response, county_name, metric, year, dependents)
+
 @app.get("/api/bivariate_colors")
 async def get_bivariate_colors(income_weight: float = 0.5, density_weight: float = 0.5):
     """返回雙變數色彩矩陣"""
@@ -939,14 +4142,331 @@ async def get_bivariate_colors(income_weight: float = 0.5, density_weight: float
         }
     }
 
-@app.get("/api/clinics/{county_name}")
-async def get_clinics(county_name: str, specialties: Optional[str] = None):
-    """返回指定縣市的診所地標資料"""
-    if clinic_data is None:
+def build_search_response(data, query: str, kind: str = 'all', limit: int = 10):
+    """依名稱搜尋村里與診所，返回排序後的結果與座標"""
+    total, results = data.search_index.search(query, kind, limit)
+    timing_mark('lookup')
+    return {"query": query, "total": total, "results": results}
+
+@app.get("/api/search")
+async def search(request: Request, q: str = '', kind: str = Query('all', alias='type'), limit: int = 10):
+    """
+    搜尋村里名稱與診所名稱（支援臺/台、簡體字與部分關鍵字），返回排序後的結果與座標
+    
+    - q: 關鍵字，多個關鍵字以空白分隔
+    - type: all / village / clinic
+    - limit: 返回筆數（1-50）
+    """
+    query = ' '.join(normalize_search_text(part) for part in q.split())
+    if not query:
+        raise HTTPException(status_code=400, detail="請提供搜尋關鍵字 q")
+    if kind not in SEARCH_TYPES:
+        raise HTTPException(status_code=400, detail=f"type 必須是 {'、'.join(SEARCH_TYPES)} 之一")
+    limit = max(1, min(SEARCH_MAX_LIMIT, limit))
+    return await run_cpu_bound(request, ('search', query, kind, limit), build_search_response, query, kind, limit)
+
+def build_locate_response(data, lat: float, lon: float):
+    """返回座標所在的村里（含薪資、人口密度與縣市內等級）"""
+    row = int(data.village_locator.locate([lat], [lon])[0])
+    timing_mark('lookup')
+    if row < 0:
+        raise HTTPException(status_code=404, detail=f"座標不在任何村里內: {lat}, {lon}")
+    return {"lat": lat, "lon": lon, "village": data.village_locator.properties[row]}
+
+@app.get("/api/locate")
+async def locate(request: Request, lat: float, lon: float):
+    """返回座標所在的村里（含薪資、人口密度與縣市內等級）"""
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise HTTPException(status_code=400, detail="lat / lon 超出範圍")
+    return await run_cpu_bound(request, ('locate', lat, lon), build_locate_response, lat, lon)
+
+def _parse_locate_points(body):
+    """解析批次定位的請求內容：{"points": [[lat, lon], ...]} 或 {"points": [{"lat": ..., "lon": ...}, ...]}"""
+    try:
+        points = json.loads(body)['points']
+        if not isinstance(points, list):
+            raise TypeError
+        if points and isinstance(points[0], dict):
+            coordinates = np.array([(point['lat'], point['lon']) for point in points], dtype=float)
+        else:
+            coordinates = np.array(points, dtype=float)
+    except (ValueError, KeyError, TypeError, IndexError):
+        raise HTTPException(status_code=400, detail='請求內容須為 {"points": [[lat, lon], ...]}')
+    if len(points) == 0:
+        return np.empty((0, 2))
+    if coordinates.ndim != 2 or coordinates.shape[1] != 2 or not np.isfinite(coordinates).all():
+        raise HTTPException(status_code=400, detail='請求內容須為 {"points": [[lat, lon], ...]}')
+    if len(coordinates) > LOCATE_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"一次最多 {LOCATE_MAX_POINTS} 個點")
+    return coordinates
+
+def build_locate_batch_response(data, body: bytes):
+    """批次查詢多個座標所在的村里，結果順序與輸入相同，找不到的點為 null"""
+    coordinates = _parse_locate_points(body)
+    rows = data.village_locator.locate(coordinates[:, 0], coordinates[:, 1]).tolist()
+    timing_mark('lookup')
+    properties = data.village_locator.properties
+    return {
+        "count": len(rows),
+        "matched": sum(1 for row in rows if row >= 0),
+        "results": [properties[row] if row >= 0 else None for row in rows]
+    }
+
+@app.post("/api/locate")
+async def locate_batch(request: Request):
+    """
+    批次查詢座標所在的村里（一次最多 10000 點）
+    
+    請求內容：{"points": [[lat, lon], ...]}，亦接受 [{"lat": ..., "lon": ...}, ...]
+    """
+    body = await request.body()
+    # 以請求內容的雜湊作為快取鍵值，相同的批次只運算一次
+    return await run_cpu_bound(request, ('locate_batch', hashlib.sha256(body).hexdigest()), build_locate_batch_response, body)
+
+# 範圍彙總查詢的多邊形頂點數上限
+AGGREGATE_MAX_VERTICES = 100000
+AGGREGATE_GEOMETRY_ERROR = '請求內容須為經緯度座標的 GeoJSON Polygon / MultiPolygon（或其 Feature / FeatureCollection）'
+
+def _parse_aggregate_geometry(body):
+    """
+    解析範圍彙總查詢的多邊形：GeoJSON Polygon / MultiPolygon，或其 Feature / FeatureCollection（合併為一個範圍）
+    
+    無效的多邊形（自相交等）以 make_valid 修復，只保留面的部分
+    """
+    try:
+        payload = json.loads(body)
+        if payload.get('type') == 'FeatureCollection':
+            geometries = [feature['geometry'] for feature in payload['features']]
+        elif payload.get('type') == 'Feature':
+            geometries = [payload['geometry']]
+        else:
+            geometries = [payload]
+        parts = np.array([shape(geometry) for geometry in geometries], dtype=object)
+    except (ValueError, KeyError, TypeError, AttributeError, IndexError, shapely.errors.GEOSException):
+        raise HTTPException(status_code=400, detail=AGGREGATE_GEOMETRY_ERROR)
+    if len(parts) == 0 or any(part.geom_type not in ('Polygon', 'MultiPolygon') for part in parts):
+        raise HTTPException(status_code=400, detail=AGGREGATE_GEOMETRY_ERROR)
+    if shapely.get_num_coordinates(parts).sum() > AGGREGATE_MAX_VERTICES:
+        raise HTTPException(status_code=400, detail=f"多邊形最多 {AGGREGATE_MAX_VERTICES} 個頂點")
+    coordinates = shapely.get_coordinates(parts)
+    if not (np.isfinite(coordinates).all() and (np.abs(coordinates[:, 0]) <= 180).all() and (np.abs(coordinates[:, 1]) <= 90).all()):
+        raise HTTPException(status_code=400, detail="座標須為經緯度（[lon, lat]）")
+    
+    invalid = ~shapely.is_valid(parts)
+    parts[invalid] = [_polygonal_part(part) for part in shapely.make_valid(parts[invalid])]
+    polygon = parts[0] if len(parts) == 1 else _polygonal_part(shapely.union_all(parts))
+    if polygon.is_empty or polygon.geom_type not in ('Polygon', 'MultiPolygon') or polygon.area == 0:
+        raise HTTPException(status_code=400, detail="多邊形的面積為零")
+    return polygon
+
+def build_aggregate_response(data, body: bytes):
+    """
+    彙總任意多邊形範圍內的人口、薪資與診所
+    
+    部分涵蓋的村里依涵蓋面積比例分配人口，薪資中位數以分配後的人口加權平均；
+    診所以 TWD97 TM2 座標判定是否在範圍內（含邊界），相同機構名稱與地址只計算一次
+    """
+    polygon = _parse_aggregate_geometry(body)
+    indicators = data.village_indicators
+    village_ids, fractions, rows = data.village_locator.coverage(polygon)
+    population = _indicator_array([indicators['population'][village_id] for village_id in village_ids.tolist()])
+    income = _indicator_array([indicators['median_income'][village_id] for village_id in village_ids.tolist()])
+    covered_population = population * fractions
+    has_population = ~np.isnan(covered_population)
+    weighted = has_population & ~np.isnan(income)
+    income_population = covered_population[weighted].sum()
+    timing_mark('villages')
+    
+    index = data.clinic_index
+    projected = shapely.transform(polygon, lambda xy: np.column_stack(index.transformer.transform(xy[:, 0], xy[:, 1])))
+    area_km2 = projected.area / 1e6
+    positions = index.within(projected)
+    specialty_counts = {specialty: int(mask[positions].sum()) for specialty, mask in index.specialty_masks.items()}
+    timing_mark('clinics')
+    
+    total_population = float(covered_population[has_population].sum())
+    properties = data.village_locator.properties
+    villages = [
+        {
+            "county": properties[row]["county"],
+            "district": properties[row]["district"],
+            "village": properties[row]["village"],
+            "coverage": round(fraction, 4),
+            "population": None if math.isnan(value) else round(value, 1),
+            "median_income": properties[row]["median_income"]
+        }
+        for row, fraction, value in zip(rows.tolist(), fractions.tolist(), covered_population.tolist())
+    ]
+    villages.sort(key=lambda village: (-village["coverage"], village["county"], village["district"], village["village"]))
+    return {
+        "area_km2": round(area_km2, 4),
+        "bounds": [round(value, 6) for value in polygon.bounds],
+        "village_count": len(villages),
+        "fully_covered_villages": int((fractions >= 1).sum()),
+        "population": round(total_population, 1),
+        "population_density": round(total_population / area_km2, 2) if area_km2 > 0 else None,
+        "median_income": round(float((income * covered_population)[weighted].sum() / income_population), 1) if income_population > 0 else None,
+        "clinics": {
+            "total": len(positions),
+            "per_10k_population": round(len(positions) / total_population * 10000, 3) if total_population > 0 else None,
+            "specialties": {specialty: count for specialty, count in sorted(specialty_counts.items()) if count}
+        },
+        "villages": villages
+    }
+
+@app.post("/api/aggregate")
+async def aggregate(request: Request):
+    """
+    彙總任意範圍（自行繪製的商圈、服務範圍或多個村里的聯集）內的人口、薪資中位數與各科別診所數
+    
+    請求內容：經緯度座標的 GeoJSON Polygon / MultiPolygon，或其 Feature / FeatureCollection（合併為一個範圍）
+    """
+    body = await request.body()
+    return await run_cpu_bound(request, ('aggregate', hashlib.sha256(body).hexdigest()), build_aggregate_response, body)
+
+def build_clinics_near_response(data, lat: float, lon: float, radius_km: Optional[float] = None, k: Optional[int] = None,
+                                specialties: Optional[str] = None):
+    """返回某點附近（可跨縣市）的診所，依距離排序"""
+    requested_specialties = {s.strip() for s in specialties.split(',') if s.strip()} if specialties else None
+    limit = k if k is not None else CLINIC_NEAR_MAX_RESULTS + 1
+    positions, distances = data.clinic_index.query(lat, lon, radius_km, limit, requested_specialties)
+    truncated = k is None and len(positions) > CLINIC_NEAR_MAX_RESULTS
+    positions, distances = positions[:CLINIC_NEAR_MAX_RESULTS], distances[:CLINIC_NEAR_MAX_RESULTS]
+    timing_mark('lookup')
+    
+    clinics = data.clinic_data.iloc[positions]
+    features = []
+    for name, address, county, clinic_specialties, original_specialty, clinic_lon, clinic_lat, distance in zip(
+            clinics['機構名稱'].tolist(), clinics['地址'].tolist(), clinics['縣市'].astype(str).tolist(), clinics['標準科別'].tolist(),
+            clinics['科別'].tolist(), clinics['經度'].tolist(), clinics['緯度'].tolist(), distances.tolist()):
+        features.append({
+            "type": "Feature",
+            "properties": {
+                "name": name,
+                "address": address,
+                "county": county,
+                "specialties": sorted(clinic_specialties) if clinic_specialties else [],
+                "original_specialty": original_specialty,
+                "distance_km": round(distance / 1000, 3)
+            },
+            "geometry": {
+                "type": "Point",
+                "coordinates": [float(clinic_lon), float(clinic_lat)]
+            }
+        })
+    
+    return {
+        "type": "FeatureCollection",
+        "query": {"lat": lat, "lon": lon, "radius_km": radius_km, "k": k, "specialties": sorted(requested_specialties or [])},
+        "truncated": truncated,
+        "features": features
+    }
+
+@app.get("/api/clinics/near")
+async def get_clinics_near(request: Request, lat: float, lon: float, radius_km: Optional[float] = None, k: Optional[int] = None,
+                           specialties: Optional[str] = None):
+    """
+    返回某點附近的診所（依距離排序，可跨縣市）
+    
+    - radius_km: 搜尋半徑（公里，最大 50）
+    - k: 返回最近的 k 間（最多 200）；同時指定時返回半徑內最近的 k 間
+    - specialties: 以逗號分隔的科別，符合任一即可
+    """
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise HTTPException(status_code=400, detail="lat / lon 超出範圍")
+    if radius_km is None and k is None:
+        raise HTTPException(status_code=400, detail="必須提供 radius_km 或 k")
+    if radius_km is not None and not 0 < radius_km <= CLINIC_NEAR_MAX_RADIUS_KM:
+        raise HTTPException(status_code=400, detail=f"radius_km 必須介於 0 到 {CLINIC_NEAR_MAX_RADIUS_KM} 之間")
+    if k is not None and not 1 <= k <= CLINIC_NEAR_MAX_K:
+        raise HTTPException(status_code=400, detail=f"k 必須介於 1 到 {CLINIC_NEAR_MAX_K} 之間")
+    return await run_cpu_bound(request, ('clinics_near', lat, lon, radius_km, k, specialties),
+                               build_clinics_near_response, lat, lon, radius_km, k, specialties)
+
+def build_clinic_gaps_response(data, county_name: str, specialty: Optional[str] = None, radius_km: float = CLINIC_GAP_DEFAULT_RADIUS_KM,
+                               income_weight: float = 0.3, top_n: int = 20):
+    """返回指定縣市與科別的診所供給不足村里排名（每間診所服務人口與薪資的全國百分位加權）"""
+    if radius_km not in CLINIC_GAP_RADII_KM:
+        raise HTTPException(status_code=400, detail=f"不支援的服務半徑: {radius_km}，可用半徑（公里）: {list(CLINIC_GAP_RADII_KM)}")
+    if not 0 <= income_weight <= 1:
+        raise HTTPException(status_code=400, detail="income_weight 必須介於 0 到 1 之間")
+    if top_n < 1 or top_n > 500:
+        raise HTTPException(status_code=400, detail="top_n 必須介於 1 到 500 之間")
+    
+    # 同一半徑的矩陣只計算一次，所有縣市、科別與權重共用
+    radius_key = int(radius_km)
+    if radius_key not in data.clinic_gap_cache:
+        data.clinic_gap_cache[radius_key] = compute_clinic_gaps(data, radius_key)
+    gaps = data.clinic_gap_cache[radius_key]
+    
+    specialty = specialty or CLINIC_GAP_ALL_SPECIALTIES
+    if specialty not in gaps['specialties']:
+        raise HTTPException(status_code=400, detail=f"不支援的科別: {specialty}，可用科別: {gaps['specialties']}")
+    column = gaps['specialties'].index(specialty)
+    
+    registry = data.village_registry
+    county_rows = np.flatnonzero(registry.county_of[registry.ids['village']] == registry.county_id(county_name))
+    if not len(county_rows):
+        raise HTTPException(status_code=404, detail=f"找不到縣市: {county_name}")
+    timing_mark('lookup')
+    
+    # 分數 0-100：每間診所服務人口的百分位（供給不足程度）與薪資百分位（消費能力）依權重加總；
+    # 缺少人口資料的村里（以及權重大於 0 時缺少薪資資料的村里）不列入排名
+    scores = gaps['supply_ranks'][county_rows, column] * (1 - income_weight)
+    if income_weight > 0:
+        scores = scores + gaps['income_ranks'][county_rows] * income_weight
+    scores = scores * 100
+    ranked = county_rows[~np.isnan(scores)]
+    order = np.argsort(-scores[~np.isnan(scores)], kind='stable')[:top_n]
+    
+    village_data = data.village_data
+    records = []
+    for rank, position in enumerate(ranked[order].tolist(), 1):
+        row = village_data.iloc[position]
+        records.append({
+            "rank": rank,
+            "county": str(row['COUNTYNAME']),
+            "district": str(row['TOWNNAME']),
+            "village": str(row['VILLNAME']),
+            "center_lat": _optional_float(row['center_lat']),
+            "center_lon": _optional_float(row['center_lon']),
+            "population": int(gaps['population'][position]),
+            "median_income": _optional_float(gaps['median_income'][position]),
+            "clinic_count": int(gaps['clinic_counts'][position, column]),
+            "population_per_clinic": float(gaps['population_per_clinic'][position, column]),
+            "score": round(float(scores[np.searchsorted(county_rows, position)]), 2)
+        })
+    
+    return {
+        "county": county_name,
+        "specialty": specialty,
+        "radius_km": radius_key,
+        "income_weight": income_weight,
+        "village_count": int(len(ranked)),
+        "villages": records
+    }
+
+@app.get("/api/clinic_gaps/{county_name}")
+async def get_clinic_gaps(request: Request, county_name: str, specialty: Optional[str] = None,
+                          radius_km: float = CLINIC_GAP_DEFAULT_RADIUS_KM, income_weight: float = 0.3, top_n: int = 20):
+    """返回指定縣市與科別的診所供給不足村里排名（分數越高越值得設立診所）"""
+    return await run_cpu_bound(request, ('clinic_gaps', county_name, specialty, radius_km, income_weight, top_n),
+                               build_clinic_gaps_response, county_name, specialty, radius_km, income_weight, top_n)
+
+def build_clinics_response(data, county_name: str, specialties: Optional[str] = None, deduplicate: bool = True):
+    """
+    返回指定縣市的診所地標資料
+    
+    Args:
+        deduplicate: 依機構名稱和地址去重；靜態檔（build_static.py）保留所有列，由前端依科別篩選後再去重，
+            結果才會與先篩選再去重的 API 相同
+    """
+    if data.clinic_data is None:
         raise HTTPException(status_code=500, detail="診所資料尚未載入")
     
-    # 篩選該縣市的診所
-    county_clinics = clinic_data[clinic_data['縣市'] == county_name].copy()
+    # 以縣市編號篩選該縣市的診所
+    clinic_county_ids, _ = data.village_registry.region_ids['clinic']
+    county_clinics = data.clinic_data[clinic_county_ids == data.village_registry.county_id(county_name)].copy()
     
     if county_clinics.empty:
         return {"type": "FeatureCollection", "features": []}
@@ -968,7 +4488,9 @@ async def get_clinics(county_name: str, specialties: Optional[str] = None):
             return {"type": "FeatureCollection", "features": []}
     
     # 依據機構名稱和地址去重，避免同一診所重複標記
-    county_clinics = county_clinics.drop_duplicates(subset=['機構名稱', '地址'])
+    if deduplicate:
+        county_clinics = county_clinics.drop_duplicates(subset=['機構名稱', '地址'])
+    timing_mark('lookup')
     
     # 轉換為 GeoJSON 格式
     clinics_geojson = {
@@ -997,15 +4519,19 @@ async def get_clinics(county_name: str, specialties: Optional[str] = None):
     
     return clinics_geojson
 
-@app.get("/api/clinic_specialties")
-async def get_clinic_specialties():
+@app.get("/api/clinics/{county_name}")
+async def get_clinics(request: Request, county_name: str, specialties: Optional[str] = None):
+    """返回指定縣市的診所地標資料"""
+    return await run_cpu_bound(request, ('clinics', county_name, specialties), build_clinics_response, county_name, specialties)
+
+def build_clinic_specialties_response(data):
     """返回所有可用的診所科別"""
-    if clinic_data is None:
+    if data.clinic_data is None:
         raise HTTPException(status_code=500, detail="診所資料尚未載入")
     
     # 收集所有標準化科別
     all_specialties = set()
-    for specialty_set in clinic_data['標準科別']:
+    for specialty_set in data.clinic_data['標準科別']:
         if specialty_set:
             all_specialties.update(specialty_set)
     
@@ -1047,19 +4573,342 @@ async def get_clinic_specialties():
         "total_count": len(specialties_data)
     }
 
+@app.get("/api/clinic_specialties")
+async def get_clinic_specialties(request: Request):
+    """返回所有可用的診所科別"""
+    return await run_cpu_bound(request, ('clinic_specialties',), build_clinic_specialties_response)
+
+# 村里資料匯出：格式 -> (Content-Type, 副檔名)；每段寫入 EXPORT_CHUNK_ROWS 列，記憶體用量不隨匯出範圍增加
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'gpkg': ('application/geopackage+sqlite3', 'gpkg'),
+}
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_READ_BYTES = 1024 * 1024
+
+def count_clinics_by_village(data):
+    """以村里多邊形定位每間診所（相同機構名稱與地址只計算一次），返回每個村里界列的診所數"""
+    _, first_rows = np.unique(data.clinic_index.clinic_keys, return_index=True)
+    rows = data.village_locator.locate(data.clinic_data['緯度'].to_numpy(dtype=float)[first_rows],
+                                       data.clinic_data['經度'].to_numpy(dtype=float)[first_rows])
+    return np.bincount(rows[rows >= 0], minlength=len(data.village_data))
+
+def build_export_table(data, county_name: Optional[str] = None):
+    """
+    組合匯出用的村里表（不含幾何），每個村里界一列
+    
+    欄位為縣市、鄉鎮市區、村里、面積、人口數、人口密度、最新薪資中位數、縣市內的薪資與人口密度等級
+    （與 /api/villages 相同）、村里內的診所數，以及薪資矩陣中每個年度的中位數、平均數與綜合所得總額
+    
+    Returns:
+        (village_data 列位置陣列, DataFrame)
+    """
+    registry, indicators = data.village_registry, data.village_indicators
+    village_ids = registry.ids['village']
+    if county_name:
+        positions = np.flatnonzero(registry.county_of[village_ids] == registry.county_id(county_name))
+        if not len(positions):
+            raise HTTPException(status_code=404, detail=f"找不到縣市: {county_name}")
+    else:
+        positions = np.arange(len(village_ids))
+    ids = village_ids[positions].tolist()
+    properties = [data.village_locator.properties[position] for position in positions.tolist()]
+    timing_mark('lookup')
+    
+    columns = {
+        'county': [item['county'] for item in properties],
+        'district': [item['district'] for item in properties],
+        'village': [item['village'] for item in properties],
+        'area_km2': data.village_data['area_km2'].to_numpy(dtype=float)[positions],
+        'population': pd.array([None if indicators['population'][village_id] is None else int(indicators['population'][village_id])
+                                for village_id in ids], dtype='Int64'),
+        'population_density': _indicator_array([item['population_density'] for item in properties]),
+        'median_income': _indicator_array([item['median_income'] for item in properties]),
+        'income_level': [item['income_level'] for item in properties],
+        'density_level': [item['density_level'] for item in properties],
+        'clinic_count': count_clinics_by_village(data)[positions],
+    }
+    
+    # 薪資矩陣的列以村里 ID 對應（同一 ID 有多列時取最後一列），沒有資料的村里為 NaN
+    matrix = data.salary_matrix
+    matrix_rows = np.full(len(registry.keys), -1, dtype=np.intp)
+    matrix_rows[registry.ids['salary_matrix']] = np.arange(len(registry.ids['salary_matrix']))
+    rows = matrix_rows[village_ids[positions]]
+    for metric in SALARY_GROWTH_METRICS:
+        values = np.asarray(matrix['matrices'][metric])[np.maximum(rows, 0)]
+        values[rows < 0] = np.nan
+        for column, year in enumerate(matrix['years'].tolist()):
+            columns[f'{metric}_{int(year)}'] = values[:, column]
+    timing_mark('join')
+    return positions, pd.DataFrame(columns)
+
+def _export_chunks(table, positions, geometries):
+    """依 EXPORT_CHUNK_ROWS 分段返回（屬性表, 幾何陣列或 None）"""
+    for start in range(0, len(table), EXPORT_CHUNK_ROWS):
+        stop = start + EXPORT_CHUNK_ROWS
+        yield table.iloc[start:stop], None if geometries is None else np.asarray(geometries[positions[start:stop]])
+
+def _stream_csv(table, positions, geometries):
+    """CSV（UTF-8 加 BOM 以便 Excel 辨識），幾何以 WKT 欄位輸出"""
+    yield '\ufeff'.encode('utf-8')
+    for index, (chunk, chunk_geometries) in enumerate(_export_chunks(table, positions, geometries)):
+        if chunk_geometries is not None:
+            chunk = chunk.assign(geometry=shapely.to_wkt(chunk_geometries, rounding_precision=7))
+        yield chunk.to_csv(index=False, header=index == 0).encode('utf-8')
+
+class _StreamBuffer(io.RawIOBase):
+    """只保留尚未送出的位元組、寫入位置持續累計的檔案物件（ParquetWriter 依位置記錄各段的偏移）"""
+    
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self.position
+    
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+def _stream_parquet(table, positions, geometries):
+    """Parquet，每段一個 row group；幾何以 WKB 欄位輸出並附 GeoParquet 中繼資料"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    sink = _StreamBuffer()
+    writer = None
+    try:
+        for chunk, chunk_geometries in _export_chunks(table, positions, geometries):
+            if chunk_geometries is not None:
+                chunk = chunk.assign(geometry=shapely.to_wkb(chunk_geometries))
+            if writer is None:
+                arrow_table = pa.Table.from_pandas(chunk, preserve_index=False)
+                schema = arrow_table.schema
+                if chunk_geometries is not None:
+                    # 未指定 crs 時 GeoParquet 預設為 OGC:CRS84（經度、緯度），與 EPSG:4326 的座標順序相同
+                    schema = schema.with_metadata({**(schema.metadata or {}), b'geo': json.dumps({
+                        "version": "1.0.0",
+                        "primary_column": "geometry",
+                        "columns": {"geometry": {"encoding": "WKB", "geometry_types": []}}
+                    }).encode()})
+                writer = pq.ParquetWriter(sink, schema)
+            else:
+                arrow_table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+            writer.write_table(arrow_table.replace_schema_metadata(writer.schema.metadata))
+            yield sink.drain()
+        if writer is not None:
+            writer.close()
+            writer = None
+            yield sink.drain()
+    finally:
+        if writer is not None:
+            writer.close()
+
+def _stream_gpkg(table, positions, geometries):
+    """GeoPackage 需要可隨機寫入的 SQLite 檔案：分段附加到暫存檔後再分段讀出，結束或中斷時刪除暫存檔"""
+    with tempfile.TemporaryDirectory(prefix='village_export_') as temp_dir:
+        file_path = Path(temp_dir) / 'villages.gpkg'
+        for index, (chunk, chunk_geometries) in enumerate(_export_chunks(table, positions, geometries)):
+            chunk = chunk.astype({'population': float})  # 部分寫入引擎不支援可為空的整數欄位
+            gpd.GeoDataFrame(chunk, geometry=chunk_geometries, crs='EPSG:4326').to_file(
+                file_path, layer='villages', driver='GPKG', mode='w' if index == 0 else 'a')
+        with open(file_path, 'rb') as f:
+            while True:
+                block = f.read(EXPORT_READ_BYTES)
+                if not block:
+                    break
+                yield block
+
+EXPORT_WRITERS = {'csv': _stream_csv, 'parquet': _stream_parquet, 'gpkg': _stream_gpkg}
+
+@app.get("/api/export")
+async def export_villages(county_name: Optional[str] = None, format: str = 'csv', geometry: bool = False):
+    """
+    匯出單一縣市或全台村里的合併資料表（CSV / Parquet / GeoPackage），分段串流輸出
+    
+    geometry=true 時附上村里界（CSV 為 WKT、Parquet 為 WKB），GeoPackage 一律包含幾何
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支援的匯出格式: {format}，可用格式: {list(EXPORT_FORMATS)}")
+    snapshot = current_snapshot()
+    # 合併資料表在執行緒池中建置；串流過程中的序列化由 Starlette 在執行緒中逐段執行
+    loop = asyncio.get_running_loop()
+    cost = await admission.acquire('export', ('export', county_name))
+    started = time.perf_counter()
+    try:
+        positions, table = await loop.run_in_executor(cpu_executor, build_export_table, snapshot, county_name)
+    finally:
+        admission.release('export', cost, ('export', county_name), time.perf_counter() - started)
+    
+    geometries = snapshot.village_data.geometry.values if geometry or format == 'gpkg' else None
+    media_type, extension = EXPORT_FORMATS[format]
+    filename = f"villages_{county_name or 'taiwan'}.{extension}"
+    headers = {'Content-Disposition': f"attachment; filename=\"villages.{extension}\"; filename*=UTF-8''{quote(filename)}"}
+    return StreamingResponse(EXPORT_WRITERS[format](table, positions, geometries), media_type=media_type, headers=headers)
+
+def _dataframe_memory(df):
+    """計算 DataFrame 的記憶體用量（位元組），幾何欄位以座標數估算"""
+    column_bytes = {}
+    for column in df.columns:
+        if isinstance(df[column].dtype, gpd.array.GeometryDtype):
+            geometries = df[column].values
+            # 每個座標 16 bytes，加上每個幾何物件的固定開銷
+            column_bytes[column] = int(shapely.get_num_coordinates(np.asarray(geometries)).sum() * 16 + len(geometries) * 100)
+        elif df[column].dtype == object:
+            # 共用的物件（例如 interned 科別集合）只計算一次
+            unique_objects = {id(value): value for value in df[column].to_numpy()}
+            column_bytes[column] = len(df) * 8 + sum(sys.getsizeof(value) for value in unique_objects.values())
+        else:
+            column_bytes[column] = int(df[column].memory_usage(deep=True, index=False))
+    return {
+        "rows": len(df),
+        "bytes": sum(column_bytes.values()) + int(df.index.memory_usage(deep=True)),
+        "columns": {column: {"dtype": str(df[column].dtype), "bytes": size} for column, size in column_bytes.items()}
+    }
+
+def _process_memory():
+    """返回目前程序的常駐記憶體（RSS）與峰值（位元組），平台不支援時為 None"""
+    current_rss = None
+    peak_rss = None
+    try:
+        with open('/proc/self/statm') as f:
+            current_rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux 單位為 KB
+    except ImportError:
+        pass
+    return {"rss_bytes": current_rss, "peak_rss_bytes": peak_rss}
+
+def build_memory_report(snapshot):
+    """計算資料快照中各資料集的記憶體用量（逐欄位走訪，全台資料約需數百毫秒）"""
+    salary_matrix = snapshot.salary_matrix
+    datasets = {}
+    for name in ('county_data', 'village_data', 'district_data', 'salary_data', 'population_data', 'population_history', 'clinic_data'):
+        datasets[name] = _dataframe_memory(getattr(snapshot, name))
+    registry = snapshot.village_registry
+    if registry is not None:
+        # 編號陣列加上以 ID 為索引的指標列表（None 共用同一個物件）
+        indicator_bytes = sum(sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values if value is not None)
+                              for values in snapshot.village_indicators.values())
+        datasets['village_registry'] = {
+            "villages": len(registry.keys),
+            "bytes": registry.nbytes() + indicator_bytes
+        }
+    if salary_matrix is not None:
+        datasets['salary_matrix'] = {
+            "villages": len(salary_matrix['villages']),
+            "years": len(salary_matrix['years']),
+            "bytes": int(sum(matrix.nbytes for matrix in salary_matrix['matrices'].values())
+                         + sum(salary_matrix[k].nbytes for k in ('counties', 'districts', 'villages', 'years'))),
+            "memory_mapped": snapshot.source == 'shared'
+        }
+    for scheme, table in snapshot.insurance_brackets.items():
+        datasets[f'insurance_{scheme}'] = _dataframe_memory(table)
+    
+    return {
+        "data_source": snapshot.source,
+        "snapshot_version": snapshot.version,
+        "total_bytes": sum(d['bytes'] for d in datasets.values()),
+        "datasets": datasets,
+        "process": _process_memory()
+    }
+
+@app.get("/api/debug/memory")
+async def get_memory_report(request: Request):
+    """返回目前資料快照中各資料集的記憶體用量報告（需要 X-Admin-Token 標頭），在執行緒池中計算"""
+    _check_admin_token(request)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, build_memory_report, current_snapshot())
+
+@app.get("/api/debug/profiles")
+async def list_profiles(request: Request):
+    """列出最近的取樣分析（需要 X-Admin-Token 標頭），由新到舊"""
+    _check_admin_token(request)
+    return {
+        "buffer_size": profile_records.maxlen,
+        "default_interval_ms": PROFILE_INTERVAL_MS,
+        "profiles": [profile.summary() for profile in reversed(profile_records)]
+    }
+
+@app.get("/api/debug/profiles/{profile_id}")
+async def download_profile(request: Request, profile_id: int, format: str = 'folded'):
+    """
+    下載取樣分析（需要 X-Admin-Token 標頭）
+    
+    - format=folded：flamegraph.pl、speedscope、inferno 可直接讀取的 folded stacks 文字檔
+    - format=json：摘要與每個堆疊的取樣次數
+    """
+    _check_admin_token(request)
+    profile = next((profile for profile in profile_records if profile.id == profile_id), None)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"找不到取樣分析 #{profile_id}（只保留最近 {profile_records.maxlen} 筆）")
+    if format == 'json':
+        return {**profile.summary(), "stacks": dict(profile.stacks.most_common())}
+    if format != 'folded':
+        raise HTTPException(status_code=400, detail="format 必須是 folded 或 json")
+    return PlainTextResponse(profile.folded(), headers={
+        'Content-Disposition': f'attachment; filename="profile-{profile.id}.folded"'
+    })
+
+@app.post("/api/admin/reload")
+async def admin_reload(request: Request, force: bool = False):
+    """在背景重新載入有變更的資料集（需要 X-Admin-Token 標頭），進度可由 /api/health 的 reload 欄位查詢"""
+    _check_admin_token(request)
+    
+    started = start_reload('admin', force)
+    return JSONResponse(status_code=202, content={
+        "status": "started" if started else "already_running",
+        "reload": dict(reload_status)
+    })
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 格式的監控指標（請求延遲、回應大小、快取命中率、資料載入耗時）"""
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
+
 @app.get("/api/health")
 async def health_check():
     """健康檢查端點"""
+    snapshot = data_snapshot
+    loaded = snapshot is not None
     return {
         "status": "healthy",
-        "county_data_loaded": county_data is not None,
-        "village_data_loaded": village_data is not None,
-        "salary_data_loaded": salary_data is not None,
-        "population_data_loaded": population_data is not None,
-        "clinic_data_loaded": clinic_data is not None,
-        "salary_mappings": len(village_salary_mapping) if village_salary_mapping else 0,
-        "population_mappings": len(village_population_mapping) if village_population_mapping else 0,
-        "clinic_count": len(clinic_data) if clinic_data is not None else 0
+        "data_source": snapshot.source if loaded else None,
+        "snapshot": {
+            "version": snapshot.version,
+            "loaded_at": snapshot.loaded_at,
+            "signatures": snapshot.signatures
+        } if loaded else None,
+        "reload": dict(reload_status),
+        "county_data_loaded": loaded,
+        "village_data_loaded": loaded,
+        "salary_data_loaded": loaded,
+        "population_data_loaded": loaded,
+        "clinic_data_loaded": loaded,
+        "salary_mappings": sum(1 for value in snapshot.village_indicators['median_income'] if value is not None) if loaded else 0,
+        "population_mappings": sum(1 for value in snapshot.village_indicators['population_density'] if value is not None) if loaded else 0,
+        "name_match_rates": snapshot.village_registry.match_rates if loaded else None,
+        "clinic_count": len(snapshot.clinic_data) if loaded else 0,
+        "inflight_requests": len(inflight_requests),
+        "admission": admission.status(),
+        "warmup": cache_warmer.report(),
+        "response_cache": {
+            "entries": len(response_cache),
+            "bytes": response_cache_bytes,
+            **response_stats
+        }
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+混合負載下的並行延遲量測
+
+同時送出大量 CPU 密集請求（村里、診所、薪資成長）與固定間隔的 /api/health 探測，
+分別統計各類請求的 p50 / p90 / p99 延遲，以及被准入控制拒絕（503）的次數。用來比較把 CPU 工作移出事件迴圈前後的差異：
+
+    CPU_OFFLOAD=0 uvicorn backend.main:app --port 8000   # 舊行為：在事件迴圈中直接運算
+    python benchmarks/concurrency_benchmark.py --label inline --output inline.json
+
+    CPU_OFFLOAD=1 uvicorn backend.main:app --port 8000   # 執行緒池 + 請求合併
+    python benchmarks/concurrency_benchmark.py --label offload --output offload.json
+
+需要安裝 httpx（pip install httpx）。
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - 僅在未安裝時提示
+    raise SystemExit("需要安裝 httpx：pip install httpx")
+
+
+def percentile(values, q):
+    """計算百分位數（最近秩法），values 為空時返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples, duration):
+    """將 (延遲秒數, 狀態) 樣本整理為統計摘要（毫秒），狀態為 HTTP 狀態碼或連線錯誤時的 None"""
+    latencies = [latency * 1000 for latency, status in samples if status == 200]
+    return {
+        'count': len(samples),
+        'shed': sum(1 for _, status in samples if status == 503),
+        'errors': sum(1 for _, status in samples if status not in (200, 503)),
+        'throughput_rps': round(len(samples) / duration, 2) if duration else None,
+        'p50_ms': percentile(latencies, 50),
+        'p90_ms': percentile(latencies, 90),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': max(latencies) if latencies else None,
+    }
+
+
+def build_heavy_requests(counties, specialties, unique_ratio, rng):
+    """產生一個 CPU 密集請求的 (類別, 路徑, 參數)"""
+    county = rng.choice(counties)
+    kind = rng.choice(['villages', 'villages', 'clinics', 'salary_growth'])
+    if kind == 'villages':
+        if rng.random() < unique_ratio:
+            income_weight = round(rng.random(), 3)
+        else:
+            income_weight = 0.5
+        return kind, f"/api/villages/{county}", {
+            'income_weight': income_weight,
+            'density_weight': round(1 - income_weight, 3)
+        }
+    if kind == 'clinics':
+        params = {}
+        if specialties and rng.random() < unique_ratio:
+            params['specialties'] = ','.join(rng.sample(specialties, k=min(len(specialties), rng.randint(1, 3))))
+        return kind, f"/api/clinics/{county}", params
+    start_year = rng.randint(2011, 2018) if rng.random() < unique_ratio else 2011
+    return kind, "/api/salary_growth", {'county_name': county, 'start_year': start_year}
+
+
+async def heavy_worker(client, deadline, counties, specialties, unique_ratio, samples, rng):
+    while time.perf_counter() < deadline:
+        kind, path, params = build_heavy_requests(counties, specialties, unique_ratio, rng)
+        start = time.perf_counter()
+        try:
+            response = await client.get(path, params=params)
+            status = response.status_code
+        except httpx.HTTPError:
+            status = None
+        samples.setdefault(kind, []).append((time.perf_counter() - start, status))
+
+
+async def health_prober(client, deadline, interval, samples):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await client.get("/api/health")
+            status = response.status_code
+        except httpx.HTTPError:
+            status = None
+        elapsed = time.perf_counter() - start
+        samples.setdefault('health', []).append((elapsed, status))
+        await asyncio.sleep(max(0.0, interval - elapsed))
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=args.concurrency + 2)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=timeout, limits=limits) as client:
+        counties = args.counties.split(',') if args.counties else [
+            feature['properties']['name'] for feature in (await client.get("/api/counties")).json()['features']
+        ]
+        specialties = [item['name'] for item in (await client.get("/api/clinic_specialties")).json()['specialties']]
+
+        samples = {}
+        started = time.perf_counter()
+        deadline = started + args.duration
+        tasks = [health_prober(client, deadline, args.health_interval, samples)]
+        tasks += [
+            heavy_worker(client, deadline, counties, specialties, args.unique_ratio, samples, random.Random(rng.random()))
+            for _ in range(args.concurrency)
+        ]
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+        health = (await client.get("/api/health")).json()
+
+    return {
+        'label': args.label,
+        'base_url': args.base_url,
+        'duration_s': round(elapsed, 2),
+        'concurrency': args.concurrency,
+        'unique_ratio': args.unique_ratio,
+        'results': {kind: summarize(kind_samples, elapsed) for kind, kind_samples in sorted(samples.items())},
+        'server_response_cache': health.get('response_cache'),
+        'server_admission': health.get('admission'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="混合負載下的並行延遲量測")
+    parser.add_argument('--base-url', default="http://127.0.0.1:8000", help="後端服務網址")
+    parser.add_argument('--duration', type=float, default=20.0, help="量測秒數")
+    parser.add_argument('--concurrency', type=int, default=8, help="同時進行的 CPU 密集請求數")
+    parser.add_argument('--health-interval', type=float, default=0.1, help="/api/health 探測間隔（秒）")
+    parser.add_argument('--unique-ratio', type=float, default=0.8,
+                        help="使用隨機參數的請求比例（越高越少命中快取，0 表示全部為相同請求）")
+    parser.add_argument('--counties', default=None, help="以逗號分隔的縣市清單（預設使用全部縣市）")
+    parser.add_argument('--timeout', type=float, default=60.0, help="單一請求逾時秒數")
+    parser.add_argument('--seed', type=int, default=7, help="亂數種子")
+    parser.add_argument('--label', default="run", help="此次量測的標籤")
+    parser.add_argument('--output', default=None, help="將結果寫入 JSON 檔案")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(f"[{report['label']}] {report['duration_s']}s, concurrency={report['concurrency']}")
+    print(f"{'類別':<16}{'次數':>8}{'503':>6}{'錯誤':>6}{'rps':>9}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for kind, stats in report['results'].items():
+        def fmt(value):
+            return f"{value:>10.1f}" if value is not None else f"{'-':>10}"
+        print(f"{kind:<16}{stats['count']:>8}{stats['shed']:>6}{stats['errors']:>6}{stats['throughput_rps']:>9}"
+              f"{fmt(stats['p50_ms'])}{fmt(stats['p90_ms'])}{fmt(stats['p99_ms'])}{fmt(stats['max_ms'])}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果已寫入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
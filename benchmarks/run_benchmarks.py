@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+端到端效能量測
+
+1. 以 benchmarks/synthetic_data.py 產生（或使用既有的）合成資料
+2. 量測 load_and_process_data 各階段耗時
+3. 量測每個 API 端點在未快取（cold）與已快取（cached）下的延遲、吞吐量與回應大小
+4. 量測取樣分析（X-Profile）對回應建置時間的影響
+5. 將結果寫入 benchmarks/results/<時間>-<commit>.json，並可與先前的結果比較
+
+使用方式：
+    python benchmarks/run_benchmarks.py --scale 1.0
+    python benchmarks/run_benchmarks.py --scale 1.0 --compare benchmarks/results/<baseline>.json --fail-on-regression
+"""
+
+import argparse
+import contextlib
+import functools
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+sys.path.insert(0, str(PROJECT_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+def percentile(values, q):
+    """最近秩法百分位數"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_stats(latencies):
+    """整理延遲樣本（秒）為毫秒統計"""
+    ms = [value * 1000 for value in latencies]
+    mean = statistics.mean(ms)
+    return {
+        'samples': len(ms),
+        'mean_ms': round(mean, 3),
+        'p50_ms': round(percentile(ms, 50), 3),
+        'p90_ms': round(percentile(ms, 90), 3),
+        'p99_ms': round(percentile(ms, 99), 3),
+        'throughput_rps': round(1000 / mean, 2) if mean else None,
+    }
+
+
+def git_revision():
+    """返回目前 commit（含未提交修改標記），非 git 目錄時返回 'unknown'"""
+    try:
+        sha = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=PROJECT_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return f"{sha}-dirty" if dirty else sha
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def endpoint_cases(main):
+    """
+    每個端點的代表性請求：(名稱, 路徑, 查詢參數)，POST 端點另有第四個元素為 JSON 請求內容
+    以資料量最多的縣市與其中一個村里作為參數
+    """
+    village_data = main.data_snapshot.village_data
+    village_counts = village_data['COUNTYNAME'].value_counts()
+    county = str(village_counts.index[0])
+    sample = village_data[village_data['COUNTYNAME'] == county].iloc[0]
+    district = str(sample['TOWNNAME'])
+    village = str(sample['VILLNAME'])
+    lat, lon = float(sample['center_lat']), float(sample['center_lon'])
+    # 以村里中心點為圓心、半徑約 8 公里的多邊形（約為一個城市的範圍）
+    catchment = {'type': 'Polygon', 'coordinates': [[
+        [round(lon + 0.08 * math.cos(angle), 6), round(lat + 0.08 * math.sin(angle), 6)]
+        for angle in [2 * math.pi * step / 64 for step in range(64)] + [0.0]
+    ]]}
+
+    return [
+        ('root', '/', {}),
+        ('health', '/api/health', {}),
+        ('counties', '/api/counties', {}),
+        ('villages', f'/api/villages/{county}', {}),
+        ('villages_weighted', f'/api/villages/{county}', {'income_weight': 0.3, 'density_weight': 0.7}),
+        ('districts', f'/api/districts/{county}', {}),
+        ('hexgrid', '/api/hexgrid', {'county_name': county}),
+        ('hexgrid_bbox', '/api/hexgrid', {'cell_km': 1, 'bbox': f'{lon - 0.1},{lat - 0.1},{lon + 0.1},{lat + 0.1}'}),
+        ('summary_national', '/api/summary', {}),
+        ('summary_county', '/api/summary', {'county_name': county, 'year': 2015}),
+        ('village_salary', f'/api/village_salary/{village}', {'county_name': county, 'district_name': district}),
+        ('village_population', f'/api/village_population/{village}', {'county_name': county, 'district_name': district}),
+        ('salary_growth_county', '/api/salary_growth', {'county_name': county}),
+        ('salary_growth_national', '/api/salary_growth', {'top_n': 50}),
+        ('insurance', '/api/insurance', {'salary': 42000, 'dependents': 1}),
+        ('insurance_villages', '/api/insurance/villages', {'metric': 'average'}),
+        ('bivariate_colors', '/api/bivariate_colors', {}),
+        ('clinics', f'/api/clinics/{county}', {}),
+        ('clinics_specialties', f'/api/clinics/{county}', {'specialties': '兒科,內科'}),
+        ('clinic_specialties', '/api/clinic_specialties', {}),
+        ('clinics_near_radius', '/api/clinics/near', {'lat': lat, 'lon': lon, 'radius_km': 2, 'specialties': '兒科'}),
+        ('clinics_near_k', '/api/clinics/near', {'lat': lat, 'lon': lon, 'k': 10}),
+        ('clinic_gaps', f'/api/clinic_gaps/{county}', {'specialty': '兒科'}),
+        ('locate', '/api/locate', {'lat': lat, 'lon': lon}),
+        ('aggregate', '/api/aggregate', {}, catchment),
+        ('export_csv', '/api/export', {'county_name': county}),
+        ('export_parquet', '/api/export', {'format': 'parquet', 'geometry': 'true'}),
+        ('search_village', '/api/search', {'q': village}),
+        ('search_clinic', '/api/search', {'q': f'{county} 診所', 'type': 'clinic'}),
+        ('debug_memory', '/api/debug/memory', {}),
+        ('metrics', '/metrics', {}),
+    ]
+
+
+def measure_load(main, repeats):
+    """重複載入資料並取各階段耗時的中位數"""
+    runs = []
+    for _ in range(repeats):
+        snapshot = main.load_and_process_data()
+        runs.append(dict(snapshot.stage_timings))
+    return {stage: round(statistics.median(run[stage] for run in runs), 4) for stage in runs[0]}
+
+
+def measure_endpoints(main, client, iterations):
+    results = {}
+    for name, path, params, *body in endpoint_cases(main):
+        if body:
+            send = functools.partial(client.post, path, params=params, json=body[0])
+        else:
+            send = functools.partial(client.get, path, params=params)
+        cold, cached = [], []
+        status = None
+        payload_bytes = None
+        for _ in range(iterations):
+            main.clear_response_cache()
+            start = time.perf_counter()
+            response = send()
+            cold.append(time.perf_counter() - start)
+            status = response.status_code
+            payload_bytes = len(response.content)
+        for _ in range(iterations):
+            start = time.perf_counter()
+            send()
+            cached.append(time.perf_counter() - start)
+        results[name] = {
+            'path': path,
+            'params': params,
+            'status': status,
+            'payload_bytes': payload_bytes,
+            'cold': latency_stats(cold),
+            'cached': latency_stats(cached),
+        }
+    return results
+
+
+PROFILE_OVERHEAD_CASES = ('villages', 'districts', 'hexgrid', 'summary_national', 'clinic_gaps')
+
+
+def measure_profile_overhead(main, client, iterations):
+    """同一端點未快取時，一般請求與取樣分析請求（X-Profile: 1）的延遲比較"""
+    results = {}
+    for name, path, params, *_ in endpoint_cases(main):
+        if name not in PROFILE_OVERHEAD_CASES:
+            continue
+        plain, profiled = [], []
+        samples = []
+        for _ in range(iterations):
+            main.clear_response_cache()
+            start = time.perf_counter()
+            client.get(path, params=params)
+            plain.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            response = client.get(path, params=params, headers={'X-Profile': '1'})
+            profiled.append(time.perf_counter() - start)
+            profile_id = int(response.headers['X-Profile-Id'])
+            samples.append(next(profile.samples for profile in main.profile_records if profile.id == profile_id))
+        plain_stats, profiled_stats = latency_stats(plain), latency_stats(profiled)
+        results[name] = {
+            'plain': plain_stats,
+            'profiled': profiled_stats,
+            'overhead_pct': round((profiled_stats['p50_ms'] - plain_stats['p50_ms']) / plain_stats['p50_ms'] * 100, 1),
+            'samples_p50': statistics.median(samples),
+        }
+    return results
+
+
+def uncovered_routes(main, results):
+    """列出沒有量測案例的 GET 路由，提醒新增端點時一併補上"""
+    measured = {result['path'] for result in results.values()}
+    uncovered = []
+    for route in main.app.routes:
+        if 'GET' not in (getattr(route, 'methods', None) or set()) or route.path in ('/openapi.json', '/docs', '/docs/oauth2-redirect', '/redoc'):
+            continue
+        if not any(route.path_regex.match(path) for path in measured):
+            uncovered.append(route.path)
+    return sorted(uncovered)
+
+
+def compare(current, baseline, threshold):
+    """比較兩次結果，返回超過門檻的退步項目"""
+    regressions = []
+    rows = []
+    for stage, seconds in current['load_stages'].items():
+        before = baseline.get('load_stages', {}).get(stage)
+        if before:
+            change = (seconds - before) / before
+            rows.append((f"load:{stage}", before * 1000, seconds * 1000, change))
+    for name, result in current['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(name)
+        if before:
+            for mode in ('cold', 'cached'):
+                old, new = before[mode]['p50_ms'], result[mode]['p50_ms']
+                if old:
+                    rows.append((f"{name}:{mode}", old, new, (new - old) / old))
+    print(f"\n與 {baseline.get('revision')} ({baseline.get('timestamp')}) 比較（p50，ms）")
+    for label, old, new, change in rows:
+        flag = ''
+        # 太小的數值容易受雜訊影響，低於 1ms 的項目不判定退步
+        if change > threshold and new - old > 1:
+            flag = '  <-- 退步'
+            regressions.append(label)
+        print(f"  {label:<40}{old:>10.2f}{new:>10.2f}{change * 100:>+9.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端效能量測")
+    parser.add_argument('--data-dir', default=None, help="使用既有的資料目錄（預設產生合成資料）")
+    parser.add_argument('--scale', type=float, default=0.3, help="合成資料規模（1.0 約等於正式資料）")
+    parser.add_argument('--seed', type=int, default=42, help="合成資料亂數種子")
+    parser.add_argument('--load-repeats', type=int, default=1, help="資料載入的重複次數")
+    parser.add_argument('--iterations', type=int, default=5, help="每個端點的量測次數")
+    parser.add_argument('--output', default=None, help="結果檔案路徑（預設寫入 benchmarks/results/）")
+    parser.add_argument('--compare', default=None, help="與先前的結果檔案比較")
+    parser.add_argument('--threshold', type=float, default=0.25, help="判定退步的變化比例")
+    parser.add_argument('--fail-on-regression', action='store_true', help="發現退步時以非零狀態結束")
+    parser.add_argument('--verbose', action='store_true', help="顯示後端的載入訊息")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        if args.data_dir:
+            data_dir = Path(args.data_dir)
+        else:
+            import synthetic_data
+            data_dir = Path(stack.enter_context(tempfile.TemporaryDirectory(prefix='taiwan_map_bench_')))
+            started = time.perf_counter()
+            summary = synthetic_data.generate(data_dir, scale=args.scale, seed=args.seed)
+            print(f"合成資料已產生（{time.perf_counter() - started:.1f}s）: {summary}")
+
+        # 必須在匯入後端之前設定資料目錄；管理端點（/api/debug/memory）與取樣分析需要權杖
+        os.environ['DATA_BASE_DIR'] = str(data_dir)
+        os.environ.setdefault('ADMIN_TOKEN', 'benchmark')
+        os.environ['PROFILE_SAMPLE_RATE'] = '1'
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with quiet:
+            import backend.main as backend_main
+            from fastapi.testclient import TestClient
+            load_stages = measure_load(backend_main, args.load_repeats)
+            client = TestClient(backend_main.app, headers={'X-Admin-Token': os.environ['ADMIN_TOKEN']})
+            endpoints = measure_endpoints(backend_main, client, args.iterations)
+            profile_overhead = measure_profile_overhead(backend_main, client, args.iterations)
+
+        import pandas
+        report = {
+            'revision': git_revision(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'data': {'data_dir': None if not args.data_dir else str(data_dir), 'scale': args.scale, 'seed': args.seed},
+            'environment': {
+                'python': platform.python_version(),
+                'pandas': pandas.__version__,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'load_stages': load_stages,
+            'endpoints': endpoints,
+            'profile_overhead': profile_overhead,
+            'uncovered_routes': uncovered_routes(backend_main, endpoints),
+        }
+
+    print("\n資料載入階段耗時（秒）")
+    for stage, seconds in report['load_stages'].items():
+        print(f"  {stage:<28}{seconds:>10.3f}")
+    print("\n端點延遲（ms）")
+    print(f"  {'端點':<26}{'狀態':>6}{'大小 KB':>10}{'cold p50':>10}{'cold p99':>10}{'cached p50':>12}{'cold rps':>10}")
+    for name, result in report['endpoints'].items():
+        print(f"  {name:<28}{result['status']:>6}{result['payload_bytes'] / 1024:>10.1f}"
+              f"{result['cold']['p50_ms']:>10.2f}{result['cold']['p99_ms']:>10.2f}"
+              f"{result['cached']['p50_ms']:>12.2f}{result['cold']['throughput_rps']:>10.1f}")
+    print("\n取樣分析的額外耗時（未快取 p50，ms）")
+    print(f"  {'端點':<26}{'一般':>10}{'取樣':>10}{'增加':>9}{'樣本數':>8}")
+    for name, result in report['profile_overhead'].items():
+        print(f"  {name:<28}{result['plain']['p50_ms']:>10.2f}{result['profiled']['p50_ms']:>10.2f}"
+              f"{result['overhead_pct']:>+8.1f}%{result['samples_p50']:>8g}")
+    if report['uncovered_routes']:
+        print(f"\n警告：以下端點沒有量測案例: {report['uncovered_routes']}")
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}-{report['revision']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果已寫入 {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n發現 {len(regressions)} 項退步: {regressions}")
+            if args.fail_on_regression:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
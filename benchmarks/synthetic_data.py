@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+產生與正式資料結構相同的合成台灣資料
+
+真實輸入檔（村里界 GeoJSON、薪資 CSV、人口 CSV、診所 CSV）皆為 Git LFS 物件，
+離線時無法取得。此腳本依照相同的目錄結構與欄位產生可調整規模的合成資料，
+讓後端可以在沒有 LFS 的環境下啟動、測試與量測效能。
+
+使用方式：
+    python benchmarks/synthetic_data.py --output /tmp/synthetic --scale 1.0
+    DATA_BASE_DIR=/tmp/synthetic uvicorn backend.main:app
+"""
+
+import argparse
+import csv
+import json
+import math
+import random
+import shutil
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+# 與正式資料相同的 22 個縣市
+COUNTY_NAMES = [
+    '臺北市', '新北市', '桃園市', '臺中市', '臺南市', '高雄市',
+    '基隆市', '新竹市', '嘉義市', '新竹縣', '苗栗縣', '彰化縣',
+    '南投縣', '雲林縣', '嘉義縣', '屏東縣', '宜蘭縣', '花蓮縣',
+    '臺東縣', '澎湖縣', '金門縣', '連江縣'
+]
+
+# 原始科別字串（會經過 standardize_specialties 標準化）
+RAW_SPECIALTIES = [
+    '家庭醫學科', '西醫一般科', '整形外科', '醫美整形', '皮膚科', '牙科', '中醫',
+    '眼科', '耳鼻喉科', '骨科', '內科', '外科', '婦產科', '兒科', '精神科',
+    '神經科', '復健科', '泌尿科', '放射診斷科', '職業醫學科', '麻醉科'
+]
+
+SALARY_YEARS = list(range(2011, 2024))  # 2011-2023，共 13 年
+
+# 台灣本島大致範圍（WGS84）
+LON_MIN, LON_MAX = 120.0, 122.0
+LAT_MIN, LAT_MAX = 21.9, 25.3
+
+
+def _grid_shape(n):
+    """回傳接近正方形的 (列, 行) 數量"""
+    cols = max(1, int(math.ceil(math.sqrt(n))))
+    rows = max(1, int(math.ceil(n / cols)))
+    return rows, cols
+
+
+def _rectangle(lon0, lat0, lon1, lat1, jitter_vertices=0):
+    """建立矩形多邊形座標，可在邊上加入額外頂點以模擬真實邊界的頂點數"""
+    ring = []
+    corners = [(lon0, lat0), (lon1, lat0), (lon1, lat1), (lon0, lat1)]
+    for i in range(4):
+        start = corners[i]
+        end = corners[(i + 1) % 4]
+        ring.append([start[0], start[1]])
+        for k in range(1, jitter_vertices + 1):
+            t = k / (jitter_vertices + 1)
+            ring.append([start[0] + (end[0] - start[0]) * t, start[1] + (end[1] - start[1]) * t])
+    ring.append(ring[0])
+    return [ring]
+
+
+def build_layout(scale, rng):
+    """建立縣市 → 鄉鎮市區 → 村里的階層與幾何範圍"""
+    districts_per_county = max(1, int(round(17 * scale)))
+    villages_per_district = max(1, int(round(21 * scale)))
+
+    county_rows, county_cols = _grid_shape(len(COUNTY_NAMES))
+    county_w = (LON_MAX - LON_MIN) / county_cols
+    county_h = (LAT_MAX - LAT_MIN) / county_rows
+
+    layout = []
+    for c_idx, county in enumerate(COUNTY_NAMES):
+        c_row, c_col = divmod(c_idx, county_cols)
+        c_lon0 = LON_MIN + c_col * county_w
+        c_lat0 = LAT_MIN + c_row * county_h
+        county_entry = {
+            'name': county,
+            'code': f"{c_idx + 1:05d}",
+            'bounds': (c_lon0, c_lat0, c_lon0 + county_w, c_lat0 + county_h),
+            'districts': []
+        }
+
+        d_rows, d_cols = _grid_shape(districts_per_county)
+        d_w = county_w / d_cols
+        d_h = county_h / d_rows
+        for d_idx in range(districts_per_county):
+            d_row, d_col = divmod(d_idx, d_cols)
+            d_lon0 = c_lon0 + d_col * d_w
+            d_lat0 = c_lat0 + d_row * d_h
+            district = {
+                'name': f"{county[:2]}第{d_idx + 1}區",
+                'villages': []
+            }
+
+            v_rows, v_cols = _grid_shape(villages_per_district)
+            v_w = d_w / v_cols
+            v_h = d_h / v_rows
+            for v_idx in range(villages_per_district):
+                v_row, v_col = divmod(v_idx, v_cols)
+                v_lon0 = d_lon0 + v_col * v_w
+                v_lat0 = d_lat0 + v_row * v_h
+                district['villages'].append({
+                    'name': f"第{v_idx + 1}里",
+                    'bounds': (v_lon0, v_lat0, v_lon0 + v_w, v_lat0 + v_h),
+                    # 村里的基礎特性，讓各年份資料有一致的趨勢
+                    'base_median': rng.uniform(400, 900),
+                    'growth': rng.uniform(-0.01, 0.05),
+                    'population': int(rng.lognormvariate(7.5, 0.8)) + 50,
+                })
+            county_entry['districts'].append(district)
+        layout.append(county_entry)
+    return layout
+
+
+def write_geojson(layout, output_dir, vertices_per_edge):
+    county_features = []
+    village_features = []
+    for county in layout:
+        county_features.append({
+            'type': 'Feature',
+            'properties': {'COUNTYNAME': county['name'], 'COUNTYCODE': county['code']},
+            'geometry': {'type': 'Polygon', 'coordinates': _rectangle(*county['bounds'], jitter_vertices=vertices_per_edge * 4)}
+        })
+        for d_idx, district in enumerate(county['districts']):
+            for v_idx, village in enumerate(district['villages']):
+                village_features.append({
+                    'type': 'Feature',
+                    'properties': {
+                        'COUNTYNAME': county['name'],
+                        'TOWNNAME': district['name'],
+                        'VILLNAME': village['name'],
+                        'VILLCODE': f"{county['code']}{d_idx + 1:03d}{v_idx + 1:03d}",
+                    },
+                    'geometry': {'type': 'Polygon', 'coordinates': _rectangle(*village['bounds'], jitter_vertices=vertices_per_edge)}
+                })
+
+    county_dir = output_dir / 'taiwan_country_border'
+    village_dir = output_dir / 'taiwan_village_border'
+    county_dir.mkdir(parents=True, exist_ok=True)
+    village_dir.mkdir(parents=True, exist_ok=True)
+    with open(county_dir / 'taiwan_country_border.geojson', 'w', encoding='utf-8') as f:
+        json.dump({'type': 'FeatureCollection', 'features': county_features}, f, ensure_ascii=False)
+    with open(village_dir / 'counties_villages_standardized.geojson', 'w', encoding='utf-8') as f:
+        json.dump({'type': 'FeatureCollection', 'features': village_features}, f, ensure_ascii=False)
+    return len(county_features), len(village_features)
+
+
+def write_salary(layout, output_dir, rng):
+    salary_dir = output_dir / 'salary-gh-pages' / 'data' / 'csv'
+    salary_dir.mkdir(parents=True, exist_ok=True)
+    header = ['縣市', '鄉鎮市區', '村里', '納稅單位', '綜合所得總額', '平均數', '中位數',
+              '第一分位數', '第三分位數', '標準差', '變異係數']
+    for y_idx, year in enumerate(SALARY_YEARS):
+        with open(salary_dir / f"{year}_standardized.csv", 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for county in layout:
+                for district in county['districts']:
+                    for village in district['villages']:
+                        median = village['base_median'] * (1 + village['growth']) ** y_idx * rng.uniform(0.97, 1.03)
+                        average = median * rng.uniform(1.15, 1.6)
+                        units = max(10, int(village['population'] * 0.45))
+                        writer.writerow([
+                            county['name'], district['name'], village['name'], units,
+                            round(average * units), round(average), round(median),
+                            round(median * 0.55), round(median * 1.6),
+                            round(average * 0.9, 2), round(rng.uniform(80, 300), 2)
+                        ])
+    return len(SALARY_YEARS)
+
+
+def write_insurance(output_dir):
+    """健保與勞保投保金額分級表不是 LFS 物件，直接複製專案中的檔案"""
+    data_dir = output_dir / 'salary-gh-pages' / 'data'
+    data_dir.mkdir(parents=True, exist_ok=True)
+    for name in ('nhi.json', 'bli.json'):
+        shutil.copyfile(PROJECT_DIR / 'salary-gh-pages' / 'data' / name, data_dir / name)
+    return 2
+
+
+def write_population(layout, output_dir, months, rng):
+    population_dir = output_dir / 'taiwan_population_data'
+    population_dir.mkdir(parents=True, exist_ok=True)
+    header = ['統計年月', '區域別代碼', '縣市', '鄉鎮市區', '村里', '戶數', '人口數', '男', '女']
+    # 由 107 年 1 月起每半年一檔（與正式資料命名相同）
+    periods = []
+    roc_year, month = 107, 1
+    while len(periods) < months:
+        periods.append((roc_year, month))
+        month += 6
+        if month > 12:
+            month -= 12
+            roc_year += 1
+    for p_idx, (roc_year, month) in enumerate(periods):
+        name = f"opendata{roc_year}{month:02d}M030_standardized.csv"
+        with open(population_dir / name, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for county in layout:
+                for d_idx, district in enumerate(county['districts']):
+                    for village in district['villages']:
+                        population = max(1, int(village['population'] * (1 + 0.004 * p_idx) * rng.uniform(0.99, 1.01)))
+                        households = max(1, int(population / rng.uniform(2.2, 3.1)))
+                        male = population // 2
+                        writer.writerow([
+                            f"{roc_year}{month:02d}", f"{county['code']}{d_idx + 1:03d}", county['name'],
+                            district['name'], village['name'], households, population, male, population - male
+                        ])
+    return len(periods)
+
+
+def write_clinics(layout, output_dir, clinic_count, rng):
+    clinic_dir = output_dir / 'taiwan_clinic_site'
+    clinic_dir.mkdir(parents=True, exist_ok=True)
+    villages = [
+        (county, district, village)
+        for county in layout
+        for district in county['districts']
+        for village in district['villages']
+    ]
+    # 以人口加權分配診所位置，使都市地區診所較密集
+    weights = [v[2]['population'] for v in villages]
+    header = ['機構代碼', '機構名稱', '縣市區名', '地址', '電話', '科別', '經度', '緯度']
+    with open(clinic_dir / 'TAIWAN CLINIC SITE_FINAL_20231231.csv', 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        picks = rng.choices(villages, weights=weights, k=clinic_count)
+        for idx, (county, district, village) in enumerate(picks):
+            lon0, lat0, lon1, lat1 = village['bounds']
+            specialties = rng.sample(RAW_SPECIALTIES, k=rng.choice([1, 1, 1, 2, 2, 3]))
+            writer.writerow([
+                f"{3500000000 + idx}", f"合成診所{idx + 1}",
+                f"{county['name']}{district['name']}",
+                f"{county['name']}{district['name']}{village['name']}中正路{rng.randint(1, 500)}號",
+                f"0{rng.randint(2, 9)}-{rng.randint(1000000, 9999999)}",
+                ','.join(specialties),
+                round(rng.uniform(lon0, lon1), 6), round(rng.uniform(lat0, lat1), 6)
+            ])
+    return clinic_count
+
+
+def generate(output_dir, scale=1.0, clinics=None, population_files=16, vertices_per_edge=6, seed=42):
+    """產生完整的合成資料目錄，回傳各資料集的數量摘要"""
+    rng = random.Random(seed)
+    output_dir = Path(output_dir)
+    layout = build_layout(scale, rng)
+    if clinics is None:
+        clinics = max(10, int(round(23000 * scale)))
+
+    counties, villages = write_geojson(layout, output_dir, vertices_per_edge)
+    salary_files = write_salary(layout, output_dir, rng)
+    insurance_files = write_insurance(output_dir)
+    population_files = write_population(layout, output_dir, population_files, rng)
+    clinic_rows = write_clinics(layout, output_dir, clinics, rng)
+    return {
+        'counties': counties,
+        'villages': villages,
+        'salary_files': salary_files,
+        'insurance_files': insurance_files,
+        'population_files': population_files,
+        'clinics': clinic_rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="產生與正式資料結構相同的合成台灣資料")
+    parser.add_argument('--output', required=True, help="輸出目錄（結構與專案根目錄相同）")
+    parser.add_argument('--scale', type=float, default=1.0, help="資料規模，1.0 約等於正式資料（約 7,800 個村里）")
+    parser.add_argument('--clinics', type=int, default=None, help="診所數量（預設依規模換算）")
+    parser.add_argument('--population-files', type=int, default=16, help="人口資料檔案數（每半年一檔）")
+    parser.add_argument('--vertices-per-edge', type=int, default=6, help="每條邊額外的頂點數")
+    parser.add_argument('--seed', type=int, default=42, help="亂數種子")
+    args = parser.parse_args()
+
+    summary = generate(
+        args.output, scale=args.scale, clinics=args.clinics,
+        population_files=args.population_files,
+        vertices_per_edge=args.vertices_per_edge, seed=args.seed
+    )
+    print(f"合成資料已寫入 {args.output}")
+    for name, count in summary.items():
+        print(f"  {name}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+離線建置靜態資料檔
+
+輸入資料固定時，縣市 GeoJSON、各縣市鄉鎮市區、村里與六角形網格（等級、範圍、顏色）、診所、科別清單、
+村里薪資與人口序列、統計摘要、雙變數色彩矩陣等回應都是確定的。此腳本直接使用後端的處理程式
+產生這些回應，寫成 JSON 檔（附預先壓縮的 .gz，安裝 brotli 套件時另有 .br）與 manifest.json，
+前端（frontend/script.js）可直接從靜態主機讀取，只有真正動態的查詢才需要 FastAPI 服務。
+
+使用方式：
+    python build_static.py --output frontend/data
+    DATA_BASE_DIR=/tmp/synthetic python build_static.py --output /tmp/static
+"""
+
+import argparse
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(PROJECT_DIR))
+
+# 靜態資料格式版本（前端讀取 manifest 時檢查）
+STATIC_FORMAT_VERSION = 2
+# 前端權重滑桿以 1% 為單位，每個薪資權重各產生一份色彩矩陣
+WEIGHT_STEPS = range(0, 101)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class StaticWriter:
+    """寫入 JSON 檔與預先壓縮的版本，並記錄到 manifest"""
+
+    def __init__(self, output_dir, compress=True):
+        self.output_dir = output_dir
+        self.compress = compress
+        self.files = {}
+
+    def write(self, relative_path, body):
+        file_path = self.output_dir / relative_path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(body)
+        entry = {'bytes': len(body), 'sha256': hashlib.sha256(body).hexdigest()[:16]}
+        if self.compress:
+            # mtime=0 使相同內容產生相同的壓縮檔，方便部署時比對差異
+            gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+            file_path.with_name(file_path.name + '.gz').write_bytes(gzip_body)
+            entry['gzip_bytes'] = len(gzip_body)
+            if brotli is not None:
+                brotli_body = brotli.compress(body, quality=11)
+                file_path.with_name(file_path.name + '.br').write_bytes(brotli_body)
+                entry['br_bytes'] = len(brotli_body)
+        self.files[relative_path] = entry
+
+
+def render(main, builder, *args):
+    """以後端相同的方式序列化回應"""
+    return main.JSONResponse(builder(*args)).body
+
+
+def render_village_series(main, snapshot, builder, villages):
+    """
+    建立單一縣市所有村里的序列資料：{"鄉鎮市區/村里": 回應}
+
+    找不到資料的村里（後端回應 404）不列入，前端會改向 API 查詢
+    """
+    series = {}
+    for _, row in villages.iterrows():
+        district_name, village_name = str(row['TOWNNAME']), str(row['VILLNAME'])
+        try:
+            series[f"{district_name}/{village_name}"] = builder(snapshot, village_name, str(row['COUNTYNAME']), district_name)
+        except main.HTTPException as e:
+            if e.status_code != 404:
+                raise
+    return series
+
+
+def build(main, output_dir, compress):
+    snapshot = main.data_snapshot
+    writer = StaticWriter(output_dir, compress)
+    village_data = snapshot.village_data
+    counties = sorted(str(name) for name in village_data['COUNTYNAME'].unique())
+
+    writer.write('counties.json', render(main, main.build_counties_response, snapshot))
+    writer.write('clinic_specialties.json', render(main, main.build_clinic_specialties_response, snapshot))
+    writer.write('summary.json', render(main, main.build_summary_response, snapshot))
+
+    for income_step in WEIGHT_STEPS:
+        income_weight = income_step / 100
+        density_weight = (100 - income_step) / 100
+        color_matrix = [
+            [main.get_bivariate_color(income_level, density_level, income_weight, density_weight) for density_level in range(9)]
+            for income_level in range(9)
+        ]
+        writer.write(f'bivariate_colors/{income_step}.json', main.JSONResponse({
+            "color_matrix": color_matrix,
+            "income_weight": income_weight,
+            "density_weight": density_weight,
+            "dimensions": {"income_levels": 9, "density_levels": 9}
+        }).body)
+
+    for index, county_name in enumerate(counties, 1):
+        started = time.perf_counter()
+        villages = village_data[village_data['COUNTYNAME'] == county_name]
+        writer.write(f'villages/{county_name}.json', render(main, main.build_villages_response, snapshot, county_name))
+        writer.write(f'districts/{county_name}.json', render(main, main.build_districts_response, snapshot, county_name))
+        writer.write(f'hexgrid/{county_name}.json', render(main, main.build_hexgrid_response, snapshot, main.HEX_DEFAULT_CELL_KM, county_name))
+        writer.write(f'summary/{county_name}.json', render(main, main.build_summary_response, snapshot, county_name))
+        # 診所不去重：前端依科別篩選後再去重，與 /api/clinics 的結果相同
+        writer.write(f'clinics/{county_name}.json', render(main, main.build_clinics_response, snapshot, county_name, None, False))
+        writer.write(f'village_salary/{county_name}.json', main.JSONResponse(
+            render_village_series(main, snapshot, main.build_village_salary_response, villages)).body)
+        writer.write(f'village_population/{county_name}.json', main.JSONResponse(
+            render_village_series(main, snapshot, main.build_village_population_response, villages)).body)
+        print(f"[{index}/{len(counties)}] {county_name}: {len(villages)} 個村里（{time.perf_counter() - started:.1f}s）")
+
+    manifest = {
+        'format_version': STATIC_FORMAT_VERSION,
+        'generated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'input_signature': main.compute_input_signature(),
+        'dataset_signatures': snapshot.signatures,
+        'default_weights': {'income': 0.5, 'density': 0.5},
+        'hex_cell_km': main.HEX_DEFAULT_CELL_KM,
+        'weight_steps': [WEIGHT_STEPS.start, WEIGHT_STEPS.stop - 1],
+        'counties': counties,
+        'encodings': ['gzip'] + (['br'] if brotli is not None else []) if compress else [],
+        'files': writer.files,
+    }
+    writer.write('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="離線建置前端使用的靜態資料檔")
+    parser.add_argument('--output', default=str(PROJECT_DIR / 'frontend' / 'data'), help="輸出目錄（會先清空）")
+    parser.add_argument('--no-compress', action='store_true', help="不產生預先壓縮的 .gz / .br 檔")
+    parser.add_argument('--verbose', action='store_true', help="顯示後端的載入訊息")
+    args = parser.parse_args()
+
+    output_dir = Path(args.output)
+    started = time.perf_counter()
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        import backend.main as backend_main
+        backend_main.load_and_process_data()
+    print(f"資料載入完成（{time.perf_counter() - started:.1f}s）")
+
+    # 先寫入暫存目錄再替換，建置失敗時不影響既有的輸出
+    build_dir = output_dir.with_name(output_dir.name + '.building')
+    shutil.rmtree(build_dir, ignore_errors=True)
+    build_dir.mkdir(parents=True)
+    manifest = build(backend_main, build_dir, not args.no_compress)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    build_dir.rename(output_dir)
+
+    total_bytes = sum(entry['bytes'] for entry in manifest['files'].values())
+    gzip_bytes = sum(entry.get('gzip_bytes', 0) for entry in manifest['files'].values())
+    print(f"已產生 {len(manifest['files'])} 個檔案，共 {total_bytes / 1024 / 1024:.1f} MB"
+          + (f"（gzip 後 {gzip_bytes / 1024 / 1024:.1f} MB）" if gzip_bytes else "")
+          + f"，耗時 {time.perf_counter() - started:.1f}s：{output_dir}")
+
+
+if __name__ == "__main__":
+    main()
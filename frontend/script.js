@@ -26,6 +26,105 @@ const API_BASE_URL = window.location.hostname === 'localhost' || window.location
     ? 'http://localhost:8000'
     : 'https://taiwan-clinic-site-625286433349.asia-east1.run.app'; // Google Cloud Run 後端URL
 
+// 靜態資料（build_static.py 產生，與前端一起部署）的位置；沒有靜態資料或讀取失敗時改向 API 查詢
+const STATIC_DATA_URL = 'data';
+const STATIC_FORMAT_VERSION = 2;
+let staticManifest = null; // 靜態資料清單，null 表示只使用 API
+const staticDataCache = new Map(); // 檔案路徑 -> Promise（同一檔案只下載一次）
+
+async function loadStaticManifest() {
+    try {
+        const response = await fetch(`${STATIC_DATA_URL}/manifest.json`, { cache: 'no-cache' });
+        if (!response.ok) {
+            console.log('沒有靜態資料，使用 API');
+            return;
+        }
+        const manifest = await response.json();
+        if (manifest.format_version !== STATIC_FORMAT_VERSION) {
+            console.warn('靜態資料格式版本不符，使用 API:', manifest.format_version);
+            return;
+        }
+        staticManifest = manifest;
+        console.log(`使用靜態資料（產生於 ${manifest.generated_at}，共 ${Object.keys(manifest.files).length} 個檔案）`);
+    } catch (error) {
+        console.log('無法讀取靜態資料，使用 API:', error.message);
+    }
+}
+
+const staticManifestReady = loadStaticManifest();
+
+// 讀取靜態資料檔，檔案不存在或讀取失敗時返回 null
+async function fetchStaticJson(path) {
+    await staticManifestReady;
+    if (!staticManifest || !staticManifest.files[path]) {
+        return null;
+    }
+    
+    if (!staticDataCache.has(path)) {
+        // 以內容雜湊作為版本參數，靜態主機可長期快取
+        const url = `${STATIC_DATA_URL}/${path.split('/').map(encodeURIComponent).join('/')}?v=${staticManifest.files[path].sha256}`;
+        staticDataCache.set(path, fetch(url)
+            .then(response => response.ok ? response.json() : null)
+            .catch(() => null));
+    }
+    
+    const data = await staticDataCache.get(path);
+    if (data === null) {
+        staticDataCache.delete(path);
+    }
+    return data;
+}
+
+// 向後端 API 查詢 JSON
+async function fetchApiJson(path) {
+    const response = await fetch(`${API_BASE_URL}${path}`);
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    return response.json();
+}
+
+// 目前薪資權重對應的靜態色彩矩陣檔名（權重以 1% 為單位）
+function bivariateColorsPath() {
+    return `bivariate_colors/${Math.round(currentWeights.income * 100)}.json`;
+}
+
+// 載入村里資料：優先使用靜態檔，並依目前權重以色彩矩陣重新計算雙變數顏色
+async function fetchVillageData(countyName) {
+    const [villageData, colorData] = await Promise.all([
+        fetchStaticJson(`villages/${countyName}.json`),
+        fetchStaticJson(bivariateColorsPath())
+    ]);
+    
+    if (villageData && colorData) {
+        villageData.features.forEach(feature => {
+            const properties = feature.properties;
+            properties.bivariate_color = colorData.color_matrix[properties.income_level][properties.density_level];
+        });
+        return villageData;
+    }
+    
+    return fetchApiJson(`/api/villages/${encodeURIComponent(countyName)}?income_weight=${currentWeights.income}&density_weight=${currentWeights.density}`);
+}
+
+// 載入單一村里的序列資料（薪資或人口）：靜態檔以縣市為單位，找不到該村里時改向 API 查詢
+async function fetchVillageSeries(kind, villageName, countyName, districtName) {
+    const countySeries = await fetchStaticJson(`${kind}/${countyName}.json`);
+    if (countySeries && countySeries[`${districtName}/${villageName}`]) {
+        return countySeries[`${districtName}/${villageName}`];
+    }
+    
+    const url = `${API_BASE_URL}/api/${kind}/${encodeURIComponent(villageName)}?county_name=${encodeURIComponent(countyName)}&district_name=${encodeURIComponent(districtName)}`;
+    console.log(`${kind} API URL:`, url);
+    const response = await fetch(url);
+    if (!response.ok) {
+        const errorText = await response.text();
+        console.error(`${kind} API 錯誤回應:`, errorText);
+        throw new Error(`${kind === 'village_salary' ? '薪資' : '人口'}資料載入失敗! status: ${response.status}, message: ${errorText}`);
+    }
+    return response.json();
+}
+
 // 工具函數：將hex顏色轉換為rgba格式
 function hexToRgba(hex, alpha) {
     // 移除 # 符號
@@ -100,12 +199,7 @@ async function loadCountyData() {
         showLoading();
         console.log('開始載入縣市資料...');
         
-        const response = await fetch(`${API_BASE_URL}/api/counties`);
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        
-        const countyData = await response.json();
+        const countyData = await fetchStaticJson('counties.json') || await fetchApiJson('/api/counties');
         console.log('縣市資料載入成功，縣市數量:', countyData.features.length);
         
         // 創建縣市圖層
@@ -209,12 +303,7 @@ async function handleCountyClick(countyName) {
         resetClinicSelections();
         
         // 載入該縣市的村里資料（包含權重參數）
-        const response = await fetch(`${API_BASE_URL}/api/villages/${encodeURIComponent(countyName)}?income_weight=${currentWeights.income}&density_weight=${currentWeights.density}`);
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        
-        const villageData = await response.json();
+        const villageData = await fetchVillageData(countyName);
         console.log('村里資料載入成功，村里數量:', villageData.features.length);
         
         // 儲存當前村里資料
@@ -396,36 +485,12 @@ async function handleVillageClick(villageName, countyName, districtName) {
     try {
         showLoading();
         
-        // 並行載入薪資和人口資料
-        const salaryUrl = `${API_BASE_URL}/api/village_salary/${encodeURIComponent(villageName)}?county_name=${encodeURIComponent(countyName)}&district_name=${encodeURIComponent(districtName)}`;
-        const populationUrl = `${API_BASE_URL}/api/village_population/${encodeURIComponent(villageName)}?county_name=${encodeURIComponent(countyName)}&district_name=${encodeURIComponent(districtName)}`;
-        
-        console.log('薪資 API URL:', salaryUrl);
-        console.log('人口 API URL:', populationUrl);
-        
+        // 並行載入薪資和人口資料（優先使用靜態檔）
         console.log('正在並行載入薪資和人口資料...');
-        const [salaryResponse, populationResponse] = await Promise.all([
-            fetch(salaryUrl),
-            fetch(populationUrl)
+        const [salaryData, populationData] = await Promise.all([
+            fetchVillageSeries('village_salary', villageName, countyName, districtName),
+            fetchVillageSeries('village_population', villageName, countyName, districtName)
         ]);
-        
-        console.log('薪資API 回應狀態:', salaryResponse.status, salaryResponse.statusText);
-        console.log('人口API 回應狀態:', populationResponse.status, populationResponse.statusText);
-        
-        if (!salaryResponse.ok) {
-            const errorText = await salaryResponse.text();
-            console.error('薪資API 錯誤回應:', errorText);
-            throw new Error(`薪資資料載入失敗! status: ${salaryResponse.status}, message: ${errorText}`);
-        }
-        
-        if (!populationResponse.ok) {
-            const errorText = await populationResponse.text();
-            console.error('人口API 錯誤回應:', errorText);
-            throw new Error(`人口資料載入失敗! status: ${populationResponse.status}, message: ${errorText}`);
-        }
-        
-        const salaryData = await salaryResponse.json();
-        const populationData = await populationResponse.json();
         console.log('薪資資料載入成功:', salaryData);
         console.log('人口資料載入成功:', populationData);
         
@@ -1038,12 +1103,8 @@ async function updateBivariateLegend() {
     
     try {
         // 獲取雙變數色彩矩陣
-        const response = await fetch(`${API_BASE_URL}/api/bivariate_colors?income_weight=${currentWeights.income}&density_weight=${currentWeights.density}`);
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        
-        const colorData = await response.json();
+        const colorData = await fetchStaticJson(bivariateColorsPath())
+            || await fetchApiJson(`/api/bivariate_colors?income_weight=${currentWeights.income}&density_weight=${currentWeights.density}`);
         
         // 顯示雙變數圖例
         const bivariateLegend = document.getElementById('bivariate-legend');
@@ -1077,12 +1138,7 @@ async function reloadVillageColors() {
         showLoading();
         
         // 重新載入資料
-        const response = await fetch(`${API_BASE_URL}/api/villages/${encodeURIComponent(currentCounty)}?income_weight=${currentWeights.income}&density_weight=${currentWeights.density}`);
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        
-        const villageData = await response.json();
+        const villageData = await fetchVillageData(currentCounty);
         currentVillageData = villageData;
         
         // 更新現有圖層的顏色
@@ -1190,9 +1246,10 @@ function setupSliderEvents() {
 document.addEventListener('DOMContentLoaded', async function() {
     console.log('頁面載入完成，開始初始化...');
     
-    // 檢查 API 連線
+    // 檢查 API 連線（有靜態資料時地圖不需要後端也能顯示）
+    await staticManifestReady;
     const isAPIHealthy = await checkAPIHealth();
-    if (!isAPIHealthy) {
+    if (!isAPIHealthy && !staticManifest) {
         alert('無法連接到後端 API，請確保後端服務正在運行。');
         return;
     }
@@ -1210,12 +1267,7 @@ document.addEventListener('DOMContentLoaded', async function() {
 async function loadClinicSpecialties() {
     try {
         console.log('載入診所科別資料...');
-        const response = await fetch(`${API_BASE_URL}/api/clinic_specialties`);
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        
-        const data = await response.json();
+        const data = await fetchStaticJson('clinic_specialties.json') || await fetchApiJson('/api/clinic_specialties');
         clinicSpecialties = data.specialties;
         console.log('診所科別載入成功:', clinicSpecialties);
         
@@ -1292,14 +1344,29 @@ async function updateClinicMarkers() {
     try {
         showLoading();
         
-        const specialtiesParam = Array.from(selectedSpecialties).join(',');
-        const response = await fetch(`${API_BASE_URL}/api/clinics/${encodeURIComponent(currentCounty)}?specialties=${encodeURIComponent(specialtiesParam)}`);
-        
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+        // 靜態檔包含該縣市所有診所（未去重），在前端依科別篩選後再依機構名稱和地址去重，與 API 的順序相同
+        let clinicData;
+        const countyClinics = await fetchStaticJson(`clinics/${currentCounty}.json`);
+        if (countyClinics) {
+            const seenClinics = new Set();
+            clinicData = {
+                ...countyClinics,
+                features: countyClinics.features.filter(clinic => {
+                    if (!clinic.properties.specialties.some(specialty => selectedSpecialties.has(specialty))) {
+                        return false;
+                    }
+                    const clinicKey = JSON.stringify([clinic.properties.name, clinic.properties.address]);
+                    if (seenClinics.has(clinicKey)) {
+                        return false;
+                    }
+                    seenClinics.add(clinicKey);
+                    return true;
+                })
+            };
+        } else {
+            const specialtiesParam = Array.from(selectedSpecialties).join(',');
+            clinicData = await fetchApiJson(`/api/clinics/${encodeURIComponent(currentCounty)}?specialties=${encodeURIComponent(specialtiesParam)}`);
         }
-        
-        const clinicData = await response.json();
         console.log(`載入 ${currentCounty} 的診所地標:`, clinicData.features.length, '個');
         
         // 先清除現有的診所標記
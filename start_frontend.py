@@ -5,15 +5,160 @@
 
 import sys
 import os
+import re
+import gzip
+import hashlib
+import argparse
 import subprocess
 import webbrowser
 import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 import threading
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 需要壓縮的文字類型與最小大小；更小的檔案壓縮後的節省抵不過標頭開銷
+COMPRESSIBLE_SUFFIXES = {'.html', '.js', '.css', '.json', '.svg', '.txt', '.map', '.geojson'}
+COMPRESS_MIN_BYTES = 1024
+# 記憶體中的檔案與壓縮版本快取上限（位元組），超過時移除最久未使用的檔案
+ASSET_CACHE_MAX_BYTES = int(float(os.getenv('FRONTEND_CACHE_MB', '64')) * 1024 * 1024)
+# 檔名含內容雜湊（例如 script.3f2a9c1d.js）或帶 ?v= 版本參數的請求內容不會改變，可長期快取
+HASHED_NAME = re.compile(r'\.[0-9a-f]{8,}\.[^./]+$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+# 啟動時預先壓縮的前端主要檔案
+PRELOAD_ASSETS = ('index.html', 'script.js', 'styles.css')
+
+class Asset:
+    """
+    一個靜態檔案的內容與各編碼版本（identity / gzip / br）
+    
+    有 build_static.py 產生的 .gz / .br 檔且不比原檔舊時直接使用，否則在第一次讀取時壓縮一次；
+    每個編碼版本有各自的 ETag（同一 URL 的不同表示法不可共用 ETag）
+    """
+    
+    def __init__(self, path, stat):
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        self.mtime = int(stat.st_mtime)
+        body = Path(path).read_bytes()
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {'identity': body}
+        self.etags = {'identity': f'"{digest}"'}
+        if Path(path).suffix.lower() in COMPRESSIBLE_SUFFIXES and len(body) >= COMPRESS_MIN_BYTES:
+            for encoding, suffix, compress in (('br', '.br', brotli and (lambda data: brotli.compress(data, quality=11))),
+                                               ('gzip', '.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))):
+                sidecar = Path(path + suffix)
+                if sidecar.exists() and sidecar.stat().st_mtime_ns >= stat.st_mtime_ns:
+                    self.variants[encoding] = sidecar.read_bytes()
+                elif compress:
+                    self.variants[encoding] = compress(body)
+                else:
+                    continue
+                self.etags[encoding] = f'"{digest}-{encoding}"'
+    
+    @property
+    def nbytes(self):
+        return sum(len(body) for body in self.variants.values())
+
+class AssetCache:
+    """依檔案路徑快取 Asset（多執行緒共用），檔案的修改時間或大小改變時重新讀取"""
+    
+    def __init__(self, max_bytes=ASSET_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+    
+    def get(self, path):
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            asset = self.entries.get(path)
+            if asset is not None and asset.signature == signature:
+                self.entries.move_to_end(path)
+                return asset
+        # 在鎖外讀取與壓縮，避免大型檔案阻塞其他請求
+        asset = Asset(path, stat)
+        with self.lock:
+            previous = self.entries.pop(path, None)
+            if previous is not None:
+                self.total_bytes -= previous.nbytes
+            if asset.nbytes <= self.max_bytes:
+                self.entries[path] = asset
+                self.total_bytes += asset.nbytes
+                while self.total_bytes > self.max_bytes:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.total_bytes -= evicted.nbytes
+        return asset
+
+asset_cache = AssetCache()
+
+def _accepted_encodings(header):
+    """解析 Accept-Encoding，返回可接受的編碼集合（q=0 表示拒絕）"""
+    accepted = set()
+    for part in (header or '').split(','):
+        token, _, params = part.partition(';')
+        token = token.strip().lower()
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if token and quality > 0:
+            accepted.add(token)
+    if '*' in accepted:
+        accepted.update({'br', 'gzip'})
+    return accepted
+
+def _parse_range(header, size):
+    """
+    解析單一位元組範圍（bytes=start-end、bytes=start-、bytes=-suffix）
+    
+    Returns:
+        (start, end)（含 end）；不支援的格式或多重範圍返回 None（回應完整內容），無法滿足時返回 'unsatisfiable'
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if first == '':
+            length = int(last)
+            if length <= 0:
+                return 'unsatisfiable'
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return 'unsatisfiable'
+    return start, min(end, size - 1)
+
 class CORSRequestHandler(SimpleHTTPRequestHandler):
-    """支援 CORS 的 HTTP 請求處理器"""
+    """
+    支援 CORS 的 HTTP 請求處理器
+    
+    - HTTP/1.1 持續連線，搭配 ThreadingHTTPServer 每個連線一個執行緒，慢速的用戶端不會阻塞其他人
+    - 依 Accept-Encoding 回應預先壓縮的 br / gzip 版本（Vary: Accept-Encoding）
+    - ETag / If-None-Match 與 Last-Modified / If-Modified-Since 條件請求回應 304
+    - 單一 Range 請求回應 206（以未壓縮內容計算範圍）
+    - 檔名含內容雜湊或帶 ?v= 版本參數時長期快取，其餘每次以 ETag 重新驗證
+    - 每個請求記錄狀態、大小、編碼與處理時間
+    """
+    
+    protocol_version = 'HTTP/1.1'
+    timeout = 30  # 閒置的持續連線在 30 秒後關閉，釋放執行緒
     
     def end_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -23,10 +168,124 @@ class CORSRequestHandler(SimpleHTTPRequestHandler):
     
     def do_OPTIONS(self):
         self.send_response(200)
+        self.send_header('Content-Length', '0')
         self.end_headers()
+    
+    def handle_one_request(self):
+        self.started = time.perf_counter()
+        self.response_status = None
+        self.body_bytes = 0
+        self.content_encoding = 'identity'
+        super().handle_one_request()
+        if self.response_status is not None:
+            elapsed = (time.perf_counter() - self.started) * 1000
+            sys.stderr.write(f"{self.address_string()} {self.command} {self.path} {self.response_status} "
+                             f"{self.body_bytes}B {self.content_encoding} {elapsed:.1f}ms\n")
+    
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+    
+    def log_request(self, code='-', size='-'):
+        pass  # 由 handle_one_request 在回應完成後記錄（含處理時間）
+    
+    def do_GET(self):
+        self._serve(include_body=True)
+    
+    def do_HEAD(self):
+        self._serve(include_body=False)
+    
+    def _serve(self, include_body):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            if not self.path.split('?', 1)[0].endswith('/'):
+                # 目錄需以 / 結尾（SimpleHTTPRequestHandler 會回應重新導向）
+                return super().do_GET() if include_body else super().do_HEAD()
+            path = os.path.join(path, 'index.html')
+        if not os.path.isfile(path):
+            self.send_error(404, "File not found")
+            return
+        asset = asset_cache.get(path)
+        
+        # 有 Range 時以未壓縮內容計算範圍；否則選擇用戶端接受的最小編碼版本
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if range_header and if_range and if_range.strip() not in (asset.etags['identity'], asset.last_modified):
+            range_header = None
+        encoding = 'identity'
+        if not range_header:
+            accepted = _accepted_encodings(self.headers.get('Accept-Encoding'))
+            encoding = next((name for name in ('br', 'gzip') if name in accepted and name in asset.variants), 'identity')
+        body = asset.variants[encoding]
+        etag = asset.etags[encoding]
+        
+        if self._not_modified(asset, etag):
+            self.send_response(304)
+            self._send_cache_headers(asset, etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        
+        status = 200
+        if range_header:
+            byte_range = _parse_range(range_header, len(body))
+            if byte_range == 'unsatisfiable':
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(body)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if byte_range is not None:
+                start, end = byte_range
+                status = 206
+                body_range = f'bytes {start}-{end}/{len(body)}'
+                body = body[start:end + 1]
+        
+        self.send_response(status)
+        content_type = self.guess_type(path)
+        if content_type.startswith('text/') or content_type in ('application/json', 'application/javascript'):
+            content_type += '; charset=utf-8'
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', body_range)
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        self._send_cache_headers(asset, etag)
+        self.send_header('Server-Timing', f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        self.end_headers()
+        self.content_encoding = encoding
+        if include_body:
+            self.wfile.write(body)
+            self.body_bytes = len(body)
+    
+    def _not_modified(self, asset, etag):
+        """If-None-Match 優先於 If-Modified-Since（RFC 9110）"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            candidates = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+            return '*' in candidates or etag in candidates
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                return asset.mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+    
+    def _send_cache_headers(self, asset, etag):
+        name = self.path.split('?', 1)[0]
+        query = self.path.split('?', 1)[1] if '?' in self.path else ''
+        versioned = HASHED_NAME.search(name) or any(part.startswith('v=') for part in query.split('&'))
+        self.send_header('Cache-Control', IMMUTABLE_CACHE_CONTROL if versioned else REVALIDATE_CACHE_CONTROL)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', asset.last_modified)
+        if len(asset.variants) > 1:
+            self.send_header('Vary', 'Accept-Encoding')
 
-def start_frontend_server():
-    """啟動前端 HTTP 伺服器"""
+def start_frontend_server(host='127.0.0.1', port=8080, open_browser_on_start=True):
+    """啟動前端 HTTP 伺服器（多執行緒）"""
     frontend_dir = Path("frontend")
     if not frontend_dir.exists():
         print("錯誤: 找不到 frontend 目錄")
@@ -45,13 +304,21 @@ def start_frontend_server():
     os.chdir(frontend_dir)
     print(f"切換後工作目錄: {os.getcwd()}")
     
+    # 預先讀取並壓縮主要檔案，第一個請求不需等待壓縮
+    for name in PRELOAD_ASSETS:
+        if Path(name).exists():
+            asset = asset_cache.get(os.path.abspath(name))
+            print(f"  {name}: " + ", ".join(f"{encoding} {len(body)} bytes" for encoding, body in asset.variants.items()))
+    if brotli is None:
+        print("未安裝 brotli 套件，只提供 gzip 壓縮版本（pip install brotli）")
+    
     # 設定伺服器
-    port = 8080
-    server_address = ('127.0.0.1', port)  # 明確指定IP
+    server_address = (host, port)
     
     try:
-        httpd = HTTPServer(server_address, CORSRequestHandler)
-        print(f"前端服務已啟動: http://127.0.0.1:{port}")
+        httpd = ThreadingHTTPServer(server_address, CORSRequestHandler)
+        httpd.daemon_threads = True
+        print(f"前端服務已啟動: http://{host}:{port}")
         print("按 Ctrl+C 停止服務")
         print("-" * 50)
         
@@ -61,7 +328,7 @@ def start_frontend_server():
             
             # 添加時間戳參數來避免快取
             timestamp = int(time.time())
-            url_with_timestamp = f'http://127.0.0.1:{port}?t={timestamp}'
+            url_with_timestamp = f'http://{host}:{port}?t={timestamp}'
             
             # 嘗試使用 Microsoft Edge 無痕模式開啟
             edge_paths = [
@@ -98,7 +365,8 @@ def start_frontend_server():
                 print(f"已在預設瀏覽器開啟: {url_with_timestamp}")
                 print("建議手動清除瀏覽器快取或使用無痕模式")
         
-        threading.Thread(target=open_browser, daemon=True).start()
+        if open_browser_on_start:
+            threading.Thread(target=open_browser, daemon=True).start()
         
         # 啟動伺服器
         httpd.serve_forever()
@@ -126,8 +394,14 @@ def main():
     print("注意: 請確保後端服務已在 http://localhost:8000 運行")
     print("-" * 50)
     
+    parser = argparse.ArgumentParser(description="台灣地圖應用程式前端伺服器")
+    parser.add_argument('--host', default='127.0.0.1', help="監聽位址（供區域網路使用時設為 0.0.0.0）")
+    parser.add_argument('--port', type=int, default=8080, help="監聽連接埠")
+    parser.add_argument('--no-browser', action='store_true', help="啟動後不開啟瀏覽器")
+    args = parser.parse_args()
+    
     # 啟動前端服務
-    start_frontend_server()
+    start_frontend_server(args.host, args.port, not args.no_browser)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
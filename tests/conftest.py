@@ -0,0 +1,60 @@
+"""
+測試共用的 fixture
+
+以 benchmarks/synthetic_data.py 產生小規模的合成資料，設定 DATA_BASE_DIR 後才匯入後端，
+整個測試階段只載入一次資料
+"""
+
+import contextlib
+import io
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+# 與 benchmarks/run_benchmarks.py 相同，直接匯入 synthetic_data（benchmarks 不是套件，可能與已安裝的同名套件衝突）
+sys.path.insert(0, str(PROJECT_DIR / 'benchmarks'))
+
+
+@pytest.fixture(scope='session')
+def data_dir(tmp_path_factory):
+    import synthetic_data
+    output_dir = tmp_path_factory.mktemp('synthetic')
+    synthetic_data.generate(output_dir, scale=0.1, population_files=4, seed=7)
+    return output_dir
+
+
+@pytest.fixture(scope='session')
+def client(data_dir):
+    """已載入合成資料的測試用戶端（啟動事件會載入資料）"""
+    os.environ['DATA_BASE_DIR'] = str(data_dir)
+    os.environ.setdefault('WARMUP', '0')
+    from fastapi.testclient import TestClient
+    with contextlib.redirect_stdout(io.StringIO()):
+        import backend.main as backend_main
+        test_client = TestClient(backend_main.app)
+        test_client.__enter__()
+    yield test_client
+    test_client.__exit__(None, None, None)
+
+
+@pytest.fixture(scope='session')
+def main(client):
+    """後端模組（資料已載入）"""
+    import backend.main as backend_main
+    return backend_main
+
+
+@pytest.fixture
+def snapshot(main):
+    return main.current_snapshot()
+
+
+@pytest.fixture
+def admin_token(main, monkeypatch):
+    """啟用管理端點，返回測試用的權杖"""
+    monkeypatch.setattr(main, 'ADMIN_TOKEN', 'test-token')
+    return 'test-token'
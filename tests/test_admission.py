@@ -0,0 +1,164 @@
+"""准入控制與快取預熱的名額"""
+
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def controller(main):
+    return main.AdmissionController(total_limit=2, route_limit=1, queue_max=4, max_wait=1.0)
+
+
+def test_try_acquire_respects_limits(controller):
+    cost = controller.try_acquire('villages', ('villages', '臺北市'))
+    assert cost is not None
+    # 同一路由已達上限
+    assert controller.try_acquire('villages', ('villages', '新北市')) is None
+    other = controller.try_acquire('clinics', ('clinics', '臺北市'))
+    assert other is not None
+    # 全域名額已滿
+    assert controller.try_acquire('districts', ('districts', '臺北市')) is None
+    controller.release('villages', cost)
+    controller.release('clinics', other)
+    assert controller.running_total == 0
+    # 預熱不計入路由的准入統計
+    assert controller.stats == {}
+
+
+def test_try_acquire_yields_to_queued_requests(controller):
+    async def scenario():
+        first = await controller.acquire('villages', ('villages', '臺北市'))
+        queued = asyncio.ensure_future(controller.acquire('villages', ('villages', '新北市')))
+        await asyncio.sleep(0)
+        # 仍有空出的全域名額，但佇列中有即時請求時預熱不插隊
+        assert controller.waiters
+        assert controller.try_acquire('districts', ('districts', '臺北市')) is None
+        controller.release('villages', first)
+        controller.release('villages', await queued)
+    asyncio.run(scenario())
+
+
+def test_cheaper_requests_are_dispatched_first(main):
+    controller = main.AdmissionController(total_limit=1, route_limit=1, queue_max=4, max_wait=5.0)
+    controller.costs.update({('villages', '大'): 0.5, ('villages', '小'): 0.01})
+    
+    async def scenario():
+        running = await controller.acquire('villages', ('villages', '中'))
+        order = []
+        
+        async def request(county_name):
+            cost = await controller.acquire('villages', ('villages', county_name))
+            order.append(county_name)
+            controller.release('villages', cost)
+        tasks = [asyncio.ensure_future(request(county_name)) for county_name in ('大', '小')]
+        await asyncio.sleep(0)
+        assert len(controller.waiters) == 2
+        controller.release('villages', running)
+        await asyncio.gather(*tasks)
+        return order
+    assert asyncio.run(scenario()) == ['小', '大']
+
+
+def test_full_queue_is_rejected_with_retry_after(main):
+    controller = main.AdmissionController(total_limit=1, route_limit=1, queue_max=1, max_wait=5.0)
+    controller.costs[('villages',)] = 0.01
+    
+    async def scenario():
+        running = await controller.acquire('villages', ('villages', '甲'))
+        queued = asyncio.ensure_future(controller.acquire('villages', ('villages', '乙')))
+        await asyncio.sleep(0)
+        with pytest.raises(main.HTTPException) as rejected:
+            await controller.acquire('villages', ('villages', '丙'))
+        controller.release('villages', running)
+        controller.release('villages', await queued)
+        return rejected.value
+    error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert int(error.headers['Retry-After']) >= 1
+    assert controller.stats['villages'] == {'admitted': 2, 'queued': 1, 'rejected': 1, 'timed_out': 0}
+    assert controller.running_total == 0 and not controller.waiters
+
+
+def test_long_estimated_wait_is_rejected_immediately(main):
+    controller = main.AdmissionController(total_limit=1, route_limit=1, queue_max=10, max_wait=1.0)
+    controller.costs[('export',)] = 3.0
+    
+    async def scenario():
+        running = await controller.acquire('export', ('export', None))
+        started = asyncio.get_running_loop().time()
+        with pytest.raises(main.HTTPException) as rejected:
+            await controller.acquire('export', ('export', None))
+        elapsed = asyncio.get_running_loop().time() - started
+        controller.release('export', running)
+        return rejected.value, elapsed
+    error, elapsed = asyncio.run(scenario())
+    assert error.status_code == 503 and int(error.headers['Retry-After']) == 3
+    assert elapsed < 0.5
+    assert controller.stats['export']['rejected'] == 1
+
+
+def test_queued_request_times_out(main):
+    controller = main.AdmissionController(total_limit=1, route_limit=1, queue_max=10, max_wait=0.1)
+    controller.costs[('villages',)] = 0.01
+    
+    async def scenario():
+        running = await controller.acquire('villages', ('villages', '甲'))
+        with pytest.raises(main.HTTPException) as rejected:
+            await controller.acquire('villages', ('villages', '乙'))
+        assert not controller.waiters
+        controller.release('villages', running)
+        return rejected.value
+    assert asyncio.run(scenario()).status_code == 503
+    assert controller.stats['villages']['timed_out'] == 1
+    assert controller.running_total == 0
+
+
+def test_cancelled_waiter_leaves_queue(main):
+    controller = main.AdmissionController(total_limit=1, route_limit=1, queue_max=10, max_wait=5.0)
+    controller.costs[('villages',)] = 0.01
+    
+    async def scenario():
+        running = await controller.acquire('villages', ('villages', '甲'))
+        queued = asyncio.ensure_future(controller.acquire('villages', ('villages', '乙')))
+        await asyncio.sleep(0)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert not controller.waiters
+        controller.release('villages', running)
+    asyncio.run(scenario())
+    assert controller.running_total == 0
+
+
+def test_busy_server_sheds_uncached_requests(client, main, monkeypatch):
+    monkeypatch.setattr(main, 'admission', main.AdmissionController(total_limit=1, route_limit=1, queue_max=0, max_wait=0.1))
+    held = main.admission.try_acquire('summary', ('summary',))
+    main.clear_response_cache()
+    try:
+        response = client.get('/api/summary')
+        assert response.status_code == 503
+        assert 'Retry-After' in response.headers
+    finally:
+        main.admission.release('summary', held)
+    assert client.get('/api/summary').status_code == 200
+
+
+def test_warmer_skips_items_without_free_slot(main, snapshot, controller, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, 'admission', controller)
+    warmer = main.CacheWarmer(tmp_path / 'popularity.json')
+    main.clear_response_cache()
+    held = [controller.try_acquire(route, (route,)) for route in ('villages', 'clinics')]
+    asyncio.run(warmer.run(snapshot))
+    assert warmer.status['state'] == 'done'
+    assert warmer.status['built'] == 0
+    assert warmer.status['busy'] == warmer.status['total']
+    assert len(main.response_cache) == 0
+    
+    controller.release('villages', held[0])
+    controller.release('clinics', held[1])
+    asyncio.run(warmer.run(snapshot))
+    assert warmer.status['built'] > 0
+    assert warmer.status['busy'] == 0
+    assert controller.running_total == 0
+    main.clear_response_cache()
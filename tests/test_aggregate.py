@@ -0,0 +1,73 @@
+"""任意範圍彙總（POST /api/aggregate）：人口與診所守恆、部分涵蓋的比例分配與錯誤處理"""
+
+import json
+import math
+
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import box, mapping
+
+
+def post(client, geometry):
+    return client.post('/api/aggregate', content=json.dumps(geometry))
+
+
+def test_covering_polygon_conserves_population_and_clinics(client, snapshot):
+    locator, indicators = snapshot.village_locator, snapshot.village_indicators
+    min_x, min_y, max_x, max_y = shapely.total_bounds(locator.geometries)
+    response = post(client, mapping(box(min_x - 0.1, min_y - 0.1, max_x + 0.1, max_y + 0.1)))
+    assert response.status_code == 200
+    data = response.json()
+    
+    village_ids = np.unique(locator.village_ids[locator.row_areas > 0])
+    assert data['village_count'] == data['fully_covered_villages'] == len(village_ids)
+    assert all(village['coverage'] == 1 for village in data['villages'])
+    populations = [indicators['population'][village_id] for village_id in village_ids.tolist()]
+    expected = sum(value for value in populations if value is not None and not math.isnan(value))
+    assert data['population'] == pytest.approx(expected, abs=0.1)
+    # 每個機構（名稱與地址）只計算一次
+    assert data['clinics']['total'] == len(np.unique(snapshot.clinic_index.clinic_keys))
+
+
+def test_partial_coverage_weights_population(client, snapshot):
+    locator, indicators = snapshot.village_locator, snapshot.village_indicators
+    row = int(np.argmax(locator.row_areas))
+    village_id = int(locator.village_ids[row])
+    min_x, min_y, max_x, max_y = locator.geometries[row].bounds
+    half = box(min_x - 0.01, min_y - 0.01, (min_x + max_x) / 2, max_y + 0.01)
+    same_village = locator.village_ids == village_id
+    fraction = shapely.area(shapely.intersection(locator.geometries[same_village], half)).sum() / locator.village_areas[village_id]
+    assert 0 < fraction < 1
+    
+    data = post(client, mapping(half)).json()
+    properties = locator.properties[row]
+    village = next(village for village in data['villages'] if (village['county'], village['district'], village['village'])
+                   == (properties['county'], properties['district'], properties['village']))
+    assert village['coverage'] == round(fraction, 4)
+    population = indicators['population'][village_id]
+    assert village['population'] == pytest.approx(population * fraction, abs=0.1)
+    assert data['fully_covered_villages'] < data['village_count']
+    assert data['population'] == pytest.approx(sum(village['population'] or 0 for village in data['villages']), abs=1)
+
+
+def test_polygon_without_villages(client):
+    """外海的範圍沒有相交的村里，返回空的彙總"""
+    response = post(client, mapping(box(123.5, 21.0, 124.0, 21.5)))
+    assert response.status_code == 200
+    data = response.json()
+    assert data['village_count'] == 0 and data['villages'] == []
+    assert data['population'] == 0 and data['median_income'] is None
+    assert data['clinics']['total'] == 0
+
+
+@pytest.mark.parametrize('body', [
+    'not json',
+    json.dumps({'type': 'Point', 'coordinates': [121.5, 25.0]}),
+    json.dumps({'type': 'FeatureCollection', 'features': []}),
+    json.dumps({'type': 'Polygon', 'coordinates': [[[121, 25], [121, 26]]]}),
+    json.dumps(mapping(box(300000, 2700000, 310000, 2710000))),  # 投影座標而非經緯度
+    json.dumps({'type': 'Polygon', 'coordinates': [[[121, 25], [121.1, 25], [121.2, 25], [121, 25]]]}),  # 面積為零
+])
+def test_invalid_geometry_is_rejected(client, body):
+    assert client.post('/api/aggregate', content=body).status_code == 400
@@ -0,0 +1,102 @@
+"""診所供需分數：半徑內診所數、全國百分位分數與每個半徑的快取"""
+
+import math
+
+import numpy as np
+import pytest
+
+
+def percentile_ranks(values):
+    """與 pandas rank(pct=True) 相同：同值取平均名次，除以有值的數量，NaN 維持 NaN"""
+    known = [value for value in values if not math.isnan(value)]
+    ranks = []
+    for value in values:
+        if math.isnan(value):
+            ranks.append(math.nan)
+            continue
+        below = sum(other < value for other in known)
+        equal = sum(other == value for other in known)
+        ranks.append((below + (equal + 1) / 2) / len(known))
+    return np.array(ranks)
+
+
+def reference_counts(snapshot, radius_km, specialty=None):
+    """逐個村里計算半徑內的診所數（每個機構以第一列的座標與科別計）"""
+    index = snapshot.clinic_index
+    _, first_rows = np.unique(index.clinic_keys, return_index=True)
+    if specialty is not None:
+        first_rows = first_rows[index.specialty_masks[specialty][first_rows]]
+    village_data = snapshot.village_data
+    x, y = index.transformer.transform(village_data['center_lon'].to_numpy(dtype=float),
+                                       village_data['center_lat'].to_numpy(dtype=float))
+    counts = []
+    for village_x, village_y in zip(np.asarray(x).tolist(), np.asarray(y).tolist()):
+        if not (math.isfinite(village_x) and math.isfinite(village_y)):
+            counts.append(0)
+            continue
+        distances = np.hypot(index.x[first_rows] - village_x, index.y[first_rows] - village_y)
+        counts.append(int((distances <= radius_km * 1000).sum()))
+    return np.array(counts)
+
+
+def cached_table(main, snapshot, radius_km):
+    """透過回應函式建立（或取得）該半徑的快取表"""
+    main.build_clinic_gaps_response(snapshot, snapshot.village_registry.counties[0], radius_km=radius_km)
+    return snapshot.clinic_gap_cache[radius_km]
+
+
+def test_clinic_counts_match_brute_force(main, snapshot):
+    gaps = cached_table(main, snapshot, 3)
+    np.testing.assert_array_equal(gaps['clinic_counts'][:, 0], reference_counts(snapshot, 3))
+    column = gaps['specialties'].index('兒科')
+    np.testing.assert_array_equal(gaps['clinic_counts'][:, column], reference_counts(snapshot, 3, '兒科'))
+
+
+@pytest.mark.parametrize('income_weight', [0.0, 0.3, 1.0])
+def test_ranking_matches_hand_computed_scores(client, snapshot, income_weight):
+    registry, indicators = snapshot.village_registry, snapshot.village_indicators
+    village_ids = registry.ids['village'].tolist()
+    population = np.array([math.nan if indicators['population'][i] is None else indicators['population'][i] for i in village_ids])
+    income = np.array([math.nan if indicators['median_income'][i] is None else indicators['median_income'][i] for i in village_ids])
+    counts = reference_counts(snapshot, 3)
+    supply_ranks = percentile_ranks((population / (counts + 1)).tolist())
+    income_ranks = percentile_ranks(income.tolist())
+    scores = 100 * (supply_ranks * (1 - income_weight) + (income_ranks * income_weight if income_weight > 0 else 0))
+    
+    county_name = snapshot.village_data['COUNTYNAME'].astype(str).value_counts().index[0]
+    county_rows = np.flatnonzero(snapshot.village_data['COUNTYNAME'].astype(str).to_numpy() == county_name)
+    candidates = [(row, scores[row]) for row in county_rows.tolist() if not math.isnan(scores[row])]
+    # 分數由高到低，同分時維持村里順序
+    expected = sorted(candidates, key=lambda item: -item[1])
+    
+    data = client.get(f'/api/clinic_gaps/{county_name}', params={'income_weight': income_weight, 'top_n': 500}).json()
+    assert data['village_count'] == len(expected)
+    assert [village['score'] for village in data['villages']] == [round(score, 2) for _, score in expected][:500]
+    village_names = snapshot.village_data['VILLNAME'].astype(str).to_numpy()
+    assert [village['village'] for village in data['villages']] == [village_names[row] for row, _ in expected][:500]
+    for village, (row, _) in zip(data['villages'], expected):
+        assert village['clinic_count'] == counts[row]
+        assert village['population_per_clinic'] == pytest.approx(population[row] / (counts[row] + 1))
+
+
+def test_each_radius_builds_and_caches_its_own_table(main, snapshot):
+    county_name = snapshot.village_registry.counties[0]
+    snapshot.clinic_gap_cache.pop(10, None)
+    default = cached_table(main, snapshot, 3)
+    response = main.build_clinic_gaps_response(snapshot, county_name, radius_km=10)
+    assert response['radius_km'] == 10
+    wide = snapshot.clinic_gap_cache[10]
+    assert wide is not default
+    np.testing.assert_array_equal(wide['clinic_counts'][:, 0], reference_counts(snapshot, 10))
+    assert (wide['clinic_counts'] >= default['clinic_counts']).all()
+    assert wide['pairs'] > default['pairs']
+    # 第二次查詢沿用快取，不重新計算
+    main.build_clinic_gaps_response(snapshot, county_name, specialty='兒科', radius_km=10, income_weight=0.5)
+    assert snapshot.clinic_gap_cache[10] is wide
+    assert snapshot.clinic_gap_cache[3] is default
+
+
+@pytest.mark.parametrize('params', [{'radius_km': 4}, {'income_weight': 1.5}, {'top_n': 0}, {'specialty': '不存在科'}])
+def test_invalid_parameters(client, snapshot, params):
+    county_name = snapshot.village_registry.counties[0]
+    assert client.get(f'/api/clinic_gaps/{county_name}', params=params).status_code == 400
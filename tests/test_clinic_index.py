@@ -0,0 +1,71 @@
+"""診所空間索引（STRtree）的半徑與最近 k 間查詢，與逐筆計算距離的結果相同"""
+
+import numpy as np
+import pytest
+import shapely
+
+
+def brute_force(index, lat, lon, radius_km=None, k=None, specialties=None):
+    """計算與每間診所的距離，依（距離、列位置）排序後每個機構只保留最近的一列"""
+    x, y = index.transformer.transform(lon, lat)
+    distances = np.hypot(index.x - x, index.y - y)
+    allowed = np.ones(len(index.x), dtype=bool)
+    if specialties:
+        allowed = np.zeros(len(index.x), dtype=bool)
+        for specialty in specialties:
+            allowed |= index.specialty_masks.get(specialty, False)
+    if radius_km is not None:
+        allowed &= distances <= radius_km * 1000
+    positions = np.flatnonzero(allowed)
+    positions = positions[np.lexsort((positions, distances[positions]))]
+    seen = set()
+    result = []
+    for position in positions.tolist():
+        if index.clinic_keys[position] not in seen:
+            seen.add(index.clinic_keys[position])
+            result.append(position)
+    result = result[:k] if k is not None else result
+    return np.array(result, dtype=np.intp), distances[result]
+
+
+@pytest.fixture
+def query_points(snapshot):
+    rng = np.random.default_rng(3)
+    clinics = snapshot.clinic_data.iloc[rng.choice(len(snapshot.clinic_data), 8, replace=False)]
+    points = [(lat + rng.normal(0, 0.02), lon + rng.normal(0, 0.02))
+              for lat, lon in zip(clinics['緯度'].tolist(), clinics['經度'].tolist())]
+    # 外海的點：半徑內沒有診所，最近的診所需要擴大搜尋範圍
+    return points + [(22.0, 122.5)]
+
+
+@pytest.mark.parametrize('radius_km, k', [(1, None), (5, None), (20, None), (None, 1), (None, 10), (3, 10), (50, 200)])
+@pytest.mark.parametrize('specialties', [None, ('兒科',), ('內科', '眼科')])
+def test_query_matches_brute_force(snapshot, query_points, radius_km, k, specialties):
+    index = snapshot.clinic_index
+    for lat, lon in query_points:
+        positions, distances = index.query(lat, lon, radius_km, k, set(specialties) if specialties else None)
+        expected_positions, expected_distances = brute_force(index, lat, lon, radius_km, k, specialties)
+        np.testing.assert_array_equal(positions, expected_positions)
+        np.testing.assert_allclose(distances, expected_distances)
+
+
+def test_within_matches_brute_force(snapshot, query_points):
+    index = snapshot.clinic_index
+    points = shapely.points(index.x, index.y)
+    for lat, lon in query_points[:4]:
+        x, y = index.transformer.transform(lon, lat)
+        polygon = shapely.Point(x, y).buffer(3000)
+        inside = np.flatnonzero(shapely.intersects(polygon, points))
+        _, first = np.unique(index.clinic_keys[inside], return_index=True)
+        np.testing.assert_array_equal(index.within(polygon), np.sort(inside[first]))
+
+
+def test_near_endpoint(client, snapshot, query_points):
+    lat, lon = query_points[0]
+    response = client.get('/api/clinics/near', params={'lat': lat, 'lon': lon, 'k': 15, 'specialties': '兒科'})
+    assert response.status_code == 200
+    features = response.json()['features']
+    positions, distances = brute_force(snapshot.clinic_index, lat, lon, k=15, specialties=('兒科',))
+    assert [feature['properties']['distance_km'] for feature in features] == [round(d / 1000, 3) for d in distances.tolist()]
+    assert all('兒科' in feature['properties']['specialties'] for feature in features)
+    assert client.get('/api/clinics/near', params={'lat': lat, 'lon': lon}).status_code == 400
@@ -0,0 +1,68 @@
+"""管理與除錯端點：權限檢查與單一請求的取樣分析"""
+
+import statistics
+import time
+
+import pytest
+
+
+def test_memory_report_disabled_without_admin_token(client, main, monkeypatch):
+    monkeypatch.setattr(main, 'ADMIN_TOKEN', None)
+    assert client.get('/api/debug/memory').status_code == 404
+
+
+def test_memory_report_rejects_wrong_token(client, admin_token):
+    assert client.get('/api/debug/memory').status_code == 403
+    assert client.get('/api/debug/memory', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+
+
+def test_memory_report(client, snapshot, admin_token):
+    response = client.get('/api/debug/memory', headers={'X-Admin-Token': admin_token})
+    assert response.status_code == 200
+    report = response.json()
+    assert report['snapshot_version'] == snapshot.version
+    assert report['datasets']['village_data']['rows'] == len(snapshot.village_data)
+    assert report['total_bytes'] == sum(dataset['bytes'] for dataset in report['datasets'].values())
+
+
+PROFILED_URL = '/api/summary'
+
+
+@pytest.mark.parametrize('configured', [False, True])
+def test_profile_flag_ignored_without_valid_token(client, main, monkeypatch, configured):
+    monkeypatch.setattr(main, 'ADMIN_TOKEN', 'test-token' if configured else None)
+    expected = client.get(PROFILED_URL).content
+    for headers in ({'X-Profile': '1'}, {'X-Profile': '1', 'X-Admin-Token': 'wrong'}):
+        response = client.get(PROFILED_URL, headers=headers)
+        assert response.status_code == 200
+        assert 'X-Profile-Id' not in response.headers
+        assert response.content == expected
+
+
+def test_profile_sample_rate(client, main, monkeypatch, admin_token):
+    headers = {'X-Profile': '1', 'X-Admin-Token': admin_token}
+    monkeypatch.setattr(main, 'PROFILE_SAMPLE_RATE', 0.0)
+    assert 'X-Profile-Id' not in client.get(PROFILED_URL, headers=headers).headers
+    monkeypatch.setattr(main, 'PROFILE_SAMPLE_RATE', 1.0)
+    profile_id = int(client.get(PROFILED_URL, headers=headers).headers['X-Profile-Id'])
+    assert any(profile.id == profile_id for profile in main.profile_records)
+
+
+def test_profiler_overhead(client, main, monkeypatch, admin_token):
+    """最短取樣間隔下，取樣分析不改變回應內容，額外耗時也在合理範圍內"""
+    monkeypatch.setattr(main, 'PROFILE_SAMPLE_RATE', 1.0)
+    headers = {'X-Profile': '1', 'X-Profile-Interval-Ms': '1', 'X-Admin-Token': admin_token}
+    plain, profiled = [], []
+    for _ in range(5):
+        main.clear_response_cache()
+        started = time.perf_counter()
+        expected = client.get(PROFILED_URL).content
+        plain.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        response = client.get(PROFILED_URL, headers=headers)
+        profiled.append(time.perf_counter() - started)
+        assert response.content == expected
+        profile = next(profile for profile in main.profile_records if profile.id == int(response.headers['X-Profile-Id']))
+        # 取樣次數不會超過建置期間可容納的間隔數
+        assert profile.samples <= profile.build_duration / profile.interval + 1
+    assert statistics.median(profiled) < statistics.median(plain) * 2 + 0.05
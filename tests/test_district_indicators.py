@@ -0,0 +1,90 @@
+"""鄉鎮市區指標：人口加權薪資、總人口、人口密度與診所數"""
+
+import math
+
+import pytest
+
+
+def reference_indicators(snapshot):
+    """逐個村里累加（與向量化的 build_district_indicators 分開實作）"""
+    registry, indicators = snapshot.village_registry, snapshot.village_indicators
+    district_data = snapshot.district_data
+    rows = {(registry.county_id(county), registry.town_id(town)): row
+            for row, (county, town) in enumerate(zip(district_data['COUNTYNAME'], district_data['TOWNNAME']))}
+    totals = [{'population': 0.0, 'villages': 0, 'income_sum': 0.0, 'weight_sum': 0.0, 'clinics': set()}
+              for _ in range(len(district_data))]
+    for village_id in sorted(set(registry.ids['village'].tolist())):
+        row = rows.get((int(registry.county_of[village_id]), int(registry.town_of[village_id])))
+        population = indicators['population'][village_id]
+        income = indicators['median_income'][village_id]
+        if row is None or population is None or math.isnan(population):
+            continue
+        totals[row]['population'] += population
+        totals[row]['villages'] += 1
+        if income is not None and not math.isnan(income):
+            totals[row]['income_sum'] += income * population
+            totals[row]['weight_sum'] += population
+    clinic_county_ids, clinic_town_ids = registry.region_ids['clinic']
+    for county_id, town_id, clinic_key in zip(clinic_county_ids.tolist(), clinic_town_ids.tolist(),
+                                              snapshot.clinic_index.clinic_keys.tolist()):
+        row = rows.get((county_id, town_id))
+        if row is not None:
+            totals[row]['clinics'].add(clinic_key)
+    return totals
+
+
+def test_district_indicators_match_reference(snapshot):
+    district = snapshot.district_indicators
+    area_km2 = snapshot.district_data['area_km2'].tolist()
+    checked_income = 0
+    for row, total in enumerate(reference_indicators(snapshot)):
+        if total['weight_sum'] > 0:
+            assert district['median_income'][row] == pytest.approx(total['income_sum'] / total['weight_sum'], rel=1e-12)
+            checked_income += 1
+        else:
+            assert district['median_income'][row] is None
+        if total['villages']:
+            assert district['population'][row] == round(total['population'])
+            assert district['population_density'][row] == pytest.approx(total['population'] / area_km2[row], rel=1e-12)
+        else:
+            assert district['population'][row] is None and district['population_density'][row] is None
+        assert district['clinic_count'][row] == len(total['clinics'])
+    assert checked_income > 0
+
+
+def test_weighted_income_differs_from_plain_mean(snapshot):
+    """加權平均應落在村里薪資的最小值與最大值之間，且人口不同時不等於簡單平均"""
+    registry, indicators = snapshot.village_registry, snapshot.village_indicators
+    district = snapshot.district_indicators
+    district_rows = {(registry.county_id(county), registry.town_id(town)): row for row, (county, town) in
+                     enumerate(zip(snapshot.district_data['COUNTYNAME'], snapshot.district_data['TOWNNAME']))}
+    incomes = {}
+    for village_id in set(registry.ids['village'].tolist()):
+        income, population = indicators['median_income'][village_id], indicators['population'][village_id]
+        if income is None or population is None or math.isnan(income) or math.isnan(population):
+            continue
+        row = district_rows.get((int(registry.county_of[village_id]), int(registry.town_of[village_id])))
+        incomes.setdefault(row, []).append((income, population))
+    differs = 0
+    for row, values in incomes.items():
+        if row is None:
+            continue
+        weighted = district['median_income'][row]
+        assert min(income for income, _ in values) - 1e-9 <= weighted <= max(income for income, _ in values) + 1e-9
+        plain = sum(income for income, _ in values) / len(values)
+        differs += not math.isclose(weighted, plain)
+    assert differs > 0
+
+
+def test_districts_response_uses_indicators(client, snapshot):
+    district = snapshot.district_indicators
+    names = snapshot.district_data[['COUNTYNAME', 'TOWNNAME']].astype(str).to_records(index=False).tolist()
+    county_name = names[0][0]
+    features = client.get(f'/api/districts/{county_name}').json()['features']
+    rows = {name: row for row, name in enumerate(names)}
+    assert len(features) == sum(county == county_name for county, _ in names)
+    for feature in features:
+        properties = feature['properties']
+        row = rows[(properties['county'], properties['name'])]
+        for field in ('median_income', 'population', 'population_density', 'clinic_count'):
+            assert properties[field] == district[field][row], field
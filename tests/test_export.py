@@ -0,0 +1,65 @@
+"""村里資料匯出（/api/export）：各格式分段串流後以 pandas / geopandas 讀回"""
+
+import io
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+
+@pytest.fixture
+def small_chunks(main, monkeypatch):
+    """縮小分段列數，讓測試資料也會分成多段（多個 row group / 多次附加）"""
+    monkeypatch.setattr(main, 'EXPORT_CHUNK_ROWS', 37)
+
+
+def read_export(content, format, tmp_path):
+    if format == 'csv':
+        return pd.read_csv(io.BytesIO(content), encoding='utf-8-sig')
+    if format == 'parquet':
+        return pd.read_parquet(io.BytesIO(content))
+    file_path = tmp_path / 'villages.gpkg'
+    file_path.write_bytes(content)
+    return gpd.read_file(file_path, layer='villages')
+
+
+@pytest.mark.parametrize('county_name', [None, '臺北市'])
+@pytest.mark.parametrize('format', ['csv', 'parquet', 'gpkg'])
+def test_export_round_trip(client, main, snapshot, small_chunks, tmp_path, format, county_name):
+    positions, table = main.build_export_table(snapshot, county_name)
+    response = client.get('/api/export', params={'format': format, 'county_name': county_name})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith(main.EXPORT_FORMATS[format][0].split(';')[0])
+    
+    exported = read_export(response.content, format, tmp_path)
+    columns = list(table.columns) + (['geometry'] if format == 'gpkg' else [])
+    assert list(exported.columns) == columns
+    assert len(exported) == len(positions) == len(table)
+    assert exported['village'].tolist() == table['village'].tolist()
+    np.testing.assert_array_equal(exported['clinic_count'].to_numpy(), table['clinic_count'].to_numpy())
+    np.testing.assert_allclose(exported['population'].astype(float).to_numpy(),
+                               table['population'].astype(float).to_numpy())
+    if county_name:
+        assert set(exported['county']) == {county_name}
+
+
+@pytest.mark.parametrize('format', ['csv', 'parquet'])
+def test_export_with_geometry(client, main, snapshot, small_chunks, tmp_path, format):
+    positions, table = main.build_export_table(snapshot, '臺北市')
+    response = client.get('/api/export', params={'format': format, 'county_name': '臺北市', 'geometry': 'true'})
+    exported = read_export(response.content, format, tmp_path)
+    assert list(exported.columns) == list(table.columns) + ['geometry']
+    assert len(exported) == len(positions)
+    if format == 'csv':
+        geometries = shapely.from_wkt(exported['geometry'].to_numpy())
+    else:
+        geometries = gpd.read_parquet(io.BytesIO(response.content)).geometry.values
+    expected = np.asarray(snapshot.village_data.geometry.values[positions])
+    assert shapely.equals_exact(geometries, expected, tolerance=1e-6).all()
+
+
+def test_export_unknown_format_or_county(client):
+    assert client.get('/api/export', params={'format': 'xlsx'}).status_code == 400
+    assert client.get('/api/export', params={'county_name': '不存在縣'}).status_code == 404
@@ -0,0 +1,47 @@
+"""幾何前處理：行程池（依縣市分區）與目前行程（單一分區）的結果必須相同"""
+
+import json
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+
+@pytest.fixture(scope='module')
+def raw_villages(main):
+    """與 load_village_geometry 相同方式讀入、尚未整理的村里界"""
+    with open(main.VILLAGE_GEOJSON_PATH, 'r', encoding='utf-8') as f:
+        village_gdf = gpd.GeoDataFrame.from_features(json.load(f)['features'])
+    return village_gdf.set_crs(epsg=4326, allow_override=True)
+
+
+def preprocess(main, monkeypatch, village_gdf, workers):
+    monkeypatch.setattr(main, 'GEOMETRY_WORKERS', workers)
+    monkeypatch.setattr(main, 'GEOMETRY_POOL_MIN_VERTICES', 0)
+    group_ids = village_gdf.groupby(main.DISTRICT_KEYS, sort=True, observed=True).ngroup().to_numpy()
+    return main.preprocess_geometries(village_gdf.geometry, village_gdf['COUNTYNAME'], '村里',
+                                      with_area=True, group_ids=group_ids)
+
+
+def test_pooled_matches_serial(main, monkeypatch, capsys, raw_villages):
+    serial = preprocess(main, monkeypatch, raw_villages, 1)
+    assert '個行程' not in capsys.readouterr().out
+    pooled = preprocess(main, monkeypatch, raw_villages, 2)
+    assert '2 個行程' in capsys.readouterr().out
+    
+    assert pooled['geometry'].index.equals(serial['geometry'].index)
+    assert shapely.to_wkb(pooled['geometry'].values).tolist() == shapely.to_wkb(serial['geometry'].values).tolist()
+    for key in ('center_lat', 'center_lon', 'area_km2'):
+        np.testing.assert_array_equal(pooled[key], serial[key])
+    
+    assert shapely.to_wkb(pooled['groups']['geometry']).tolist() == shapely.to_wkb(serial['groups']['geometry']).tolist()
+    for key in ('center_lat', 'center_lon'):
+        np.testing.assert_array_equal(pooled['groups'][key], serial['groups'][key])
+    np.testing.assert_array_equal(pooled['groups']['stats'], serial['groups']['stats'])
+
+
+def test_serial_matches_loaded_snapshot(main, monkeypatch, snapshot, raw_villages):
+    serial = preprocess(main, monkeypatch, raw_villages, 1)
+    loaded = np.asarray(snapshot.village_data.geometry.values)
+    assert shapely.to_wkb(serial['geometry'].values).tolist() == shapely.to_wkb(loaded).tolist()
@@ -0,0 +1,61 @@
+"""六角形網格：向量化裁切的交集面積，以及人口與面積的守恆"""
+
+import math
+
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import MultiPolygon, Polygon, box
+
+
+WIDTH = 1000.0
+
+
+def hexagon_centers():
+    row_height = WIDTH * math.sqrt(3) / 2
+    rows, columns = np.meshgrid(np.arange(-3, 4), np.arange(-3, 4), indexing='ij')
+    return ((columns + (rows % 2) * 0.5) * WIDTH).ravel(), (rows * row_height).ravel()
+
+
+def test_hexagon_area(main):
+    centers_x, centers_y = hexagon_centers()
+    cells = shapely.polygons(main._hexagon_vertices(centers_x, centers_y, WIDTH))
+    np.testing.assert_allclose(shapely.area(cells), WIDTH * WIDTH * math.sqrt(3) / 2)
+    # 相鄰網格不重疊也沒有縫隙
+    assert shapely.union_all(cells).area == pytest.approx(shapely.area(cells).sum())
+
+
+@pytest.mark.parametrize('geometry', [
+    box(-1800, -1200, 2100, 900),  # 跨越多個網格
+    box(-100, -100, 100, 100),  # 完全在單一網格內
+    box(-5000, -5000, 5000, 5000),  # 包住整個網格範圍
+    Polygon([(2100, 900), (-1800, 900), (-1800, -1200), (2100, -1200)]),  # 順時針
+    Polygon([(-2500, -2000), (2500, -2000), (2500, 2000), (-2500, 2000)],
+            [[(-1200, -800), (-1200, 1300), (900, 1300), (900, -800)]]),  # 有洞
+    MultiPolygon([box(-2600, -2600, -400, 200), box(300, -300, 2700, 2100)]),
+    Polygon([(0, -2300), (2200, 0), (0, 2300), (-2200, 0)]).buffer(300),  # 斜邊與曲線
+])
+def test_clip_areas_match_shapely_intersection(main, geometry):
+    centers_x, centers_y = hexagon_centers()
+    cells = shapely.polygons(main._hexagon_vertices(centers_x, centers_y, WIDTH))
+    geometry_hits, cell_hits = shapely.STRtree(cells).query(np.array([geometry]), predicate='intersects')
+    areas = main._hexagon_clip_areas(np.array([geometry]), geometry_hits, centers_x[cell_hits], centers_y[cell_hits], WIDTH)
+    expected = shapely.area(shapely.intersection(geometry, cells[cell_hits]))
+    np.testing.assert_allclose(areas, expected, rtol=1e-9, atol=1e-6)
+    if geometry.within(shapely.union_all(cells)):
+        assert areas.sum() == pytest.approx(geometry.area)
+
+
+def test_grid_conserves_land_area_and_population(main, snapshot):
+    grid = main.get_hex_grid(snapshot, main.HEX_DEFAULT_CELL_KM)
+    index, locator = snapshot.clinic_index, snapshot.village_locator
+    villages = shapely.transform(locator.geometries, lambda xy: np.column_stack(index.transformer.transform(xy[:, 0], xy[:, 1])))
+    assert grid['land_km2'].sum() == pytest.approx(shapely.area(villages).sum() / 1e6, rel=1e-9)
+    
+    # 有人口且有面積的村里，人口全部分配到網格
+    registry = snapshot.village_registry
+    population = main._indicator_array(snapshot.village_indicators['population'])
+    village_ids = np.unique(registry.ids['village'][shapely.area(villages) > 0])
+    expected = np.nansum(population[village_ids])
+    assert np.nansum(grid['population']) == pytest.approx(expected, rel=1e-9)
+    np.testing.assert_allclose(grid['population_density'], grid['population'] / grid['cell_area_km2'])
@@ -0,0 +1,68 @@
+"""健保與勞保投保金額級距與保費"""
+
+import pytest
+
+
+def reference_lookup(table, salary):
+    """逐筆比對：不低於月薪的最低級距，超過最高級距時以最高級距計"""
+    rows = table.to_dict('records')
+    row = next((row for row in rows if row['base_salary'] >= salary), rows[-1])
+    return row
+
+
+def boundary_salaries(snapshot):
+    salaries = {0.0, 1.0, 10_000_000.0}
+    for table in snapshot.insurance_brackets.values():
+        for base_salary in table['base_salary'].tolist()[::7] + table['base_salary'].tolist()[-2:]:
+            salaries.update({base_salary - 1, base_salary - 0.5, float(base_salary), base_salary + 0.5, base_salary + 1})
+    return sorted(salary for salary in salaries if salary >= 0)
+
+
+@pytest.mark.parametrize('dependents', [0, 1, 3])
+def test_lookup_matches_bracket_definition(main, snapshot, dependents):
+    salaries = boundary_salaries(snapshot)
+    costs = main.lookup_insurance(snapshot.insurance_brackets, salaries, dependents)
+    for scheme, table in snapshot.insurance_brackets.items():
+        columns = dict(main.INSURANCE_COST_COLUMNS[scheme])
+        if scheme == 'nhi':
+            columns['employee'] = [f'fee{dependents + 1}']
+        for index, salary in enumerate(salaries):
+            row = reference_lookup(table, salary)
+            assert costs[scheme]['level'][index] == row['level']
+            assert costs[scheme]['insured_salary'][index] == row['base_salary']
+            for role, names in columns.items():
+                assert costs[scheme][role][index] == sum(row[name] for name in names), (scheme, salary, role)
+
+
+def test_single_and_batch_queries_agree(client, snapshot):
+    salaries = boundary_salaries(snapshot)[::5]
+    batch = client.post('/api/insurance', json={'salaries': salaries, 'dependents': 2})
+    assert batch.status_code == 200
+    results = batch.json()['results']
+    assert [result['salary'] for result in results] == salaries
+    for salary, result in zip(salaries[:10], results):
+        single = client.get('/api/insurance', params={'salary': salary, 'dependents': 2}).json()['results'][0]
+        assert single == result
+        for role in ('employee', 'employer', 'government'):
+            assert result['total'][role] == result['nhi'][role] + result['bli'][role]
+
+
+@pytest.mark.parametrize('body', [{'salaries': [-1]}, {'salaries': [1000], 'dependents': 4}, {'salary': 1000},
+                                  {'salaries': [0] * 10001}])
+def test_batch_rejects_invalid_input(client, body):
+    assert client.post('/api/insurance', json=body).status_code == 400
+
+
+def test_village_insurance_uses_monthly_income(main, client, snapshot):
+    data = client.get('/api/insurance/villages', params={'metric': 'average'}).json()
+    assert data['village_count'] == len(data['villages'])
+    assert data['matched'] == sum(village['insurance'] is not None for village in data['villages'])
+    checked = [village for village in data['villages'] if village['insurance'] is not None][:50]
+    assert checked
+    monthly = [village['income'] * main.ANNUAL_INCOME_TO_MONTHLY for village in checked]
+    costs = main.lookup_insurance(snapshot.insurance_brackets, monthly)
+    for index, village in enumerate(checked):
+        assert village['monthly_salary'] == round(monthly[index])
+        assert village['insurance']['nhi']['insured_salary'] == costs['nhi']['insured_salary'][index]
+        assert village['insurance']['bli']['employee'] == costs['bli']['employee'][index]
+    assert all(village['monthly_salary'] is None for village in data['villages'] if village['insurance'] is None)
@@ -0,0 +1,57 @@
+import math
+
+import numpy as np
+import pytest
+
+
+def test_growth_metrics_match_definitions(main, snapshot):
+    matrix = snapshot.salary_matrix
+    growth = main.compute_salary_growth(matrix, 2011, 2021)['median']
+    start = matrix['matrices']['median'][:, 0]
+    end = matrix['matrices']['median'][:, list(matrix['years']).index(2021)]
+    valid = (start > 0) & (end > 0)
+    assert valid.any()
+    np.testing.assert_allclose(growth['abs_change'], end - start)
+    np.testing.assert_allclose(growth['pct_change'][valid], (end[valid] - start[valid]) / start[valid] * 100)
+    np.testing.assert_allclose(growth['cagr'][valid], ((end[valid] / start[valid]) ** 0.1 - 1) * 100)
+    assert np.isnan(growth['cagr'][~valid]).all()
+
+
+def test_growth_ranking_is_sorted(client):
+    response = client.get('/api/salary_growth', params={'rank_by': 'cagr', 'top_n': 20})
+    assert response.status_code == 200
+    body = response.json()
+    top = [record['cagr'] for record in body['top']]
+    bottom = [record['cagr'] for record in body['bottom']]
+    assert top == sorted(top, reverse=True)
+    assert bottom == sorted(bottom)
+    assert top[0] >= bottom[-1]
+
+
+@pytest.mark.parametrize('start_value', [0.0, np.nan])
+def test_growth_with_zero_or_missing_start_year(main, client, snapshot, start_value):
+    matrix = snapshot.salary_matrix['matrices']['median']
+    original = matrix[:, 0].copy()
+    matrix[:5, 0] = start_value
+    snapshot.salary_growth_cache.clear()
+    main.clear_response_cache()
+    try:
+        response = client.get('/api/salary_growth', params={'rank_by': 'abs_change', 'top_n': 500})
+        assert response.status_code == 200
+        records = response.json()['top'] + response.json()['bottom']
+        for record in records:
+            for field in ('start_value', 'end_value', 'abs_change', 'pct_change', 'cagr'):
+                assert record[field] is None or math.isfinite(record[field])
+        if start_value == 0:
+            # 起始值為 0 的村里仍依絕對變化排名，但沒有百分比變化與 CAGR
+            zero_start = [record for record in records if record['start_value'] == 0]
+            assert zero_start
+            assert all(record['pct_change'] is None and record['cagr'] is None for record in zero_start)
+        else:
+            # 缺少起始年份的村里不列入排名
+            assert all(record['start_value'] is not None for record in records)
+            assert response.json()['village_count'] == len(snapshot.salary_matrix['villages']) - 5
+    finally:
+        matrix[:, 0] = original
+        snapshot.salary_growth_cache.clear()
+        main.clear_response_cache()
@@ -0,0 +1,77 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+
+@pytest.fixture(scope='module')
+def shared_dir(main, tmp_path_factory):
+    snapshot = main.current_snapshot()
+    target_dir = tmp_path_factory.mktemp('shared') / 'snapshot'
+    main.export_shared_data(snapshot, target_dir)
+    with open(target_dir / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump({'dataset_signatures': snapshot.signatures}, f)
+    return target_dir
+
+
+@pytest.fixture(scope='module', params=['worker', 'builder'])
+def attached(main, shared_dir, request):
+    built = main.current_snapshot() if request.param == 'builder' else None
+    return main.attach_shared_data(shared_dir, built)
+
+
+def render(main, builder, *args):
+    return main.JSONResponse(builder(*args)).body
+
+
+def test_geometries_round_trip(snapshot, attached):
+    for field in ('county_data', 'village_data', 'district_data'):
+        original = np.asarray(getattr(snapshot, field).geometry.values)
+        restored = np.asarray(getattr(attached, field).geometry.values)
+        assert shapely.get_type_id(restored).tolist() == shapely.get_type_id(original).tolist()
+        assert shapely.equals_exact(restored, original, tolerance=0).all()
+
+
+def test_derived_indexes_are_memory_mapped(attached):
+    # 陣列來自唯讀映射，不是每個 worker 各自的複本
+    assert not attached.village_registry.ids['village'].flags.writeable
+    assert not attached.search_index.labels.flags.writeable
+    assert not attached.clinic_index.x.flags.writeable
+
+
+def test_derived_indexes_match_processed_snapshot(snapshot, attached):
+    registry, restored = snapshot.village_registry, attached.village_registry
+    assert restored.keys == registry.keys
+    assert restored.match_rates == registry.match_rates
+    for name in registry.ids:
+        np.testing.assert_array_equal(restored.ids[name], registry.ids[name])
+    for name, values in snapshot.village_indicators.items():
+        assert attached.village_indicators[name] == values
+        assert [type(value) for value in attached.village_indicators[name]] == [type(value) for value in values]
+    for name, values in snapshot.district_indicators.items():
+        assert np.array_equal(attached.district_indicators[name], values) if name == 'county_ids' else attached.district_indicators[name] == values
+    for name in ('income', 'density', 'clinics'):
+        pd.testing.assert_frame_equal(attached.summary_tables[name], snapshot.summary_tables[name])
+    assert list(attached.clinic_index.specialty_masks) == list(snapshot.clinic_index.specialty_masks)
+
+
+@pytest.mark.parametrize('query,kind', [('臺北', 'all'), ('台北 第2', 'village'), ('診所', 'clinic'), ('第', 'all'), ('1', 'all')])
+def test_search_matches_processed_snapshot(snapshot, attached, query, kind):
+    assert attached.search_index.search(query, kind, 50) == snapshot.search_index.search(query, kind, 50)
+
+
+def test_responses_match_processed_snapshot(main, snapshot, attached):
+    county = str(snapshot.village_data['COUNTYNAME'].iloc[0])
+    for builder, args in [(main.build_villages_response, (county,)), (main.build_districts_response, (county,)),
+                          (main.build_clinic_gaps_response, (county,)), (main.build_summary_response, (county,)),
+                          (main.build_counties_response, ())]:
+        assert render(main, builder, attached, *args) == render(main, builder, snapshot, *args), builder.__name__
+
+    # 診所科別來自集合，順序不固定
+    def clinics(data):
+        features = main.build_clinics_response(data, county)['features']
+        return [dict(feature, properties=dict(feature['properties'], specialties=sorted(feature['properties']['specialties'])))
+                for feature in features]
+    assert clinics(attached) == clinics(snapshot)
@@ -0,0 +1,57 @@
+"""靜態診所檔（build_static.py）經前端篩選後，與 /api/clinics 的結果相同"""
+
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def filter_static(features, selected):
+    """與 frontend/script.js updateClinicMarkers 相同：先依科別篩選，再依機構名稱和地址去重"""
+    seen = set()
+    result = []
+    for feature in features:
+        if not selected.intersection(feature['properties']['specialties']):
+            continue
+        key = json.dumps([feature['properties']['name'], feature['properties']['address']])
+        if key not in seen:
+            seen.add(key)
+            result.append(feature)
+    return result
+
+
+@pytest.fixture
+def duplicated_clinics():
+    """同一診所（名稱與地址相同）以不同科別登記多次"""
+    clinic_data = pd.DataFrame({
+        '機構名稱': ['甲診所', '甲診所', '乙診所', '乙診所', '丙診所'],
+        '地址': ['一路1號', '一路1號', '二路2號', '二路2號', '三路3號'],
+        '科別': ['內科', '小兒科', '內科,小兒科', '內科', ''],
+        '標準科別': [{'內科'}, {'兒科'}, {'內科', '兒科'}, {'內科'}, set()],
+        '經度': [121.0, 121.0, 121.1, 121.1, 121.2],
+        '緯度': [25.0, 25.0, 25.1, 25.1, 25.2],
+    })
+    registry = SimpleNamespace(region_ids={'clinic': (np.zeros(len(clinic_data), dtype=np.int32), None)},
+                               county_id=lambda county_name: 0)
+    return SimpleNamespace(clinic_data=clinic_data, village_registry=registry)
+
+
+@pytest.mark.parametrize('specialties', ['兒科', '內科', '內科,兒科'])
+def test_static_filter_matches_api_with_duplicates(main, duplicated_clinics, specialties):
+    static = main.build_clinics_response(duplicated_clinics, '測試縣', None, False)['features']
+    api = main.build_clinics_response(duplicated_clinics, '測試縣', specialties)['features']
+    assert filter_static(static, set(specialties.split(','))) == api
+    # 同一診所只標記一次
+    assert len({feature['properties']['name'] for feature in api}) == len(api)
+
+
+def test_static_filter_matches_api(main, snapshot, client):
+    specialty_names = [specialty['name'] for specialty in client.get('/api/clinic_specialties').json()['specialties']]
+    counties = sorted(str(name) for name in snapshot.village_data['COUNTYNAME'].unique())
+    for county_name in counties:
+        static = json.loads(main.JSONResponse(main.build_clinics_response(snapshot, county_name, None, False)).body)
+        for selected in (specialty_names[:1], specialty_names[1:3]):
+            response = client.get(f'/api/clinics/{county_name}', params={'specialties': ','.join(selected)})
+            assert filter_static(static['features'], set(selected)) == response.json()['features']
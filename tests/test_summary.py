@@ -0,0 +1,23 @@
+"""統計摘要（/api/summary）的縣市名稱對應"""
+
+import pytest
+
+
+def test_county_name_variants_resolve_to_same_scope(client):
+    canonical = client.get('/api/summary', params={'county_name': '臺北市'})
+    assert canonical.status_code == 200
+    assert canonical.json()['scope'] == '臺北市'
+    variant = client.get('/api/summary', params={'county_name': '台北市', 'year': canonical.json()['year']})
+    assert variant.status_code == 200
+    assert variant.json() == canonical.json()
+
+
+@pytest.mark.parametrize('county_name', ['不存在縣', '臺北'])
+def test_unknown_county_is_not_found(client, county_name):
+    assert client.get('/api/summary', params={'county_name': county_name}).status_code == 404
+
+
+def test_national_summary_lists_counties(client, snapshot):
+    data = client.get('/api/summary').json()
+    assert data['scope'] == '全台'
+    assert {county['county'] for county in data['counties']} == set(snapshot.summary_tables['scopes'][:-1])